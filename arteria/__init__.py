@@ -1,3 +1,3 @@
 __version__ = "1.1.4"
 
-from .decorators import undocumented
+from .decorators import undocumented, cached, offload
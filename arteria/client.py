@@ -0,0 +1,306 @@
+import json
+import logging
+import random
+import time
+
+import tornado.httpclient
+from tornado import gen
+from tornado.httputil import url_concat
+
+from arteria.exceptions import ArteriaUsageException
+from arteria.web.state import terminal_states
+
+
+class CircuitBreaker(object):
+    """
+    Stops calls to a service that keeps failing, so that callers fail fast instead of
+    piling up on it. After failure_threshold consecutive failures the circuit opens and
+    calls are refused for reset_timeout seconds. Then one trial call is let through,
+    closing the circuit if it succeeds and opening it again if it fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return CircuitBreaker.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return CircuitBreaker.HALF_OPEN
+        return CircuitBreaker.OPEN
+
+    def allow(self):
+        """Returns True if a call may be made"""
+        state = self.state
+        if state == CircuitBreaker.CLOSED:
+            return True
+        if state == CircuitBreaker.HALF_OPEN and not self._trial_in_progress:
+            self._trial_in_progress = True
+            return True
+        return False
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._trial_in_progress or self._failures >= self.failure_threshold:
+            self._opened_at = self._clock()
+        self._trial_in_progress = False
+
+    def record_error(self):
+        """
+        Records a call that ended with an unexpected error, as neither a success nor a
+        failure, but so that another trial call can be let through if it was the trial
+        """
+        self._trial_in_progress = False
+
+
+class ArteriaClient(object):
+    """
+    An asynchronous client for the REST API of another Arteria service
+
+    Requests and responses are JSON, as written by BaseRestHandler. Failed requests are
+    retried with exponential backoff and full jitter, waiting as long as the Retry-After
+    header says if there is one. Requests that aren't idempotent, i.e. POST, are only
+    retried when the service rejected them without handling them (429 or 503).
+    A CircuitBreaker makes calls fail fast while the service is down.
+
+    Connections are only kept alive and pooled when pycurl is installed, e.g. with
+    pip install arteria[client], since tornado then uses curl. Without it, every request
+    opens a new connection. Must be used on the IOLoop thread.
+
+    Usage example:
+        client = ArteriaClient("http://demultiplexing:10900/api/1.0")
+        job = yield client.post("/jobs", {"runfolder": path})
+        job = yield client.wait_for_state("/jobs/{0}".format(job["id"]),
+                                          events_path="/events", entity_id=job["id"])
+    """
+
+    # Responses that are worth retrying
+    RETRY_STATUSES = frozenset([429, 502, 503, 504, 599])
+    # Responses retried for requests that aren't idempotent: the request was not handled
+    REJECTED_STATUSES = frozenset([429, 503])
+    IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"])
+
+    def __init__(self, base_url, request_timeout=30, connect_timeout=10, max_retries=3,
+                 backoff=0.5, max_backoff=30, max_clients=10, circuit_breaker=None,
+                 headers=None, logger=None):
+        """
+        :param base_url: The url that paths are relative to, e.g. http://localhost:10000/api/1.0
+        :param request_timeout: The default timeout of a request, in seconds
+        :param max_retries: The number of times a failed request is retried
+        :param backoff: The base of the exponential backoff between retries, in seconds
+        :param max_backoff: The longest backoff between retries, in seconds
+        :param max_clients: The maximum number of concurrent requests
+        :param circuit_breaker: A CircuitBreaker, by default one with its default settings.
+                                Share one between clients of the same service.
+        """
+        self._logger = logger or logging.getLogger(__name__)
+        self.base_url = base_url.rstrip("/")
+        self._request_timeout = request_timeout
+        self._connect_timeout = connect_timeout
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._max_clients = max_clients
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self._headers = dict(headers or {})
+        self._http_client = None
+
+    @property
+    def http_client(self):
+        # Created on first use, since it is bound to the IOLoop that is current then
+        if self._http_client is None:
+            try:
+                from tornado.curl_httpclient import CurlAsyncHTTPClient as client_class
+            except ImportError:
+                client_class = tornado.httpclient.AsyncHTTPClient
+            self._http_client = client_class(force_instance=True, max_clients=self._max_clients)
+        return self._http_client
+
+    def close(self):
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
+
+    def get(self, path, params=None, **kwargs):
+        return self.request("GET", path, params=params, **kwargs)
+
+    def put(self, path, obj=None, **kwargs):
+        return self.request("PUT", path, obj, **kwargs)
+
+    def post(self, path, obj=None, **kwargs):
+        return self.request("POST", path, obj, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    @gen.coroutine
+    def request(self, method, path, obj=None, params=None, request_timeout=None):
+        """
+        Sends a request, retrying it if it fails, and returns the JSON body of the
+        response as a Python object, or None if the body is empty
+
+        :param obj: A Python object to send as the JSON body
+        :param params: A dict of query arguments
+        :raises: ArteriaClientError if the request failed, CircuitOpenError if the circuit
+                 breaker refused it
+        """
+        url = url_concat(self.base_url + path, params or {})
+        body = json.dumps(obj) if obj is not None else None
+        if body is None and method in ("POST", "PUT"):
+            body = ""
+        headers = dict(self._headers)
+        headers.setdefault("Accept", "application/json")
+        if obj is not None:
+            headers["Content-Type"] = "application/json"
+        retry_statuses = self.RETRY_STATUSES if method in self.IDEMPOTENT_METHODS \
+            else self.REJECTED_STATUSES
+
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow():
+                raise CircuitOpenError("The circuit to {0} is open".format(self.base_url), 599)
+            response, error = None, None
+            try:
+                response = yield self.http_client.fetch(
+                    url, method=method, body=body, headers=headers, raise_error=False,
+                    request_timeout=request_timeout or self._request_timeout,
+                    connect_timeout=self._connect_timeout)
+                code = response.code
+            except tornado.httpclient.HTTPError as e:
+                # Timeouts
+                response, code, error = e.response, e.code, e
+            except (IOError, OSError) as e:
+                # Connection errors
+                code, error = 599, e
+            except BaseException:
+                # Otherwise a half-open circuit would wait for this trial forever
+                self.circuit_breaker.record_error()
+                raise
+            if code < 500 and code != 429:
+                self.circuit_breaker.record_success()
+            else:
+                self.circuit_breaker.record_failure()
+
+            if code < 400:
+                raise gen.Return(self._decode(response))
+            if code not in retry_statuses or attempt >= self._max_retries:
+                raise ArteriaClientError("{0} {1} failed: {2} {3}".format(
+                    method, url, code, error or response.reason),
+                    code, self._decode(response, strict=False))
+            delay = self._retry_delay(response, attempt)
+            self._logger.info("{0} {1} failed with {2}, retrying in {3:.2f}s".format(
+                method, url, code, delay))
+            yield gen.sleep(delay)
+            attempt += 1
+
+    def _retry_delay(self, response, attempt):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self._max_backoff)
+            except ValueError:
+                # An HTTP date, fall back to the backoff
+                pass
+        return random.uniform(0, min(self._max_backoff, self._backoff * 2 ** attempt))
+
+    @staticmethod
+    def _decode(response, strict=True):
+        if response is None or not response.body:
+            return None
+        try:
+            return json.loads(response.body.decode("utf-8"))
+        except ValueError:
+            if strict:
+                raise ArteriaClientError("Expected a JSON response from {0}".format(
+                    response.effective_url), response.code, response.body)
+            return response.body
+
+    @gen.coroutine
+    def get_many(self, paths, concurrency=10, params=None):
+        """
+        Gets the paths, at most concurrency at a time, returning the bodies in the same order
+        """
+        paths = list(paths)
+        results = [None] * len(paths)
+        indexes = iter(range(len(paths)))
+
+        @gen.coroutine
+        def worker():
+            for index in indexes:
+                results[index] = yield self.get(paths[index], params)
+
+        yield [worker() for _ in range(min(concurrency, len(paths)))]
+        raise gen.Return(results)
+
+    @gen.coroutine
+    def wait_for_state(self, path, timeout=None, poll_interval=1, max_poll_interval=30,
+                       events_path=None, entity_id=None, long_poll_wait=30):
+        """
+        Waits until the resource at path, e.g. a job, reaches a terminal State and returns it
+
+        The resource is polled with exponential backoff and jitter, from poll_interval up to
+        max_poll_interval seconds. If the service publishes events through an
+        EventLongPollHandler at events_path, it is long polled for events of entity_id
+        instead, so the state change is seen as soon as it happens.
+
+        :param timeout: The maximum number of seconds to wait, or None to wait forever
+        :raises: WaitTimeoutError if the timeout is reached
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        long_poll = events_path is not None and entity_id is not None
+        version = None
+        if long_poll:
+            # The current version is fetched before the state, so no change is missed
+            version = (yield self.get(events_path, {"entity": entity_id}))["version"]
+        interval = poll_interval
+        while True:
+            resource = yield self.get(path)
+            if resource.get("state") in terminal_states:
+                raise gen.Return(resource)
+            remaining = deadline - time.time() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                raise WaitTimeoutError("{0} didn't reach a terminal state within {1}s, it is {2}"
+                                       .format(path, timeout, resource.get("state")))
+            if long_poll:
+                wait = long_poll_wait if remaining is None else max(min(long_poll_wait, remaining), 0)
+                events = yield self.get(events_path,
+                                        {"entity": entity_id, "since": version, "wait": wait},
+                                        request_timeout=wait + self._request_timeout)
+                version = events["version"]
+            else:
+                delay = random.uniform(interval / 2.0, interval)
+                if remaining is not None:
+                    delay = min(delay, remaining)
+                yield gen.sleep(delay)
+                interval = min(interval * 2, max_poll_interval)
+
+
+class ArteriaClientError(ArteriaUsageException):
+
+    def __init__(self, message, code, body=None):
+        super(ArteriaClientError, self).__init__(message)
+        self.code = code
+        self.body = body
+
+
+class CircuitOpenError(ArteriaClientError):
+    pass
+
+
+class WaitTimeoutError(ArteriaUsageException):
+    pass
@@ -1,15 +1,114 @@
+import hashlib
 import logging
-import yaml
+import os
+import time
 import threading
+from collections import namedtuple
+
+# yaml, pickle and tempfile are imported on first use, so that importing this module is fast
+_yaml = None
+_SafeLoader = None
+
+
+def _load_yaml():
+    global _yaml, _SafeLoader
+    if _yaml is None:
+        import yaml
+        try:
+            # Use the libyaml bindings when available, they are an order of magnitude faster
+            _SafeLoader = yaml.CSafeLoader
+        except AttributeError:
+            _SafeLoader = yaml.SafeLoader
+        _yaml = yaml
+    return _yaml, _SafeLoader
+
+
+class ConfigSnapshot(namedtuple("ConfigSnapshot", ["path", "config", "signature", "checked_at"])):
+    """
+    An immutable snapshot of a parsed config file.
+
+    The signature is the (mtime, size, inode) of the file when it was parsed. Snapshots are
+    never modified in place, instead a new snapshot is swapped into the cache.
+    """
+    __slots__ = ()
+
+
+class CompiledConfigCache:
+    """
+    Stores parsed config files as pickles, so that unchanged config files don't
+    have to be parsed again when a service starts.
+
+    A cached entry is keyed by the absolute path, mtime and SHA-1 of the content of the
+    config file. Since the cached files are unpickled, the cache directory must only be
+    writable by trusted users.
+    """
+
+    def __init__(self, cache_dir, logger=None):
+        self._cache_dir = cache_dir
+        self._logger = logger or logging.getLogger(__name__)
+
+    def load(self, path, parse):
+        """
+        Returns the config file at path, either from the cache or by calling parse
+        with the content of the file. Newly parsed configs are written to the cache.
+        """
+        with open(path, 'rb') as f:
+            content = f.read()
+            mtime = os.fstat(f.fileno()).st_mtime
+        key = (os.path.abspath(path), mtime, hashlib.sha1(content).hexdigest())
+        cache_path = self._cache_path(key[0])
+
+        found, config = self._read(cache_path, key)
+        if not found:
+            config = parse(content)
+            self._write(cache_path, key, config)
+        return config
+
+    def _cache_path(self, path):
+        name = hashlib.sha1(path.encode("utf-8")).hexdigest()
+        return os.path.join(self._cache_dir, "{0}.pickle".format(name))
+
+    def _read(self, cache_path, key):
+        import pickle
+        try:
+            with open(cache_path, 'rb') as f:
+                if pickle.load(f) != key:
+                    return False, None
+                return True, pickle.load(f)
+        except (IOError, OSError):
+            return False, None
+        except Exception:
+            self._logger.warning("Ignoring unreadable compiled config cache {0}".format(cache_path))
+            return False, None
+
+    def _write(self, cache_path, key, config):
+        import pickle
+        import tempfile
+        # Write to a temporary file that is renamed, so readers never see partial entries
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(config, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError) as e:
+            self._logger.warning("Could not write compiled config cache {0}: {1}"
+                                 .format(cache_path, e))
+
 
 class ConfigurationService:
-    def __init__(self, logger=None, logger_config_path=None, app_config_path=None):
+    def __init__(self, logger=None, logger_config_path=None, app_config_path=None,
+                 reload_interval=1.0, compiled_cache_dir=None):
         """
         Initializes a configuration service
 
         :param logger: The logger instance to use. Will default to one named like the module
         :param logger_config_path: The path to the logger config file
         :param app_config_path: The path to the application specific config file
+        :param reload_interval: Minimum number of seconds between checks of a config file
+                                for changes on disk. Set to None to never reload.
+        :param compiled_cache_dir: Optional directory where parsed config files are cached,
+                                   see CompiledConfigCache
 
         Usage example:
         config_svc = ConfigurationService(logger_config_path="/opt/product/etc/logger.config",
@@ -21,12 +120,30 @@ class ConfigurationService:
 
         # Config files are cached in-memory
         # The config files should be YAML
+
+        # A config file is reloaded when its mtime, size or inode changes. Services that need
+        # to react to changes can register a listener, which is called with the path and
+        # the new config:
+        config_svc.add_listener(lambda path, config: ...)
         """
         self._logger = logger or logging.getLogger(__name__)
         self._logger_config_path = logger_config_path
         self._app_config_path = app_config_path
+        self._reload_interval = reload_interval
         self._cache_lock = threading.Lock()
         self._cache = {}
+        self._listeners = []
+        self._compiled_cache = None
+        if compiled_cache_dir:
+            self._compiled_cache = CompiledConfigCache(compiled_cache_dir, self._logger)
+
+    @property
+    def logger_config_path(self):
+        return self._logger_config_path
+
+    @property
+    def app_config_path(self):
+        return self._app_config_path
 
     def get_app_config(self):
         """Returns the application specific config file"""
@@ -41,22 +158,96 @@ class ConfigurationService:
         app_config = self.get_app_config()
         return app_config[key]
 
+    def add_listener(self, listener):
+        """
+        Registers a callable that is called with (path, config) when a cached
+        config file has been reloaded because it changed on disk
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def check_for_changes(self):
+        """
+        Checks all cached config files for changes on disk, ignoring the reload interval.
+        Changed files are reloaded and the listeners notified.
+
+        Suitable for calling periodically, e.g. from a tornado.ioloop.PeriodicCallback
+        """
+        for path in list(self._cache):
+            self._load_config_file(path, from_cache=False)
+
     def _load_config_file(self, path, from_cache=True):
-        """Loads the config file, possibly from cache"""
-        must_fetch = lambda: (not from_cache) or (path not in self._cache)
-        if must_fetch():
-            # TODO: Code review threading code
-            with self._cache_lock:
-                if must_fetch():
-                    config_file = ConfigurationService.read_yaml(path)
-                    self._cache[path] = config_file
-                    self._logger.info("Read config file from {0}, format={1}, from_cache={2}"
-                                      .format(path, format, from_cache))
-        return self._cache[path]
+        """
+        Loads the config file, possibly from cache
+
+        The cache is read without locking. If the reload interval has passed, or if from_cache
+        is False, the file is stat'ed and only parsed again if its signature has changed.
+        """
+        snapshot = self._cache.get(path)
+        if snapshot is not None:
+            if from_cache and not self._is_check_due(snapshot):
+                return snapshot.config
+            signature = ConfigurationService._signature(path)
+            if signature == snapshot.signature or signature is None:
+                # Unchanged (or temporarily unavailable, e.g. while being replaced).
+                # Swap in a snapshot with an updated check time, unless another thread
+                # has stored a newer snapshot since it was read.
+                with self._cache_lock:
+                    current = self._cache.get(path)
+                    if current is snapshot:
+                        current = self._cache[path] = snapshot._replace(checked_at=time.time())
+                return current.config
+
+        with self._cache_lock:
+            current = self._cache.get(path)
+            signature = ConfigurationService._signature(path)
+            if current is not None and current is not snapshot and current.signature == signature:
+                # Another thread reloaded the file while we were waiting for the lock
+                return current.config
+            config_file = self._read_config(path)
+            self._cache[path] = ConfigSnapshot(path, config_file, signature, time.time())
+            self._logger.info("Read config file from {0}, reload={1}"
+                              .format(path, snapshot is not None))
+
+        if snapshot is not None:
+            self._notify_listeners(path, config_file)
+        return config_file
+
+    def _is_check_due(self, snapshot):
+        if self._reload_interval is None:
+            return False
+        return time.time() - snapshot.checked_at >= self._reload_interval
+
+    def _notify_listeners(self, path, config):
+        for listener in list(self._listeners):
+            try:
+                listener(path, config)
+            except Exception:
+                self._logger.exception("Config listener failed for {0}".format(path))
+
+    @staticmethod
+    def _signature(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size, stat.st_ino
+
+    def _read_config(self, path):
+        if self._compiled_cache is not None:
+            return self._compiled_cache.load(path, ConfigurationService.parse_yaml)
+        return ConfigurationService.read_yaml(path)
 
     @staticmethod
     def read_yaml(path):
         """Deserializes the content of the yaml file"""
-        with open(path, 'r') as f:
-            config = yaml.safe_load(f.read())
-            return config
+        with open(path, 'rb') as f:
+            return ConfigurationService.parse_yaml(f.read())
+
+    @staticmethod
+    def parse_yaml(content):
+        """Deserializes yaml content, using the libyaml based loader if available"""
+        yaml, loader = _load_yaml()
+        return yaml.load(content, Loader=loader)
@@ -1,3 +1,8 @@
+import functools
+
+from arteria.exceptions import ArteriaUsageException
+
+
 def undocumented(f):
     """
     Apply the undocumented decorator to handler methods if they should not turn up in the API help
@@ -5,3 +10,63 @@ def undocumented(f):
     f.undocumented = True
     return f
 
+
+def cached(ttl=10, max_entries=128, vary=()):
+    """
+    Apply the cached decorator to GET methods of a BaseRestHandler to cache their responses
+
+    Responses are cached by path and query, plus the values of the request headers in vary,
+    for ttl seconds in an LRU cache of at most max_entries responses. Only successful
+    responses that haven't been flushed are cached, with their status and the headers the
+    method set, e.g. Link or Cache-Control. Concurrent identical requests wait for
+    the first one instead of computing the response again. Responses carry an ETag, and
+    requests with a matching If-None-Match header get a 304.
+
+    Usage example:
+        class StatusHandler(BaseRestHandler):
+            @cached(ttl=5, vary=("Accept-Encoding",))
+            def get(self, runfolder):
+                ...
+
+        # The cached responses can be invalidated with:
+        StatusHandler.get.invalidate()  # or .invalidate(path) for one path
+    """
+    # Imported here so that importing arteria doesn't import tornado
+    from arteria.web.cache import cache_responses
+    return cache_responses(ttl, max_entries, tuple(vary))
+
+
+def offload(pool="default"):
+    """
+    Apply the offload decorator to handler methods of a BaseRestHandler that call blocking
+    code, e.g. directory walks, checksums or waiting for subprocesses, to run them in a
+    named pool of the ExecutorService (see arteria.executors) instead of on the IOLoop
+
+    The method must not write the response itself, since it doesn't run on the IOLoop thread.
+    Instead it returns the object to write with write_object, or None.
+
+    The pool must be a thread pool, since the handler can't be sent to another process. Use
+    self.run_in_pool with a module level function and picklable arguments for process pools.
+
+    Usage example:
+        class ChecksumHandler(BaseRestHandler):
+            @offload("checksum")
+            def get(self, path):
+                return {"md5": md5sum(path)}
+    """
+    # Imported here so that importing arteria doesn't import tornado
+    from tornado import gen
+
+    def decorator(method):
+        @gen.coroutine
+        def wrapper(self, *args, **kwargs):
+            executors = self.settings.get("executors")
+            if executors is not None and executors.get(pool).pool_type == "process":
+                raise ArteriaUsageException(
+                    "Can't offload {0} to the process pool '{1}', use a thread pool or "
+                    "run_in_pool with a module level function".format(method.__name__, pool))
+            result = yield self.run_in_pool(pool, method, self, *args, **kwargs)
+            if result is not None:
+                self.write_object(result)
+        return functools.wraps(method)(wrapper)
+    return decorator
@@ -0,0 +1,144 @@
+import logging
+import multiprocessing
+import threading
+
+from arteria.exceptions import ArteriaUsageException
+
+DEFAULT_POOL = "default"
+
+
+class BoundedExecutor(object):
+    """
+    A named thread or process pool with a limit on the number of tasks waiting for a worker
+    """
+
+    def __init__(self, name, pool_type="thread", size=4, max_queue=100):
+        if pool_type not in ("thread", "process"):
+            raise ArteriaUsageException("Unknown type '{0}' of pool '{1}', expected thread or process"
+                                        .format(pool_type, name))
+        self.name = name
+        self.pool_type = pool_type
+        self.size = size
+        self.max_queue = max_queue
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.submitted = 0
+        self.rejected = 0
+
+    @property
+    def active(self):
+        return min(self._pending, self.size)
+
+    @property
+    def queued(self):
+        return max(0, self._pending - self.size)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Submits fn to the pool, returning a concurrent.futures.Future
+
+        :raises: PoolSaturatedError if max_queue tasks are already waiting for a worker
+        """
+        with self._lock:
+            if self._pending - self.size >= self.max_queue:
+                self.rejected += 1
+                raise PoolSaturatedError("The pool '{0}' is saturated ({1} tasks queued)"
+                                         .format(self.name, self.queued))
+            self._pending += 1
+            self.submitted += 1
+            if self._executor is None:
+                # Created on first use, so that no threads or processes exist before forking
+                from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+                executor_class = ThreadPoolExecutor if self.pool_type == "thread" \
+                    else ProcessPoolExecutor
+                self._executor = executor_class(max_workers=self.size)
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+
+class ExecutorService(object):
+    """
+    Owns the named pools that blocking work, such as directory walks or checksums,
+    is offloaded to from request handlers
+
+    The pools are configured under the key 'executors' in the app config, e.g.:
+
+        executors:
+            default:
+                type: thread
+                size: 8
+                max_queue: 100
+            checksum:
+                type: process
+                size: 4
+                max_queue: 20
+
+    A thread pool named default is always available. Handler methods are offloaded to thread
+    pools with the arteria.offload decorator. Functions are run in process pools with
+    BaseRestHandler.run_in_pool, and must be defined at module level and take picklable
+    arguments, e.g.:
+
+        @gen.coroutine
+        def get(self, path):
+            md5 = yield self.run_in_pool("checksum", md5sum, path)
+    """
+
+    def __init__(self, config=None, logger=None):
+        self._logger = logger or logging.getLogger(__name__)
+        config = dict(config or {})
+        config.setdefault(DEFAULT_POOL, {"type": "thread",
+                                         "size": min(32, multiprocessing.cpu_count() + 4)})
+        self._pools = {}
+        for name, pool_config in config.items():
+            pool_config = pool_config or {}
+            self._pools[name] = BoundedExecutor(name,
+                                                pool_type=pool_config.get("type", "thread"),
+                                                size=pool_config.get("size", 4),
+                                                max_queue=pool_config.get("max_queue", 100))
+
+    def get(self, name=DEFAULT_POOL):
+        try:
+            return self._pools[name]
+        except KeyError:
+            raise ArteriaUsageException("There is no executor pool named '{0}'".format(name))
+
+    def submit(self, name, fn, *args, **kwargs):
+        """Submits fn to the named pool, see BoundedExecutor.submit"""
+        return self.get(name).submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait)
+
+    def collect(self):
+        """A collector for the MetricsRegistry"""
+        pools = sorted(self._pools.values(), key=lambda pool: pool.name)
+        return [
+            ("arteria_executor_active", "gauge", "Number of tasks running in the pool",
+             [({"pool": pool.name}, pool.active) for pool in pools]),
+            ("arteria_executor_queued", "gauge", "Number of tasks waiting for a worker",
+             [({"pool": pool.name}, pool.queued) for pool in pools]),
+            ("arteria_executor_submitted_total", "counter", "Number of tasks submitted",
+             [({"pool": pool.name}, pool.submitted) for pool in pools]),
+            ("arteria_executor_rejected_total", "counter",
+             "Number of tasks rejected because the pool was saturated",
+             [({"pool": pool.name}, pool.rejected) for pool in pools]),
+        ]
+
+
+class PoolSaturatedError(ArteriaUsageException):
+    pass
@@ -0,0 +1,350 @@
+import functools
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from arteria.exceptions import ArteriaUsageException, InvalidArteriaStateException
+from arteria.state_store import MemoryStateStore, StateRecord
+from arteria.web.state import State, terminal_states, validate_state
+
+# The state transitions a job can go through. Jobs start out as pending.
+valid_transitions = {
+    State.PENDING: set([State.STARTED, State.CANCELLED]),
+    State.STARTED: set([State.DONE, State.ERROR, State.CANCELLED]),
+}
+
+_current = threading.local()
+
+
+def current_job():
+    """
+    Returns the job running in the current thread, or None. Long running jobs in a thread
+    pool can use this to check if they have been cancelled:
+
+        if current_job().cancel_requested:
+            return
+    """
+    return getattr(_current, "job", None)
+
+
+class Job:
+    """A unit of work submitted to a JobRunner"""
+
+    def __init__(self, job_id, func, args, kwargs, timeout):
+        self.id = job_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.state = State.PENDING
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.cancel_requested = False
+
+    def transition(self, state):
+        """
+        Moves the job to the state
+
+        :raises: InvalidArteriaStateException if the state is not valid or can't be
+                 reached from the current state
+        """
+        validate_state(state)
+        if state not in valid_transitions.get(self.state, ()):
+            raise InvalidArteriaStateException(
+                "Job {0} can't go from '{1}' to '{2}'".format(self.id, self.state, state))
+        self.state = state
+        if state == State.STARTED:
+            self.started = time.time()
+        elif state in terminal_states:
+            self.finished = time.time()
+
+    def to_dict(self):
+        return {"id": self.id,
+                "state": self.state,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+                "result": self.result,
+                "error": self.error}
+
+    def to_record(self):
+        data = self.to_dict()
+        del data["id"]
+        del data["state"]
+        return StateRecord(self.id, self.state, time.time(), data)
+
+    def __repr__(self):
+        return "[Job {0} state={1}]".format(self.id, self.state)
+
+
+class JobRunner:
+    """
+    Runs jobs in a thread or process pool, keeping track of their state
+
+    Jobs wait in a bounded queue until a worker is free. Pending jobs can be cancelled,
+    as can started jobs, although a started job keeps its worker busy until it returns.
+    The same applies to jobs that exceed their timeout, which end up in the error state.
+
+    Usage example:
+        job_runner = JobRunner(max_workers=4, max_queue_size=100)
+        job = job_runner.submit(checksum, args=("/path/to/file",), timeout=3600)
+        ...
+        job_runner.get(job.id).state
+
+    The state of the jobs is kept in a StateStore. Finished jobs are only kept there, so
+    with a persistent store, such as the SqliteStateStore, they survive restarts. Jobs that
+    were pending or started when the service stopped are moved to the error state.
+    """
+
+    def __init__(self, max_workers=4, max_queue_size=100, use_processes=False,
+                 default_timeout=None, store=None, logger=None):
+        """
+        :param max_workers: The number of jobs that can run at the same time
+        :param max_queue_size: The number of jobs that can wait for a worker
+        :param use_processes: Run the jobs in a process pool rather than a thread pool.
+                              The functions and their arguments then need to be picklable.
+        :param default_timeout: Timeout in seconds for jobs submitted without a timeout
+        :param store: The StateStore to keep the job states in. Defaults to a MemoryStateStore.
+        """
+        self._logger = logger or logging.getLogger(__name__)
+        self._max_workers = max_workers
+        self._max_queue_size = max_queue_size
+        self._use_processes = use_processes
+        self._default_timeout = default_timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._jobs = {}
+        self._futures = {}
+        self._timers = {}
+        self._active = 0
+        self._listeners = []
+        self._store = store or MemoryStateStore()
+        self._recover()
+
+    def _recover(self):
+        """Moves the jobs that were interrupted by a restart to the error state"""
+        for state in (State.PENDING, State.STARTED):
+            for record in self._store.list(state):
+                self._logger.warning("Job {0} was interrupted by a restart".format(record.id))
+                record.data["error"] = "Interrupted by a restart"
+                self._store.put(StateRecord(record.id, State.ERROR, time.time(), record.data))
+
+    def add_listener(self, listener):
+        """
+        Registers a callable that is called with the job and its new state every time a
+        job changes state. Note that the listeners are called from the pool threads.
+        """
+        self._listeners.append(listener)
+
+    def submit(self, func, args=(), kwargs=None, timeout=None):
+        """
+        Queues func to be called with args and kwargs
+
+        :param timeout: Seconds the job may run before it's considered failed
+        :return: The pending (or already started) Job
+        :raises: JobQueueFullError if the queue is full
+        """
+        job = Job(uuid.uuid4().hex, func, tuple(args), dict(kwargs or {}),
+                  timeout if timeout is not None else self._default_timeout)
+        with self._lock:
+            if len(self._queue) >= self._max_queue_size:
+                raise JobQueueFullError(
+                    "The job queue is full ({0} jobs pending)".format(len(self._queue)))
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._store.put(job.to_record())
+            changed = [(job, job.state)]
+            started = self._dispatch()
+            changed.extend((started_job, State.STARTED) for started_job in started)
+        self._notify(changed)
+        self._watch(started)
+        return job
+
+    def get(self, job_id):
+        """
+        Returns the job with the id. Jobs that have finished are returned as a StateRecord.
+
+        :raises: UnknownJobError if there is no such job
+        """
+        job = self._jobs.get(job_id) or self._store.get(job_id)
+        if job is None:
+            raise UnknownJobError("No job with id '{0}'".format(job_id))
+        return job
+
+    def list(self, state=None, limit=None):
+        """
+        Returns StateRecords for the jobs, most recently updated first,
+        optionally only those in the state
+        """
+        if state is not None:
+            validate_state(state)
+        return self._store.list(state, limit)
+
+    def counts(self):
+        """Returns the number of jobs per state"""
+        return self._store.counts()
+
+    def cancel(self, job_id):
+        """
+        Cancels the job if it hasn't finished yet
+
+        :return: The job
+        """
+        with self._lock:
+            job = self.get(job_id)
+            if job.state in terminal_states:
+                return job
+            job.cancel_requested = True
+            if job.state == State.PENDING:
+                self._queue.remove(job)
+            else:
+                self._futures[job.id].cancel()
+            self._transition(job, State.CANCELLED)
+        self._notify([(job, State.CANCELLED)])
+        return job
+
+    def shutdown(self, wait=True):
+        """Cancels the pending jobs and shuts down the pool"""
+        with self._lock:
+            cancelled = list(self._queue)
+            self._queue.clear()
+            for job in cancelled:
+                self._transition(job, State.CANCELLED)
+            executor = self._executor
+        self._notify([(job, State.CANCELLED) for job in cancelled])
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _get_executor(self):
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+            if self._use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        return self._executor
+
+    def _dispatch(self):
+        """
+        Starts queued jobs while there are free workers. Must be called with the lock held.
+
+        :return: The jobs that were started. They must be passed to _watch once the
+                 lock has been released.
+        """
+        started = []
+        while self._queue and self._active < self._max_workers:
+            job = self._queue.popleft()
+            self._transition(job, State.STARTED)
+            self._active += 1
+            if self._use_processes:
+                future = self._get_executor().submit(job.func, *job.args, **job.kwargs)
+            else:
+                future = self._get_executor().submit(_run_in_thread, job)
+            self._futures[job.id] = future
+            if job.timeout:
+                timer = threading.Timer(job.timeout, self._on_timeout, (job,))
+                timer.daemon = True
+                self._timers[job.id] = timer
+                timer.start()
+            started.append(job)
+        return started
+
+    def _on_done(self, job, future):
+        with self._lock:
+            self._active -= 1
+            del self._futures[job.id]
+            timer = self._timers.pop(job.id, None)
+            if timer is not None:
+                timer.cancel()
+            changed = []
+            if job.state == State.STARTED:
+                try:
+                    self._end(job, future)
+                    changed.append((job, job.state))
+                except Exception:
+                    self._logger.exception("Failed to store the end of job {0}".format(job.id))
+            # Always called, so that the queued jobs don't stall
+            started = self._dispatch()
+            changed.extend((started_job, State.STARTED) for started_job in started)
+        self._notify(changed)
+        self._watch(started)
+
+    def _end(self, job, future):
+        """Moves the job to DONE or ERROR. Must be called with the lock held."""
+        error = future.exception()
+        if error is None:
+            job.result = future.result()
+            try:
+                self._transition(job, State.DONE)
+                return
+            except (TypeError, ValueError) as e:
+                # E.g. a result that isn't JSON serializable, which can't be stored
+                job.result = None
+                error = "The result of the job can't be stored: {0}".format(e)
+        self._logger.error("Job {0} failed: {1!r}".format(job.id, error))
+        job.error = str(error)
+        self._transition(job, State.ERROR)
+
+    def _transition(self, job, state):
+        """
+        Moves the job to the state and stores it. Must be called with the lock held, so
+        that the states are stored in the order of the transitions. If the job can't be
+        stored, it is left in its previous state.
+        """
+        previous = job.state
+        job.transition(state)
+        try:
+            self._store.put(job.to_record())
+        except Exception:
+            job.state = previous
+            raise
+        if state in terminal_states:
+            self._jobs.pop(job.id, None)
+
+    def _watch(self, jobs):
+        # Must be called without the lock held, since the callback is called
+        # immediately if the job has already finished
+        for job in jobs:
+            future = self._futures.get(job.id)
+            if future is not None:
+                future.add_done_callback(functools.partial(self._on_done, job))
+
+    def _on_timeout(self, job):
+        with self._lock:
+            if job.state != State.STARTED:
+                return
+            self._logger.warning("Job {0} timed out after {1}s".format(job.id, job.timeout))
+            job.cancel_requested = True
+            job.error = "Timed out after {0} seconds".format(job.timeout)
+            self._transition(job, State.ERROR)
+        self._notify([(job, State.ERROR)])
+
+    def _notify(self, changes):
+        for job, state in changes:
+            for listener in self._listeners:
+                try:
+                    listener(job, state)
+                except Exception:
+                    self._logger.exception("Job listener failed for {0}".format(job.id))
+
+
+def _run_in_thread(job):
+    _current.job = job
+    try:
+        return job.func(*job.args, **job.kwargs)
+    finally:
+        _current.job = None
+
+
+class JobQueueFullError(ArteriaUsageException):
+    pass
+
+
+class UnknownJobError(ArteriaUsageException):
+    pass
@@ -0,0 +1,357 @@
+import errno
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+
+from arteria.exceptions import ArteriaUsageException
+from arteria.web.state import State, terminal_states, validate_state
+
+LEASE_SUFFIX = ".lease"
+
+
+class Lease(object):
+    """
+    A claim on a unit of work, held by one node until it is released or expires
+
+    If the unit was taken over from a node whose lease had expired, taken_over_from is
+    that lease as a dict, e.g. to resume the work from its state and data.
+    """
+
+    def __init__(self, unit_id, owner, token, state, data, acquired, expires,
+                 taken_over_from=None):
+        self.unit_id = unit_id
+        self.owner = owner
+        self.token = token
+        self.state = state
+        self.data = data
+        self.acquired = acquired
+        self.expires = expires
+        self.taken_over_from = taken_over_from
+        self.lost = False
+        # Held while the lease file is checked and replaced, so that a renewal by the
+        # heartbeat can't interleave with an update or release
+        self._lock = threading.Lock()
+
+    def to_dict(self):
+        return {"unit_id": self.unit_id, "owner": self.owner, "token": self.token,
+                "state": self.state, "data": self.data, "acquired": self.acquired,
+                "expires": self.expires}
+
+
+class LeaseManager(object):
+    """
+    Lets several nodes, e.g. instances of the same service on compute nodes sharing an NFS
+    or Lustre filesystem, split units of work between them without a coordinator
+
+    Each unit of work, e.g. a runfolder, is claimed with a lease file in lease_dir. A lease
+    is created by hard linking a fully written temporary file to the lease path, which is
+    atomic and fails if the lease exists, like open with O_CREAT | O_EXCL, but also on NFS.
+    Leases expire after ttl seconds unless they are renewed, which the heartbeat thread
+    does for all held leases. A node can take over an expired lease, e.g. from a node that
+    crashed: the expired lease is renamed to a tombstone first, which only one node can do.
+    Renewals replace the lease file with a rename, so other nodes never read partial leases.
+
+    Each lease carries a State and optional JSON data. Releasing a lease in a terminal state
+    keeps it as a record that the unit is done, so that it isn't claimed again.
+
+    Expiry is checked against the clocks of the nodes, so they need to be kept in sync,
+    e.g. with NTP, to well within the ttl. A lease that has expired before this node renewed
+    it, e.g. since the filesystem hung, is lost, even if no other node has taken it over yet.
+
+    Usage example:
+        leases = LeaseManager("/mnt/shared/leases/demultiplex", ttl=60)
+        leases.start()
+        lease = leases.claim_next(runfolder_names)
+        if lease is not None:
+            leases.update(lease, State.STARTED)
+            ...
+            leases.release(lease, State.DONE)
+    """
+
+    def __init__(self, lease_dir, node_id=None, ttl=60, heartbeat_interval=None,
+                 clock=time.time, logger=None):
+        """
+        :param lease_dir: The shared directory to keep the lease files in
+        :param node_id: The name of this node in the leases, by default <host>:<pid>
+        :param ttl: The seconds a lease is valid for after it was last renewed
+        :param heartbeat_interval: The seconds between renewals, by default ttl / 3
+        """
+        self._logger = logger or logging.getLogger(__name__)
+        self._lease_dir = lease_dir
+        self.node_id = node_id or "{0}:{1}".format(socket.gethostname(), os.getpid())
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval or ttl / 3.0
+        self._clock = clock
+        self._held = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._stopped = threading.Event()
+        self._heartbeat = None
+        if not os.path.isdir(lease_dir):
+            try:
+                os.makedirs(lease_dir)
+            except OSError:
+                # Created by another node
+                if not os.path.isdir(lease_dir):
+                    raise
+
+    def add_listener(self, listener):
+        """Adds a listener that is called with a held lease when it has been lost"""
+        self._listeners.append(listener)
+
+    def start(self):
+        """Starts the heartbeat thread renewing the held leases"""
+        self._stopped.clear()
+        self._heartbeat = threading.Thread(target=self._beat, name="LeaseHeartbeat")
+        self._heartbeat.daemon = True
+        self._heartbeat.start()
+
+    def stop(self):
+        """Stops the heartbeat. The held leases then expire unless they are released."""
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+
+    def claim(self, unit_id, data=None):
+        """
+        Claims the unit of work, returning the Lease, or None if another node holds it
+        or it is done. An expired lease is taken over.
+        """
+        path = self._path(unit_id)
+        now = self._clock()
+        lease = Lease(unit_id, self.node_id, uuid.uuid4().hex, State.PENDING, data,
+                      now, now + self.ttl)
+        # Read first, since creating a lease writes and syncs a file, which is slow on NFS
+        current = self._read(path)
+        if current is None:
+            if self._create(path, lease):
+                return self._hold(lease)
+            current = self._read(path)
+        if current is None or not self._expired(current, now):
+            # Held by another node, or released since it was read
+            return None
+        if not self._bury(path, current):
+            return None
+        lease.taken_over_from = current
+        if not self._create(path, lease):
+            # Another node claimed it after the expired lease was buried
+            return None
+        self._logger.warning("Took over the expired lease on {0} from {1}".format(
+            unit_id, current["owner"]))
+        return self._hold(lease)
+
+    def claim_next(self, unit_ids, data=None):
+        """
+        Claims one of the units of work that is free, returning its Lease or None. Each node
+        goes through the units from its own offset, so that the nodes don't all race for the
+        same units.
+        """
+        unit_ids = list(unit_ids)
+        if not unit_ids:
+            return None
+        offset = (zlib.crc32(self.node_id.encode("utf-8")) & 0xffffffff) % len(unit_ids)
+        for unit_id in unit_ids[offset:] + unit_ids[:offset]:
+            lease = self.claim(unit_id, data)
+            if lease is not None:
+                return lease
+        return None
+
+    def renew(self, lease):
+        """
+        Extends the lease by ttl seconds
+
+        :raises: LeaseLostError if the lease has been taken over by another node
+        """
+        with lease._lock:
+            self._write(lease, lease.state, lease.data)
+
+    def update(self, lease, state, data=None):
+        """
+        Sets the state, and data if given, of the lease and renews it
+
+        :raises: LeaseLostError if the lease has been taken over by another node
+        """
+        validate_state(state)
+        with lease._lock:
+            self._write(lease, state, lease.data if data is None else data)
+
+    def release(self, lease, state=None):
+        """
+        Releases the lease. If the state is terminal, e.g. State.DONE, the lease is kept,
+        without expiring, so that the unit isn't claimed again. Otherwise the lease is
+        removed, and the unit can be claimed by any node.
+
+        :raises: LeaseLostError if the lease has been taken over by another node
+        """
+        if state is not None:
+            validate_state(state)
+        with lease._lock:
+            with self._lock:
+                if self._held.get(lease.unit_id) is lease:
+                    del self._held[lease.unit_id]
+            if state in terminal_states:
+                self._check_not_expired(lease)
+                lease.expires = None
+                self._write(lease, state, lease.data)
+                return
+            self._check_owner(lease)
+            try:
+                os.unlink(self._path(lease.unit_id))
+            except OSError:
+                pass
+
+    def get(self, unit_id):
+        """Returns the lease on the unit of work as a dict, or None if there is none"""
+        return self._read(self._path(unit_id))
+
+    def list(self):
+        """Returns all leases, including expired and done ones, as dicts"""
+        leases = []
+        for name in sorted(os.listdir(self._lease_dir)):
+            if name.endswith(LEASE_SUFFIX) and not name.startswith("."):
+                record = self._read(os.path.join(self._lease_dir, name))
+                if record is not None:
+                    leases.append(record)
+        return leases
+
+    def held(self):
+        """Returns the leases held by this node"""
+        with self._lock:
+            return list(self._held.values())
+
+    def _path(self, unit_id):
+        if not unit_id or "/" in unit_id or unit_id.startswith("."):
+            raise ArteriaUsageException("Invalid unit of work id '{0}'".format(unit_id))
+        return os.path.join(self._lease_dir, unit_id + LEASE_SUFFIX)
+
+    def _expired(self, record, now):
+        return record["expires"] is not None and record["expires"] < now
+
+    def _hold(self, lease):
+        with self._lock:
+            self._held[lease.unit_id] = lease
+        return lease
+
+    def _write_temporary(self, lease):
+        tmp_path = os.path.join(self._lease_dir, ".{0}.{1}.tmp".format(lease.unit_id,
+                                                                      uuid.uuid4().hex))
+        with open(tmp_path, "w") as f:
+            json.dump(lease.to_dict(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp_path
+
+    def _create(self, path, lease):
+        tmp_path = self._write_temporary(lease)
+        try:
+            os.link(tmp_path, path)
+            return True
+        except OSError as e:
+            # On NFS, a retransmitted link can fail although the first attempt succeeded
+            if os.stat(tmp_path).st_nlink == 2:
+                return True
+            if e.errno != errno.EEXIST:
+                raise
+            return False
+        finally:
+            os.unlink(tmp_path)
+
+    def _bury(self, path, record):
+        """Renames the expired lease to a tombstone, returning True if this node did it"""
+        tombstone = os.path.join(self._lease_dir, ".{0}.{1}.tombstone".format(
+            record["unit_id"], record["token"]))
+        try:
+            os.rename(path, tombstone)
+        except OSError:
+            # Another node got there first
+            return False
+        buried = self._read(tombstone)
+        if buried is None or buried["token"] != record["token"]:
+            # The lease was taken over and renewed after it was read, put it back
+            try:
+                os.link(tombstone, path)
+            except OSError:
+                pass
+            os.unlink(tombstone)
+            return False
+        os.unlink(tombstone)
+        return True
+
+    def _check_owner(self, lease):
+        current = self._read(self._path(lease.unit_id))
+        if current is None or current["token"] != lease.token:
+            raise LeaseLostError("The lease on {0} has been taken over by {1}".format(
+                lease.unit_id, current["owner"] if current else "another node"))
+
+    def _check_not_expired(self, lease):
+        # Once expired, another node may take the lease over at any time, e.g. between the
+        # check of the owner and the rename in _write, so it can't be renewed safely
+        if lease.expires is not None and lease.expires <= self._clock():
+            raise LeaseLostError("The lease on {0} expired before it was renewed".format(
+                lease.unit_id))
+
+    def _write(self, lease, state, data):
+        # Called with the lock of the lease held
+        self._check_not_expired(lease)
+        self._check_owner(lease)
+        now = self._clock()
+        lease.state = state
+        lease.data = data
+        if lease.expires is not None:
+            lease.expires = now + self.ttl
+        os.rename(self._write_temporary(lease), self._path(lease.unit_id))
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, OSError):
+            return None
+        except ValueError:
+            self._logger.warning("Ignoring the invalid lease file {0}".format(path))
+            return None
+
+    def _beat(self):
+        while not self._stopped.wait(self.heartbeat_interval):
+            self._renew_held()
+
+    def _renew_held(self):
+        lost = []
+        for lease in self.held():
+            with lease._lock:
+                with self._lock:
+                    if self._held.get(lease.unit_id) is not lease:
+                        # Released since the held leases were listed
+                        continue
+                try:
+                    self._write(lease, lease.state, lease.data)
+                except LeaseLostError as e:
+                    self._logger.warning(str(e))
+                    lease.lost = True
+                    with self._lock:
+                        del self._held[lease.unit_id]
+                    lost.append(lease)
+                except (IOError, OSError) as e:
+                    # E.g. the filesystem is unavailable, retried on the next beat
+                    self._logger.warning("Failed to renew the lease on {0}: {1}".format(
+                        lease.unit_id, e))
+        # The listeners are called without the locks, so that they can e.g. release the lease
+        for lease in lost:
+            self._lose(lease)
+
+    def _lose(self, lease):
+        for listener in self._listeners:
+            try:
+                listener(lease)
+            except Exception:
+                self._logger.exception("Lease listener failed for {0}".format(lease.unit_id))
+
+
+class LeaseLostError(ArteriaUsageException):
+    pass
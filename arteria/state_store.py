@@ -0,0 +1,294 @@
+import itertools
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from arteria.web.state import valid_states, terminal_states, validate_state
+
+
+class StateRecord(object):
+    """The state of an entity, such as a job, and the data that goes with it"""
+
+    __slots__ = ("id", "state", "updated", "data")
+
+    def __init__(self, record_id, state, updated, data=None):
+        self.id = record_id
+        self.state = state
+        self.updated = updated
+        self.data = data or {}
+
+    def to_dict(self):
+        result = dict(self.data)
+        result["id"] = self.id
+        result["state"] = self.state
+        return result
+
+    def __repr__(self):
+        return "[StateRecord {0} state={1}]".format(self.id, self.state)
+
+
+class StateStore(object):
+    """
+    Stores StateRecords and indexes them by their state
+
+    Counting the records in a state is O(1), and listing the records in a state
+    only touches the records in that state.
+    """
+
+    def put(self, record):
+        """Adds or updates the record"""
+        raise NotImplementedError("Should be implemented by subclass!")
+
+    def get(self, record_id):
+        """Returns the record with the id, or None"""
+        raise NotImplementedError("Should be implemented by subclass!")
+
+    def count(self, state=None):
+        """Returns the number of records in the state, or of all records if state is None"""
+        raise NotImplementedError("Should be implemented by subclass!")
+
+    def counts(self):
+        """Returns a dict with the number of records per state"""
+        return dict((state, self.count(state)) for state in valid_states)
+
+    def list(self, state=None, limit=None):
+        """Returns records, most recently updated first, optionally only those in the state"""
+        raise NotImplementedError("Should be implemented by subclass!")
+
+    def close(self):
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """A StateStore that keeps all records in memory"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = OrderedDict()
+        self._by_state = dict((state, OrderedDict()) for state in valid_states)
+
+    def put(self, record):
+        validate_state(record.state)
+        with self._lock:
+            previous = self._records.pop(record.id, None)
+            if previous is not None:
+                del self._by_state[previous.state][record.id]
+            # Re-inserting keeps the dicts ordered by the time of the last update
+            self._records[record.id] = record
+            self._by_state[record.state][record.id] = record
+
+    def remove(self, record_id):
+        with self._lock:
+            record = self._records.pop(record_id, None)
+            if record is not None:
+                del self._by_state[record.state][record_id]
+            return record
+
+    def get(self, record_id):
+        return self._records.get(record_id)
+
+    def count(self, state=None):
+        if state is None:
+            return len(self._records)
+        validate_state(state)
+        return len(self._by_state[state])
+
+    def list(self, state=None, limit=None):
+        with self._lock:
+            if state is None:
+                records = self._records
+            else:
+                validate_state(state)
+                records = self._by_state[state]
+            return list(itertools.islice(reversed(records.values()), limit))
+
+
+class SqliteStateStore(StateStore):
+    """
+    A StateStore persisted in SQLite, in WAL mode
+
+    Only the records in non-terminal states (e.g. pending and started) are kept in memory,
+    together with the number of records per state. On startup these are read with indexed
+    queries, rather than by loading the full history. Records in terminal states are
+    listed with indexed queries against the database.
+
+    Records are written to the database by a writer thread, in batches, so that put doesn't
+    block on disk I/O, e.g. when jobs are submitted from the IOLoop thread. The data of the
+    records is serialized as JSON in put, so data that can't be stored raises there. Reads
+    don't wait for the writer either: they use a connection of their own, which WAL mode
+    lets read while the writer writes, and take the records not written yet from memory.
+
+    Usage example:
+        store = SqliteStateStore("/var/lib/arteria/product/jobs.db")
+        job_runner = JobRunner(store=store)
+    """
+
+    def __init__(self, path, logger=None):
+        self._logger = logger or logging.getLogger(__name__)
+        # Guards the in-memory state, while _db_lock and _read_lock guard the connections
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        import sqlite3
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS records "
+            "(id TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL, data TEXT)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS records_by_state ON records (state, updated)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS records_by_updated ON records (updated)")
+        self._connection.commit()
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+
+        self._active = MemoryStateStore()
+        self._counts = dict((state, 0) for state in valid_states)
+        # Records put but not yet written, by id
+        self._pending = {}
+        self._writes = queue.Queue()
+        self._load()
+        self._writer = threading.Thread(target=self._write_records, name="SqliteStateStore")
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _load(self):
+        for state, count in self._connection.execute(
+                "SELECT state, COUNT(*) FROM records GROUP BY state"):
+            self._counts[state] = count
+        active_states = [state for state in valid_states if state not in terminal_states]
+        rows = self._connection.execute(
+            "SELECT id, state, updated, data FROM records WHERE state IN ({0}) "
+            "ORDER BY updated".format(",".join("?" * len(active_states))), active_states)
+        for row in rows:
+            self._active.put(SqliteStateStore._to_record(row))
+        self._logger.info("Loaded state store with {0} records, {1} of them active"
+                          .format(sum(self._counts.values()), self._active.count()))
+
+    def put(self, record):
+        validate_state(record.state)
+        data = json.dumps(record.data)
+        with self._lock:
+            previous = self._active.get(record.id) or self._pending.get(record.id)
+            if previous is not None:
+                self._counts[previous.state] -= 1
+            self._counts[record.state] += 1
+            if record.state in terminal_states:
+                self._active.remove(record.id)
+            else:
+                self._active.put(record)
+            self._pending[record.id] = record
+            # Whether the record may be an update of a record only in the database
+            self._writes.put((record, data, previous is None))
+
+    def _write_records(self):
+        stopped = False
+        while not stopped:
+            batch = [self._writes.get()]
+            while True:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            stopped = None in batch
+            writes = [write for write in batch if write is not None]
+            try:
+                with self._db_lock:
+                    for record, data, maybe_stored in writes:
+                        if maybe_stored:
+                            self._correct_count(record)
+                        self._connection.execute(
+                            "INSERT OR REPLACE INTO records (id, state, updated, data) "
+                            "VALUES (?, ?, ?, ?)", (record.id, record.state, record.updated, data))
+                    self._connection.commit()
+            except Exception:
+                self._logger.exception("Failed to write {0} records".format(len(writes)))
+            with self._lock:
+                for record, _, _ in writes:
+                    if self._pending.get(record.id) is record:
+                        del self._pending[record.id]
+            for _ in batch:
+                self._writes.task_done()
+
+    def _correct_count(self, record):
+        # A record that was only in the database was counted as new in put
+        row = self._connection.execute("SELECT state FROM records WHERE id = ?",
+                                       (record.id,)).fetchone()
+        if row is not None:
+            with self._lock:
+                self._counts[row[0]] -= 1
+
+    def flush(self):
+        """Waits until the records put so far have been written to the database"""
+        self._writes.join()
+
+    def get(self, record_id):
+        record = self._active.get(record_id)
+        if record is None:
+            with self._lock:
+                record = self._pending.get(record_id)
+        if record is None:
+            with self._read_lock:
+                row = self._reader.execute(
+                    "SELECT id, state, updated, data FROM records WHERE id = ?",
+                    (record_id,)).fetchone()
+            if row is not None:
+                record = SqliteStateStore._to_record(row)
+        return record
+
+    def count(self, state=None):
+        if state is None:
+            return sum(self._counts.values())
+        validate_state(state)
+        return self._counts[state]
+
+    def list(self, state=None, limit=None):
+        if state is not None:
+            validate_state(state)
+            if state not in terminal_states:
+                return self._active.list(state, limit)
+        # Taken before the query, so that records written in between are in one of them. The
+        # pending records replace the rows with their ids, which are older or the same.
+        with self._lock:
+            pending_ids = set(self._pending)
+            pending = [record for record in self._pending.values()
+                       if state is None or record.state == state]
+        sql = "SELECT id, state, updated, data FROM records"
+        params = []
+        if state is not None:
+            sql += " WHERE state = ?"
+            params.append(state)
+        sql += " ORDER BY updated DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit + len(pending_ids))
+        with self._read_lock:
+            rows = self._reader.execute(sql, params).fetchall()
+        records = [record for record in (SqliteStateStore._to_record(row) for row in rows)
+                   if record.id not in pending_ids]
+        records.extend(pending)
+        records.sort(key=lambda record: record.updated, reverse=True)
+        return records[:limit]
+
+    def close(self):
+        """Writes the pending records and closes the database"""
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+        with self._db_lock:
+            self._connection.close()
+        with self._read_lock:
+            self._reader.close()
+
+    @staticmethod
+    def _to_record(row):
+        record_id, state, updated, data = row
+        return StateRecord(record_id, state, updated, json.loads(data) if data else {})
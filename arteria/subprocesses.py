@@ -0,0 +1,406 @@
+import logging
+import os
+import signal
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import tornado.ioloop
+import tornado.locks
+import tornado.process
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.iostream import StreamClosedError
+
+from arteria.exceptions import ArteriaUsageException
+from arteria.web.state import State
+
+
+def state_for_exit_status(returncode, cancelled=False):
+    """
+    Maps the exit status of a process to a State: 0 is DONE, anything else ERROR,
+    unless the process was cancelled
+    """
+    if cancelled:
+        return State.CANCELLED
+    return State.DONE if returncode == 0 else State.ERROR
+
+
+class RotatingOutput(object):
+    """
+    Writes a stream of bytes to a file, rotating it when it exceeds max_bytes,
+    so that the output of long running tools doesn't fill up the disk.
+    The rotated files are named <path>.1 (the most recent) to <path>.<backup_count>.
+    Writes are buffered until flush or close.
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=3):
+        self.path = path
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._file = open(path, "wb")
+        self._size = 0
+
+    def write(self, data):
+        if self._max_bytes and self._size + len(data) > self._max_bytes and self._size > 0:
+            self._rotate()
+        self._file.write(data)
+        self._size += len(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self._backup_count - 1, 0, -1):
+            source = "{0}.{1}".format(self.path, i)
+            if os.path.exists(source):
+                os.rename(source, "{0}.{1}".format(self.path, i + 1))
+        if self._backup_count > 0:
+            os.rename(self.path, self.path + ".1")
+        self._file = open(self.path, "wb")
+        self._size = 0
+
+    def close(self):
+        self._file.close()
+
+
+class _OutputWriter(object):
+    """
+    Writes the output of processes to RotatingOutputs on a thread of its own, so that slow
+    log directories, e.g. on NFS or Lustre, don't block the IOLoop. The outputs are flushed
+    after each batch of writes.
+
+    write returns a Future to wait for when more than max_pending bytes are waiting to be
+    written, so that the output of a process isn't read faster than it can be written.
+    """
+
+    def __init__(self, max_pending, logger):
+        self._max_pending = max_pending
+        self._logger = logger
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._waiters = []
+        self._thread = None
+
+    def write(self, output, data):
+        """Queues the write, returning None or a Future to wait for, see the class docs"""
+        self._start()
+        with self._lock:
+            self._pending += len(data)
+            waiter = None
+            if self._pending > self._max_pending:
+                waiter = Future()
+                self._waiters.append((tornado.ioloop.IOLoop.current(), waiter))
+        self._queue.put((output, data, None))
+        return waiter
+
+    def close(self, output):
+        """Returns a Future that resolves when the queued writes are done and output is closed"""
+        self._start()
+        closed = Future()
+        self._queue.put((output, None, (tornado.ioloop.IOLoop.current(), closed)))
+        return closed
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write_outputs, name="SubprocessOutput")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _write_outputs(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            written = set()
+            for output, data, closed in batch:
+                try:
+                    if closed is None:
+                        output.write(data)
+                        written.add(output)
+                    else:
+                        written.discard(output)
+                        output.close()
+                except (IOError, OSError) as e:
+                    self._logger.warning("Failed to write to {0}: {1}".format(output.path, e))
+                if closed is not None:
+                    io_loop, future = closed
+                    io_loop.add_callback(future.set_result, None)
+            for output in written:
+                try:
+                    output.flush()
+                except (IOError, OSError) as e:
+                    self._logger.warning("Failed to write to {0}: {1}".format(output.path, e))
+            with self._lock:
+                self._pending -= sum(len(data) for _, data, _ in batch if data is not None)
+                if self._pending <= self._max_pending:
+                    waiters, self._waiters = self._waiters, []
+                else:
+                    waiters = []
+            for io_loop, waiter in waiters:
+                io_loop.add_callback(waiter.set_result, None)
+
+
+class ProcessHandle(object):
+    """
+    A command run by the SubprocessRunner. The future done resolves to the handle
+    when the process has finished, failed or been cancelled.
+    """
+
+    def __init__(self, process_id, args, tool, stdout_path, stderr_path):
+        self.id = process_id
+        self.args = args
+        self.tool = tool
+        self.state = State.PENDING
+        self.pid = None
+        self.returncode = None
+        self.stdout_path = stdout_path
+        self.stderr_path = stderr_path
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = Future()
+        self.cancelled = False
+        self._process = None
+
+    def to_dict(self):
+        return {"id": self.id, "args": self.args, "tool": self.tool, "state": self.state,
+                "pid": self.pid, "returncode": self.returncode,
+                "stdout": self.stdout_path, "stderr": self.stderr_path,
+                "created": self.created, "started": self.started, "finished": self.finished}
+
+
+class SubprocessRunner(object):
+    """
+    Runs external tools without blocking the IOLoop
+
+    Stdout and stderr are streamed to rotating files in log_dir rather than buffered in
+    memory. The files are written on a thread, so that a slow log_dir doesn't block the
+    IOLoop. At most max_processes commands run at a time, and at most tool_limits[tool]
+    of each tool, the rest wait in turn. Every process runs in its own process group, so
+    that cancelling it also kills the processes it has started.
+
+    Must be used on the IOLoop thread.
+
+    Usage example:
+        runner = SubprocessRunner("/var/log/arteria/processes", max_processes=8,
+                                  tool_limits={"bcl2fastq": 1}, nice=10)
+        handle = yield runner.run(["bcl2fastq", "-R", runfolder], tool="bcl2fastq")
+        if handle.state == State.ERROR:
+            ...
+    """
+
+    READ_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, log_dir, max_processes=4, tool_limits=None, nice=None, cpu_affinity=None,
+                 max_log_bytes=10 * 1024 * 1024, log_backups=3, kill_timeout=10,
+                 max_finished=1000, logger=None):
+        """
+        :param log_dir: The directory to write the output of the processes to
+        :param max_processes: The maximum number of processes running at a time
+        :param tool_limits: The maximum number of processes running at a time per tool
+        :param nice: The default niceness increment of the processes
+        :param cpu_affinity: The default set of CPUs the processes may run on (Linux only)
+        :param max_log_bytes: The size at which output files are rotated
+        :param log_backups: The number of rotated output files to keep
+        :param kill_timeout: Seconds to wait after SIGTERM before killing cancelled processes
+        :param max_finished: The number of ended processes to keep track of
+        """
+        self._logger = logger or logging.getLogger(__name__)
+        self._log_dir = log_dir
+        self._semaphore = tornado.locks.Semaphore(max_processes)
+        self._tool_limits = dict(tool_limits or {})
+        self._tool_semaphores = {}
+        self._nice = nice
+        self._cpu_affinity = cpu_affinity
+        self._max_log_bytes = max_log_bytes
+        self._log_backups = log_backups
+        self._kill_timeout = kill_timeout
+        self._max_finished = max_finished
+        self._processes = OrderedDict()
+        self._finished = OrderedDict()
+        self._listeners = []
+        # At most a few chunks per process wait to be written
+        self._output_writer = _OutputWriter(4 * self.READ_CHUNK_SIZE * max_processes,
+                                            self._logger)
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+
+    def add_listener(self, listener):
+        """Adds a listener that is called with (handle, state) whenever a process changes state"""
+        self._listeners.append(listener)
+
+    def start(self, args, tool=None, cwd=None, env=None, nice=None, cpu_affinity=None,
+              process_id=None):
+        """
+        Starts running the command, or queues it if the concurrency limits are reached
+
+        :param args: The command, as a list of arguments
+        :param tool: The name of the tool, used for the per-tool limits. Defaults to
+                     the basename of the executable.
+        :param nice: Overrides the default niceness increment
+        :param cpu_affinity: Overrides the default CPU affinity
+        :return: A ProcessHandle
+        """
+        if not args:
+            raise ArteriaUsageException("No command to run")
+        process_id = process_id or str(uuid.uuid4())
+        if process_id in self._processes:
+            raise ArteriaUsageException("A process with id '{0}' already exists".format(process_id))
+        tool = tool or os.path.basename(args[0])
+        handle = ProcessHandle(process_id, list(args), tool,
+                               os.path.join(self._log_dir, process_id + ".stdout"),
+                               os.path.join(self._log_dir, process_id + ".stderr"))
+        self._processes[process_id] = handle
+        preexec_fn = self._preexec_fn(self._nice if nice is None else nice,
+                                      self._cpu_affinity if cpu_affinity is None else cpu_affinity)
+        self._notify(handle, State.PENDING)
+        tornado.ioloop.IOLoop.current().add_callback(self._run, handle, cwd, env, preexec_fn)
+        return handle
+
+    def run(self, args, **kwargs):
+        """Like start, but returns a Future resolving to the handle when the process has ended"""
+        return self.start(args, **kwargs).done
+
+    def get(self, process_id):
+        try:
+            return self._processes[process_id]
+        except KeyError:
+            raise UnknownProcessError("There is no process with id '{0}'".format(process_id))
+
+    def list(self):
+        return list(self._processes.values())
+
+    def cancel(self, process_id):
+        """
+        Cancels the process. A running process group is sent SIGTERM, and SIGKILL if it hasn't
+        exited after kill_timeout seconds. A queued process is never started.
+
+        :return: True if the process was cancelled, False if it had already ended
+        """
+        handle = self.get(process_id)
+        if handle.done.done():
+            return False
+        handle.cancelled = True
+        if handle.pid is None:
+            # Still waiting for its turn, _run won't start it
+            self._finish(handle, State.CANCELLED)
+        else:
+            self._kill(handle, signal.SIGTERM)
+            tornado.ioloop.IOLoop.current().call_later(
+                self._kill_timeout, self._kill, handle, signal.SIGKILL)
+        return True
+
+    def _kill(self, handle, signum):
+        if handle.returncode is not None:
+            return
+        try:
+            os.killpg(handle.pid, signum)
+        except OSError:
+            # The process group is already gone
+            pass
+
+    def _tool_semaphore(self, tool):
+        if tool not in self._tool_limits:
+            return None
+        if tool not in self._tool_semaphores:
+            self._tool_semaphores[tool] = tornado.locks.Semaphore(self._tool_limits[tool])
+        return self._tool_semaphores[tool]
+
+    @staticmethod
+    def _preexec_fn(nice, cpu_affinity):
+        def preexec():
+            # A process group of its own, so that the whole group can be killed
+            os.setsid()
+            if nice:
+                os.nice(nice)
+            if cpu_affinity and hasattr(os, "sched_setaffinity"):
+                os.sched_setaffinity(0, cpu_affinity)
+        return preexec
+
+    @gen.coroutine
+    def _run(self, handle, cwd, env, preexec_fn):
+        tool_semaphore = self._tool_semaphore(handle.tool)
+        acquired = []
+        try:
+            for semaphore in filter(None, [tool_semaphore, self._semaphore]):
+                yield semaphore.acquire()
+                acquired.append(semaphore)
+            if handle.cancelled:
+                return
+            yield self._execute(handle, cwd, env, preexec_fn)
+        except Exception as e:
+            self._logger.exception("Failed to run {0}".format(handle.args))
+            self._finish(handle, State.ERROR, error=e)
+        finally:
+            for semaphore in reversed(acquired):
+                semaphore.release()
+
+    @gen.coroutine
+    def _execute(self, handle, cwd, env, preexec_fn):
+        stdout = RotatingOutput(handle.stdout_path, self._max_log_bytes, self._log_backups)
+        stderr = RotatingOutput(handle.stderr_path, self._max_log_bytes, self._log_backups)
+        try:
+            process = tornado.process.Subprocess(handle.args, stdout=tornado.process.Subprocess.STREAM,
+                                                 stderr=tornado.process.Subprocess.STREAM,
+                                                 cwd=cwd, env=env, preexec_fn=preexec_fn)
+            handle._process = process
+            handle.pid = process.pid
+            handle.started = time.time()
+            self._logger.info("Started {0} with pid {1}".format(handle.args, handle.pid))
+            self._notify(handle, State.STARTED)
+            handle.returncode, _, _ = yield [process.wait_for_exit(raise_error=False),
+                                             self._pump(process.stdout, stdout),
+                                             self._pump(process.stderr, stderr)]
+        finally:
+            # The output is complete once the process is done
+            yield [self._output_writer.close(stdout), self._output_writer.close(stderr)]
+        self._finish(handle, state_for_exit_status(handle.returncode, handle.cancelled))
+
+    @gen.coroutine
+    def _pump(self, stream, output):
+        while True:
+            try:
+                data = yield stream.read_bytes(self.READ_CHUNK_SIZE, partial=True)
+            except StreamClosedError:
+                break
+            waiter = self._output_writer.write(output, data)
+            if waiter is not None:
+                # The output is written slower than it is read
+                yield waiter
+
+    def _finish(self, handle, state, error=None):
+        handle.finished = time.time()
+        handle._process = None
+        self._logger.info("Process {0} ({1}) ended with exit status {2}: {3}"
+                          .format(handle.id, handle.tool, handle.returncode, state))
+        self._notify(handle, state)
+        if not handle.done.done():
+            handle.done.set_result(handle)
+        self._finished[handle.id] = True
+        while len(self._finished) > self._max_finished:
+            process_id, _ = self._finished.popitem(last=False)
+            del self._processes[process_id]
+
+    def _notify(self, handle, state):
+        handle.state = state
+        for listener in self._listeners:
+            try:
+                listener(handle, state)
+            except Exception:
+                self._logger.exception("Process listener failed for {0}".format(handle.id))
+
+
+class UnknownProcessError(ArteriaUsageException):
+    pass
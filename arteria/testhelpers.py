@@ -1,12 +1,49 @@
 import time
-import requests
 import re
 import json
+import math
+import os
+import socket
+import threading
+import timeit
 
 import unittest
 
 
+def create_session(pool_size=10):
+    """Returns a requests Session keeping up to pool_size connections per host alive"""
+    # Imported here, so that importing the helpers doesn't import requests
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 class BaseRestTest(unittest.TestCase):
+    """
+    Base class for integration tests of a REST service
+
+    The requests of all tests in a class share a session, so connections are reused.
+    """
+
+    _session = None
+
+    @property
+    def session(self):
+        cls = type(self)
+        if cls._session is None:
+            cls._session = create_session()
+        return cls._session
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls._session is not None:
+            cls._session.close()
+            cls._session = None
+        super(BaseRestTest, cls).tearDownClass()
+
     def _base_url(self):
         raise NotImplementedError("The method base url must be implemented")
 
@@ -28,7 +65,7 @@ class BaseRestTest(unittest.TestCase):
         """
         json_body = json.dumps(obj)
         full_url = self._get_full_url(url)
-        resp = requests.put(full_url, json_body)
+        resp = self.session.put(full_url, json_body)
         self._validate_response(resp, expect)
         return resp
 
@@ -41,7 +78,7 @@ class BaseRestTest(unittest.TestCase):
         :param expect: The expected status code
         """
         full_url = self._get_full_url(url)
-        resp = requests.get(full_url)
+        resp = self.session.get(full_url)
         self._validate_response(resp, expect)
         try:
             resp.body_obj = json.loads(resp.text)
@@ -49,6 +86,216 @@ class BaseRestTest(unittest.TestCase):
             resp.body_obj = None
         return resp
 
+    def load(self, url, count=100, concurrency=10, method="GET", obj=None):
+        """
+        Sends requests to the url, concurrency at a time, see run_load
+
+        A starting '.' is replaced with the base url
+        :return: A LoadTestResult
+        """
+        return run_load(self._get_full_url(url), count, concurrency, method, obj)
+
+    def assert_load(self, result, p50=None, p95=None, p99=None, min_throughput=None,
+                    max_errors=0):
+        """
+        Asserts that a LoadTestResult is within the limits, e.g.:
+
+            result = self.load("./runfolders", count=500, concurrency=20)
+            self.assert_load(result, p99=200, min_throughput=100)
+
+        :param p50: The highest acceptable median latency, in milliseconds
+        :param p95: The highest acceptable 95th percentile latency, in milliseconds
+        :param p99: The highest acceptable 99th percentile latency, in milliseconds
+        :param min_throughput: The lowest acceptable number of requests per second
+        :param max_errors: The highest acceptable number of failed requests
+        """
+        for name, limit in (("p50", p50), ("p95", p95), ("p99", p99)):
+            if limit is not None:
+                actual = getattr(result, name)
+                self.assertLessEqual(actual, limit, "{0} latency {1:.1f} ms above {2} ms ({3})"
+                                     .format(name, actual, limit, result))
+        if min_throughput is not None:
+            self.assertGreaterEqual(result.throughput, min_throughput,
+                                    "Throughput below {0}/s ({1})".format(min_throughput, result))
+        self.assertLessEqual(result.errors, max_errors,
+                             "{0} requests failed ({1})".format(result.errors, result))
+
+
+class LoadTestResult(object):
+    """
+    The outcome of a load test. Latencies are in milliseconds, throughput in requests per second.
+    """
+
+    def __init__(self, latencies, errors, duration):
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.duration = duration
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    @property
+    def throughput(self):
+        return self.requests / self.duration if self.duration > 0 else 0.0
+
+    def percentile(self, percent):
+        """Returns the latency below which percent of the requests completed (nearest rank)"""
+        if not self.latencies:
+            return 0.0
+        rank = int(math.ceil(percent / 100.0 * len(self.latencies))) - 1
+        return self.latencies[min(max(rank, 0), len(self.latencies) - 1)]
+
+    @property
+    def p50(self):
+        return self.percentile(50)
+
+    @property
+    def p95(self):
+        return self.percentile(95)
+
+    @property
+    def p99(self):
+        return self.percentile(99)
+
+    def to_dict(self):
+        return {"requests": self.requests, "errors": self.errors, "duration": self.duration,
+                "throughput": self.throughput, "p50": self.p50, "p95": self.p95, "p99": self.p99}
+
+    def __str__(self):
+        return ("{0} requests, {1} errors, {2:.1f} requests/s, "
+                "p50 {3:.1f} ms, p95 {4:.1f} ms, p99 {5:.1f} ms"
+                .format(self.requests, self.errors, self.throughput, self.p50, self.p95, self.p99))
+
+
+def run_load(url, count=100, concurrency=10, method="GET", obj=None):
+    """
+    Sends count requests to the url from concurrency threads, sharing a pool of connections,
+    and measures the latency of each. Responses with a status of 400 or above, and
+    connection errors, count as errors.
+
+    :param obj: A Python object to send as the JSON body
+    :return: A LoadTestResult
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    session = create_session(concurrency)
+    body = json.dumps(obj) if obj is not None else None
+    timer = timeit.default_timer
+
+    def send(_):
+        start = timer()
+        try:
+            ok = session.request(method, url, data=body).status_code < 400
+        except Exception:
+            ok = False
+        return (timer() - start) * 1000, ok
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            start = timer()
+            outcomes = list(executor.map(send, range(count)))
+            duration = timer() - start
+    finally:
+        session.close()
+    return LoadTestResult([latency for latency, _ in outcomes],
+                          sum(1 for _, ok in outcomes if not ok), duration)
+
+
+def unused_port():
+    """Returns a TCP port that is free to listen on"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+class AppServiceRunner(object):
+    """
+    Runs an AppService on a background thread, for integration and load tests against
+    a live server in the same process
+
+    Usage example:
+        app_svc = AppService(config_svc, debug=False, port=unused_port())
+        with AppServiceRunner(app_svc, routes) as runner:
+            result = run_load(runner.base_url + "/api/1.0/runfolders", count=500)
+    """
+
+    def __init__(self, app_svc, routes):
+        self.app_svc = app_svc
+        self._routes = routes
+        self._thread = None
+        self.base_url = "http://127.0.0.1:{0}".format(app_svc._port)
+
+    def start(self, timeout=10):
+        """Starts the service and waits until it accepts connections"""
+        self._thread = threading.Thread(target=self._run, name="AppServiceRunner")
+        self._thread.daemon = True
+        self._thread.start()
+        deadline = time.time() + timeout
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.app_svc._port), timeout=1).close()
+                return self
+            except socket.error:
+                if time.time() > deadline or not self._thread.is_alive():
+                    raise RuntimeError("The service didn't start on {0}".format(self.base_url))
+                time.sleep(0.01)
+
+    def _run(self):
+        import tornado.ioloop
+        try:
+            import asyncio
+            asyncio.set_event_loop(asyncio.new_event_loop())
+        except ImportError:
+            tornado.ioloop.IOLoop().make_current()
+        self.app_svc.start(list(self._routes))
+        tornado.ioloop.IOLoop.current().close(all_fds=True)
+
+    def stop(self):
+        self.app_svc.stop()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def import_times(module, repeat=3):
+    """
+    Imports the module in new interpreters with python -X importtime (Python 3.7 and later),
+    returning the cumulative import time in microseconds of every module imported, by name.
+    The best time of repeat runs is returned for each module.
+    """
+    import subprocess
+    import sys
+    env = dict(os.environ)
+    # The arteria package imported here is the one measured
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    times = {}
+    for _ in range(repeat):
+        process = subprocess.Popen([sys.executable, "-X", "importtime", "-c", "import " + module],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        _, err = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError("Importing {0} failed: {1}".format(module, err.decode("utf-8")))
+        for line in err.decode("utf-8").splitlines():
+            fields = line.split("|")
+            if not line.startswith("import time:") or len(fields) != 3:
+                continue
+            try:
+                cumulative = int(fields[1])
+            except ValueError:
+                # The header line
+                continue
+            name = fields[2].strip()
+            times[name] = min(cumulative, times.get(name, cumulative))
+    return times
+
 
 class TestFunctionDelta:
     """
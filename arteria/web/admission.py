@@ -0,0 +1,280 @@
+import logging
+from collections import deque
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.web import URLSpec
+
+from arteria.exceptions import ArteriaUsageException
+from arteria.web.metrics import timer
+
+# The key in the kwargs of a route tuple that declares the limits of the route
+ROUTE_KEY = "admission"
+
+
+class Gate(object):
+    """
+    Lets at most max_concurrent requests through at a time, and queues at most max_queue
+    more. Only used on the IOLoop thread.
+    """
+
+    def __init__(self, label, max_concurrent, max_queue=0, retry_after=1):
+        if max_concurrent < 1:
+            raise ArteriaUsageException("max_concurrent of {0} must be at least 1".format(label))
+        self.label = label
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.active = 0
+        self.rejected = 0
+        self.wait_count = 0
+        self.wait_sum = 0.0
+        self._waiters = deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def enter(self):
+        """
+        Enters the gate, returning None if admitted right away, or a Future that
+        resolves when admitted
+
+        :raises: AdmissionRejectedError if the queue is full
+        """
+        if self.active < self.max_concurrent:
+            self.active += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejectedError("Too many concurrent requests to {0}".format(self.label),
+                                         self.retry_after)
+        waiter = Future()
+        self._waiters.append(waiter)
+        return waiter
+
+    def cancel(self, waiter):
+        """
+        Gives up the place of a waiter returned by enter, e.g. when the client has
+        disconnected. The waiter fails with AdmissionCancelledError, or if it has been
+        admitted already, the gate is left.
+        """
+        if waiter.done():
+            self.leave()
+        else:
+            self._waiters.remove(waiter)
+            waiter.set_exception(AdmissionCancelledError(
+                "Stopped waiting for {0}".format(self.label)))
+
+    def leave(self):
+        # Hand the slot over to the next waiter, if any
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def record_wait(self, seconds):
+        self.wait_count += 1
+        self.wait_sum += seconds
+
+
+class Admission(object):
+    """
+    A request passing through the gates of its route, and the global gate
+    """
+
+    def __init__(self, gates):
+        self._gates = gates
+        self._entered = []
+        # The gate and waiter while queued
+        self._waiting = None
+
+    def start(self):
+        """
+        Enters the gates, returning None if admitted right away, or a Future that
+        resolves when admitted
+
+        :raises: AdmissionRejectedError if the queue of a gate is full. The Future
+                 can fail with it too.
+        """
+        for index, gate in enumerate(self._gates):
+            waiter = gate.enter()
+            if waiter is not None:
+                return self._wait(waiter, index)
+            self._entered.append(gate)
+        return None
+
+    @gen.coroutine
+    def _wait(self, waiter, index):
+        for gate in self._gates[index:]:
+            if waiter is None:
+                waiter = gate.enter()
+            if waiter is not None:
+                self._waiting = (gate, waiter)
+                queued_at = timer()
+                yield waiter
+                if self._waiting is None:
+                    # Cancelled after being admitted, and the gate has been left already
+                    raise AdmissionCancelledError("Stopped waiting for {0}".format(gate.label))
+                self._waiting = None
+                gate.record_wait(timer() - queued_at)
+                waiter = None
+            self._entered.append(gate)
+
+    def cancel(self):
+        """
+        Stops waiting to be admitted, e.g. when the client has disconnected, and leaves the
+        gates entered so far. Does nothing if the request isn't waiting. The Future from
+        start then fails with AdmissionCancelledError.
+        """
+        if self._waiting is None:
+            return
+        gate, waiter = self._waiting
+        self._waiting = None
+        gate.cancel(waiter)
+        self.release()
+
+    def release(self):
+        for gate in reversed(self._entered):
+            gate.leave()
+        self._entered = []
+
+
+class AdmissionController(object):
+    """
+    Limits the number of concurrent requests, globally and per route
+
+    Requests over the limit are queued, up to max_queue of them, and the rest are
+    rejected with 503 Service Unavailable and a Retry-After header. Only the handlers
+    registered with register_routes are limited, so the admin routes are exempt.
+
+    Limits per route are set in the kwargs of the route tuple:
+
+        (r"/api/1.0/runfolders", RunfoldersHandler,
+            dict(runfolder_svc=svc, admission=dict(max_concurrent=4, max_queue=10)))
+
+    or under 'routes' in the config, by route pattern. A trailing $ is not part of the pattern,
+    so /api/1.0/runfolders matches both the route tuple r"/api/1.0/runfolders" and
+    URLSpec(r"/api/1.0/runfolders", ...), whose regex pattern tornado ends with $. The config
+    is read from the key 'admission' in the app config:
+
+        admission:
+            max_concurrent: 100
+            max_queue: 200
+            retry_after: 5
+            routes:
+                /api/1.0/runfolders: {max_concurrent: 4, max_queue: 10}
+
+    Limits apply per handler class, so a handler class used in several routes shares one
+    limit between them, and the routes of a handler class can't have different limits.
+    Handler classes with the class attribute admission set to False, e.g. for long polls and
+    event streams, are not limited.
+    """
+
+    def __init__(self, config=None, logger=None):
+        self._logger = logger or logging.getLogger(__name__)
+        config = config or {}
+        self._retry_after = config.get("retry_after", 1)
+        self._route_config = config.get("routes") or {}
+        self._global_gate = None
+        if config.get("max_concurrent"):
+            self._global_gate = Gate("all routes", config["max_concurrent"],
+                                     config.get("max_queue", 0), self._retry_after)
+        self._route_gates = []
+        self._gates_by_handler = {}
+
+    def register_routes(self, routes):
+        """
+        Sets up the limits for the handlers in the tornado routes
+
+        :return: The routes, without the admission limits in their kwargs
+        :raises: ArteriaUsageException if the routes of a handler class have different limits
+        """
+        patterns = {}
+        limits = {}
+        stripped = []
+        for route in routes:
+            if isinstance(route, URLSpec):
+                pattern, handler_class = route.regex.pattern, route.handler_class
+                kwargs = route.kwargs
+            else:
+                pattern, handler_class = route[0], route[1]
+                kwargs = route[2] if len(route) > 2 else None
+            if pattern.endswith("$"):
+                pattern = pattern[:-1]
+            limit = self._route_config.get(pattern)
+            if kwargs and ROUTE_KEY in kwargs:
+                kwargs = dict(kwargs)
+                limit = kwargs.pop(ROUTE_KEY)
+                if isinstance(route, URLSpec):
+                    route.kwargs = kwargs
+                else:
+                    route = (route[0], route[1], kwargs) + tuple(route[3:])
+            if handler_class in patterns and limits[handler_class] != limit:
+                raise ArteriaUsageException(
+                    "The routes {0} and {1} of {2} have different admission limits, but limits "
+                    "apply per handler class".format(patterns[handler_class][0], pattern,
+                                                     handler_class.__name__))
+            limits[handler_class] = limit
+            patterns.setdefault(handler_class, []).append(pattern)
+            stripped.append(route)
+
+        self._route_gates = []
+        self._gates_by_handler = {}
+        for handler_class, handler_patterns in patterns.items():
+            if not getattr(handler_class, "admission", True):
+                continue
+            gates = []
+            limit = limits.get(handler_class)
+            if limit:
+                gate = Gate("|".join(handler_patterns), limit["max_concurrent"],
+                            limit.get("max_queue", 0), limit.get("retry_after", self._retry_after))
+                self._route_gates.append(gate)
+                gates.append(gate)
+            if self._global_gate is not None:
+                gates.append(self._global_gate)
+            if gates:
+                self._gates_by_handler[handler_class] = gates
+        return stripped
+
+    def enter(self, handler_class):
+        """
+        Returns an Admission for a request to the handler class, to start and release,
+        or None if the handler isn't limited
+        """
+        gates = self._gates_by_handler.get(handler_class)
+        if gates is None:
+            return None
+        return Admission(gates)
+
+    def collect(self):
+        """A collector for the MetricsRegistry"""
+        gates = list(self._route_gates)
+        if self._global_gate is not None:
+            gates.append(self._global_gate)
+        return [
+            ("arteria_admission_active", "gauge", "Number of admitted requests being handled",
+             [({"route": gate.label}, gate.active) for gate in gates]),
+            ("arteria_admission_queued", "gauge", "Number of requests waiting to be admitted",
+             [({"route": gate.label}, gate.queued) for gate in gates]),
+            ("arteria_admission_rejected_total", "counter",
+             "Number of requests rejected because the queue was full",
+             [({"route": gate.label}, gate.rejected) for gate in gates]),
+            ("arteria_admission_wait_seconds", "summary",
+             "Time queued requests waited to be admitted",
+             [({"route": gate.label}, gate.wait_sum, "_sum") for gate in gates] +
+             [({"route": gate.label}, gate.wait_count, "_count") for gate in gates]),
+        ]
+
+
+class AdmissionRejectedError(ArteriaUsageException):
+
+    def __init__(self, message, retry_after):
+        super(AdmissionRejectedError, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionCancelledError(ArteriaUsageException):
+    pass
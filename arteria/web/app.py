@@ -1,11 +1,29 @@
 import tornado.web
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.process
+import functools
 import logging
-import logging.config
+import json
 import os
 from arteria.configuration import ConfigurationService
+from arteria.exceptions import ArteriaUsageException
+from arteria.executors import ExecutorService
+from arteria.web.admission import AdmissionController
 from arteria.web.routes import RouteService
-from arteria.web.handlers import LogLevelHandler, ApiHelpHandler
-from argparse import ArgumentParser
+from arteria.web.handlers import LogLevelHandler, ApiHelpHandler, MetricsHandler, \
+    ProfilingHandler, HealthHandler
+from arteria.web.metrics import MetricsRegistry, process_metrics
+from arteria.web.tracing import Tracer
+from arteria.web.watchdog import IOLoopWatchdog
+from arteria.web.profiling import ProfilingService
+from arteria.web.workers import SharedSetting
+from arteria.web.encoding import set_json_encoder
+from arteria.web import logs
+
+# The size of the log levels shared between the workers
+LOG_LEVELS_MAX_LENGTH = 64 * 1024
 
 
 class AppService:
@@ -35,13 +53,70 @@ class AppService:
             # Now start the service.
             # The port will come from the command line argument --port
             app_svc.start(routes)
+
+    The service can be run in several worker processes, by supplying --workers
+    on the command line or the key 'workers' in the app config. The socket is then
+    bound once and shared by the forked workers, or, if the app config key
+    'reuse_port' is true, bound by each worker with SO_REUSEPORT. reuse_port requires
+    tornado 4.4 or later, with older versions the shared socket is used.
     """
 
-    def __init__(self, config_svc, debug, port, logger=None):
-        """Sets up the admin service and configures logging"""
+    def __init__(self, config_svc, debug, port, logger=None, workers=1, reuse_port=False,
+                 max_restarts=100, json_encoder="auto", compress_response=False,
+                 async_logging=None, executors=None, admission=None, watchdog=None,
+                 tracing=None):
+        """
+        Sets up the admin service and configures logging
+
+        :param workers: The number of worker processes to fork when started
+        :param reuse_port: If True, each worker binds its own socket with SO_REUSEPORT
+        :param max_restarts: The number of times crashed workers are restarted before giving up
+        :param json_encoder: The JSON encoder for responses: orjson, ujson, json or auto
+        :param compress_response: If True, responses are gzipped for clients that accept it
+        :param async_logging: If set, a dict with the optional keys queue_size and overflow
+                              (drop_new, drop_oldest or block). The handlers of the root logger
+                              are then run on a background thread once the service is started,
+                              see arteria.web.logs.AsyncLogging.
+        :param executors: The config of the pools handlers can offload blocking work to,
+                          see arteria.executors.ExecutorService
+        :param admission: The config of the concurrency limits of the routes,
+                          see arteria.web.admission.AdmissionController
+        :param watchdog: A dict with the optional keys interval and threshold, in seconds,
+                         for the IOLoop watchdog, or False to disable it.
+                         See arteria.web.watchdog.IOLoopWatchdog.
+        :param tracing: If set, a dict with the optional keys sample_rate, slow_threshold and
+                        server_timing. Requests then get request IDs and Server-Timing
+                        headers, see arteria.web.tracing.Tracer.
+        """
         self.config_svc = config_svc
         self.route_svc = RouteService(self, debug)
         self._debug = debug
+        self._workers = int(workers)
+        self._reuse_port = reuse_port
+        self._max_restarts = max_restarts
+        self._compress_response = compress_response
+
+        if self._workers > 1 and debug:
+            # Autoreload in debug mode doesn't work with forked workers
+            self._workers = 1
+
+        # The log levels are shared between the workers, so that changing one
+        # through any of them changes it in all of them
+        self._shared_log_level = SharedSetting(max_length=LOG_LEVELS_MAX_LENGTH) \
+            if self._workers > 1 else None
+        self._log_level_sync = None
+
+        self.metrics = MetricsRegistry()
+        self.metrics.add_collector(process_metrics)
+        self.watchdog = IOLoopWatchdog(**(watchdog or {})) if watchdog is not False else None
+        if self.watchdog is not None:
+            self.metrics.add_collector(self.watchdog.collect)
+        self.profiling_svc = ProfilingService()
+        self.executor_svc = ExecutorService(executors)
+        self.metrics.add_collector(self.executor_svc.collect)
+        self.admission = AdmissionController(admission)
+        self.metrics.add_collector(self.admission.collect)
+        self.tracer = Tracer(**tracing) if tracing else None
 
         try:
             self._port = int(port)
@@ -49,12 +124,25 @@ class AppService:
             raise InvalidPortError("Invalid port: '{port}'. Could not be cast to int.".format(port=port))
 
         # Initialize the logger configuration:
-        self._logger_config = config_svc.get_logger_config()
-        logging.config.dictConfig(self._logger_config)
+        self._async_logging = logs.AsyncLogging(**async_logging) if async_logging else None
+        self._async_logging_installed = False
+        self._configure_logging(config_svc.get_logger_config())
 
         self._logger = logger or logging.getLogger(__name__)
         self._logger.info("Logger initialized by AppService")
+        self._logger.info("Using the {0} JSON encoder".format(set_json_encoder(json_encoder)))
+        if self._reuse_port and tornado.version_info < (4, 4):
+            # bind_sockets has no reuse_port argument before tornado 4.4
+            self._logger.warning("reuse_port requires tornado 4.4 or later, using a socket "
+                                 "shared by the workers instead")
+            self._reuse_port = False
         self._tornado = None
+        self._server = None
+        self._io_loop = None
+        self._config_checker = None
+
+        # Re-apply the logger config when it changes on disk
+        config_svc.add_listener(self._on_config_changed)
 
     @classmethod
     def create(cls, product_name=None, config_root=None, args=None):
@@ -71,6 +159,8 @@ class AppService:
                                [--product <product name>]
                                [--debug]
                                [--configroot path]
+                               [--configcache path]
+                               [--workers N]
 
         These config files should be accessible:
             - /etc/arteria/<product_name>/app.config
@@ -79,11 +169,15 @@ class AppService:
         You can override this by supplying config_root, in which case they
         should be found at <config_root>/*.config
 
+        If --configcache is supplied, parsed config files are cached in that
+        directory, which speeds up the startup of services with large configs.
+
         :param product_name: Should by convention be __package__. This value
         can be overriden by supplying the --product parameter on the command
         line.
         """
 
+        from argparse import ArgumentParser
         parser = ArgumentParser()
         parser.add_argument(
                 "--product",
@@ -94,6 +188,12 @@ class AppService:
         parser.add_argument(
                 "--configroot",
                 dest="configroot", metavar="CONFIGROOT")
+        parser.add_argument(
+                "--configcache",
+                dest="configcache", metavar="CONFIGCACHE")
+        parser.add_argument(
+                "--workers",
+                dest="workers", metavar="WORKERS", type=int)
         parser.add_argument(
                 "--debug",
                 dest="debug", action="store_true", default=False)
@@ -117,7 +217,8 @@ class AppService:
         app_config_path = os.path.join(config_root, "app.config")
         config_svc = ConfigurationService(
                 logger_config_path=logger_config_path,
-                app_config_path=app_config_path)
+                app_config_path=app_config_path,
+                compiled_cache_dir=args.configcache)
 
         # Port from commandline should override,
         # otherwise pick the port specified in the config.
@@ -130,34 +231,185 @@ class AppService:
                     "You have to specify a port, either via the commandline,"
                     " or in the config (key: 'port').")
 
-        return cls(config_svc, args.debug, port)
+        # Workers from the commandline override the config
+        app_config = config_svc.get_app_config()
+        workers = args.workers or app_config.get("workers", 1)
 
-    def start(self, routes):
+        return cls(config_svc, args.debug, port,
+                   workers=workers,
+                   reuse_port=app_config.get("reuse_port", False),
+                   max_restarts=app_config.get("worker_max_restarts", 100),
+                   json_encoder=app_config.get("json_encoder", "auto"),
+                   compress_response=app_config.get("compress_response", False),
+                   async_logging=app_config.get("async_logging"),
+                   executors=app_config.get("executors"),
+                   admission=app_config.get("admission"),
+                   watchdog=app_config.get("watchdog"),
+                   tracing=app_config.get("tracing"))
+
+    def build_application(self, routes):
+        """
+        Returns the tornado Application serving the routes and the default routes,
+        without starting it. Used by start, and useful for testing in-process.
+        """
+        # The admin routes are added after the limits are set up, so they are exempt
+        routes = self.admission.register_routes(routes)
         # Add the default routes, such as the API handler
         routes.extend(self._get_default_routes())
         self.route_svc.set_routes(routes)
-        self._tornado = tornado.web.Application(self.route_svc.get_routes(), debug=self._debug)
-        self._logger.info("Starting the service on {0} (debug={1})"
-                          .format(self._port, self._debug))
-        self._tornado.listen(self._port)
-        tornado.ioloop.IOLoop.current().start()
-
-    def set_log_level(self, log_level):
-        # TODO: Directly change via logging module if possible
-        self._logger_config["handlers"]["file_handler"]["level"] = log_level
+        self.metrics.register_routes(routes)
+        return self.route_svc.create_application(debug=self._debug,
+                                                 metrics=self.metrics,
+                                                 executors=self.executor_svc,
+                                                 admission=self.admission,
+                                                 tracing=self.tracer,
+                                                 compress_response=self._compress_response)
+
+    def start(self, routes):
+        self._tornado = self.build_application(routes)
+        server = tornado.httpserver.HTTPServer(self._tornado)
+        self._server = server
+        if self._workers > 1:
+            self._logger.info("Starting the service on {0} with {1} workers (reuse_port={2})"
+                              .format(self._port, self._workers, self._reuse_port))
+            self._start_workers(server)
+        else:
+            self._logger.info("Starting the service on {0} (debug={1})"
+                              .format(self._port, self._debug))
+            server.listen(self._port)
+        self._start_config_checker()
+        if self.watchdog is not None:
+            self.watchdog.start()
+        self._start_async_logging()
+        self._io_loop = tornado.ioloop.IOLoop.current()
+        try:
+            self._io_loop.start()
+        finally:
+            self._shutdown()
+
+    def stop(self):
+        """Stops the service. Can be called from any thread."""
+        if self._io_loop is not None:
+            self._io_loop.add_callback(self._io_loop.stop)
+
+    def _shutdown(self):
+        self._logger.info("Shutting down the service")
+        self._server.stop()
+        if self._config_checker is not None:
+            self._config_checker.stop()
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        self.executor_svc.shutdown(wait=True)
+        if self._async_logging_installed:
+            self._async_logging.uninstall()
+            self._async_logging_installed = False
+
+    def _start_workers(self, server):
+        """
+        Forks the workers, which all serve requests on the port. The parent process
+        supervises the workers and restarts them if they crash.
+
+        Only returns in the workers.
+        """
+        if not self._reuse_port:
+            sockets = tornado.netutil.bind_sockets(self._port)
+        task_id = tornado.process.fork_processes(self._workers, max_restarts=self._max_restarts)
+        if self._reuse_port:
+            sockets = tornado.netutil.bind_sockets(self._port, reuse_port=True)
+        server.add_sockets(sockets)
+        self._logger.info("Worker {0} started (pid={1})".format(task_id, os.getpid()))
+
+        self._log_level_sync = tornado.ioloop.PeriodicCallback(self._sync_log_level, 1000)
+        self._log_level_sync.start()
+
+    def _sync_log_level(self):
+        """Applies the log levels set through other workers"""
+        change = self._shared_log_level.poll()
+        if change is None:
+            return
+        for entry in json.loads(change):
+            try:
+                logs.set_level(**entry)
+            except ArteriaUsageException as e:
+                self._logger.warning("Could not apply the log level {0}: {1}".format(entry, e))
+
+    def _start_async_logging(self):
+        """Moves the log handlers to a background thread, which must be done after forking"""
+        if self._async_logging is not None:
+            self._async_logging.install()
+            self._async_logging_installed = True
+            self.metrics.add_collector(self._async_logging.collect)
+
+    def _configure_logging(self, logger_config):
+        import logging.config
+        self._logger_config = logger_config
+        if self._async_logging_installed:
+            self._async_logging.uninstall()
         logging.config.dictConfig(self._logger_config)
+        if self._async_logging_installed:
+            self._async_logging.install()
+
+    def _start_config_checker(self):
+        """
+        Periodically checks the config files for changes, so that e.g. a changed
+        logger config is applied without restarting the service.
 
-    def get_log_level(self):
-        return self._logger_config["handlers"]["file_handler"]["level"]
+        The interval in seconds is read from the app config key 'config_check_interval',
+        and defaults to 5 seconds. Set it to 0 to disable the check.
+        """
+        interval = self.config_svc.get_app_config().get("config_check_interval", 5)
+        if interval:
+            self._config_checker = tornado.ioloop.PeriodicCallback(
+                self.config_svc.check_for_changes, interval * 1000)
+            self._config_checker.start()
+
+    def _on_config_changed(self, path, config):
+        if path == self.config_svc.logger_config_path:
+            self._logger.info("Logger config changed on disk, re-applying it")
+            self._configure_logging(config)
+
+    def set_log_level(self, log_level, logger=None, handler=None):
+        """
+        Sets the level of the named logger or handler, by default the handler named
+        file_handler, without reconfiguring logging. See arteria.web.logs.set_level.
+        """
+        logs.set_level(log_level, logger=logger, handler=handler)
+        if self._shared_log_level is not None:
+            try:
+                self._shared_log_level.update(
+                    functools.partial(_with_log_level, log_level, logger, handler))
+            except ValueError as e:
+                raise ArteriaUsageException("Too many log levels set: {0}".format(e))
+
+    def get_log_level(self, logger=None, handler=None):
+        return logs.get_level(logger=logger, handler=handler)
 
     def _get_default_routes(self):
         """
         Gets the default endpoints for a web service in the Arteria project
         """
-        return [
+        routes = [
             (r"/api", ApiHelpHandler, dict(route_svc=self.route_svc)),
-            (r"/api/1.0/admin/log_level", LogLevelHandler, dict(app_svc=self))
+            (r"/api/1.0/admin/log_level", LogLevelHandler, dict(app_svc=self)),
+            (r"/api/1.0/admin/metrics", MetricsHandler, dict(metrics=self.metrics)),
+            (r"/api/1.0/admin/profiling", ProfilingHandler,
+             dict(profiling_svc=self.profiling_svc))
         ]
+        if self.watchdog is not None:
+            routes.append((r"/api/1.0/admin/health", HealthHandler, dict(watchdog=self.watchdog)))
+        return routes
+
+
+def _with_log_level(level, logger, handler, levels):
+    """
+    Returns the JSON encoded list of the log levels set per logger and handler, with the
+    level of the logger or handler set
+    """
+    entries = [entry for entry in json.loads(levels or "[]")
+               if (entry["logger"], entry["handler"]) != (logger, handler)]
+    entries.append({"level": level, "logger": logger, "handler": handler})
+    return json.dumps(entries)
+
 
 class InvalidPortError(Exception):
     pass
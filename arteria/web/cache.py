@@ -0,0 +1,136 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from tornado import gen
+from tornado.concurrent import Future, is_future
+
+
+CachedResponse = namedtuple("CachedResponse", ["body", "status", "headers", "etag", "expires"])
+
+# Headers that describe the connection or the encoding of one response, rather than the
+# resource, and are set again when a cached response is written
+_UNCACHED_HEADERS = frozenset(["Connection", "Keep-Alive", "Transfer-Encoding", "Content-Length",
+                               "Content-Encoding", "Date", "Etag", "Server", "Vary"])
+
+
+class ResponseCache(object):
+    """
+    A thread safe LRU cache of responses, where the entries expire after ttl seconds
+    """
+
+    def __init__(self, ttl, max_entries):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Returns the CachedResponse for the key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry.expires <= time.time():
+                return None
+            # Re-insert it as the most recently used entry
+            self._entries[key] = entry
+            return entry
+
+    def put(self, key, body, headers=(), status=200):
+        """
+        Caches the response body, with its status and a sequence of (name, value) headers
+        """
+        entry = CachedResponse(body, status, tuple(headers or ()),
+                               '"{0}"'.format(hashlib.sha1(body).hexdigest()),
+                               time.time() + self._ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, path=None):
+        """Removes the entries for the path, or all entries if path is None"""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == path]:
+                    del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def cache_responses(ttl, max_entries, vary):
+    """Implements arteria.decorators.cached"""
+    def decorator(method):
+        cache = ResponseCache(ttl, max_entries)
+        # Futures for the responses being computed, by key. Only used on the IOLoop thread.
+        in_flight = {}
+
+        @gen.coroutine
+        def wrapper(self, *args, **kwargs):
+            key = (self.request.path, self.request.query) + \
+                tuple(self.request.headers.get(header) for header in vary)
+            entry = cache.get(key)
+            while entry is None and key in in_flight:
+                # An identical request is being handled, wait for its response
+                yield in_flight[key]
+                entry = cache.get(key)
+
+            if entry is None:
+                computed = Future()
+                in_flight[key] = computed
+                # The headers set before, e.g. request IDs, are not part of the response
+                headers_before = list(self._headers.get_all())
+                try:
+                    result = method(self, *args, **kwargs)
+                    if is_future(result):
+                        yield result
+                    entry = _cache_written_response(self, cache, key, headers_before)
+                finally:
+                    del in_flight[key]
+                    computed.set_result(None)
+                if entry is None:
+                    return
+                # The response is already in the write buffer
+                self._write_buffer = []
+
+            self.set_header("Etag", entry.etag)
+            if self.check_etag_header():
+                self.set_status(304)
+                return
+            self.set_status(entry.status)
+            replaced = set()
+            for name, value in entry.headers:
+                if name in replaced:
+                    self.add_header(name, value)
+                else:
+                    # Replaces the value set when the response was computed, or the default
+                    self.set_header(name, value)
+                    replaced.add(name)
+            self.write(entry.body)
+
+        wrapper = functools.wraps(method)(wrapper)
+        wrapper.cache = cache
+        wrapper.invalidate = cache.invalidate
+        return wrapper
+    return decorator
+
+
+def _cache_written_response(handler, cache, key, headers_before):
+    """
+    Caches the response the handler has written, with the headers it has set, if it's a
+    successful response that hasn't been flushed yet
+    """
+    status = handler.get_status()
+    if not 200 <= status < 300 or status == 206 or handler._finished or \
+            handler._headers_written:
+        return None
+    headers = [(name, value) for name, value in handler._headers.get_all()
+               if name not in _UNCACHED_HEADERS and (name, value) not in headers_before]
+    body = b"".join(handler._write_buffer)
+    return cache.put(key, body, headers, status)
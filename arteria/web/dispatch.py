@@ -0,0 +1,204 @@
+"""
+Dispatching requests to the routes of services with many routes
+
+Tornado tries the routes one by one until one matches, so the cost of dispatching a request
+grows with the number of routes. The CompiledRouter looks up routes without any regex,
+e.g. r"/api/1.0/admin/metrics", in a dict, and indexes the other routes in a trie by the
+literal path segments their pattern starts with, e.g. api, 1.0 and instruments for
+r"/api/1.0/instruments/(\\w+)". Only the routes indexed under the segments of the request
+path are tried, so the cost stays flat as routes are added for more instruments or projects.
+
+Routes are still matched in order: the first route in the list that matches the path handles
+the request, with the same handler and kwargs as with tornado's own routing. The one exception
+is an unescaped . in the literal part of a pattern matching a /, e.g. r"/api/1.0" matching
+"/api/1/0", which is assumed not to be intended.
+"""
+import re
+
+import tornado.web
+from tornado.util import import_object
+
+try:
+    from tornado.routing import AnyMatches, ReversibleRouter, Rule
+except ImportError:
+    # tornado.routing was added in tornado 4.5, older versions use the routes as they are
+    ReversibleRouter = object
+    AnyMatches = Rule = None
+
+# Characters that end the literal part of a pattern
+_SPECIAL = set("\\^$*+?{}[]|()")
+# Quantifiers that make the preceding character optional
+_OPTIONAL = set("*?{")
+
+
+def literal_prefix(pattern):
+    """
+    Returns the text that every path matching the pattern starts with, as a tuple of
+    (prefix, wildcards, complete). In the prefix, an unescaped . matches any character,
+    and wildcards is True if there is one. Complete is True if the prefix is the whole
+    pattern, i.e. the pattern matches nothing but the prefix.
+    """
+    if "|" in pattern:
+        # An alternation may be at the top level, so nothing is known about the prefix
+        return "", False, False
+    prefix = []
+    wildcards = False
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        escaped = char == "\\" and i + 1 < len(pattern) and not pattern[i + 1].isalnum()
+        if escaped:
+            # An escaped character, e.g. \. or \/
+            char = pattern[i + 1]
+            step = 2
+        elif char in _SPECIAL:
+            if char in _OPTIONAL and prefix:
+                prefix.pop()
+            return "".join(prefix), wildcards, char == "$" and i == len(pattern) - 1
+        else:
+            wildcards = wildcards or char == "."
+            step = 1
+        if i + step < len(pattern) and pattern[i + step] in _OPTIONAL:
+            return "".join(prefix), wildcards, False
+        prefix.append(char)
+        i += step
+    return "".join(prefix), wildcards, True
+
+
+class _Node(object):
+    __slots__ = ("children", "wildcard_children", "routes")
+
+    def __init__(self):
+        # Child nodes by path segment
+        self.children = {}
+        # Child nodes for segments with a . in them, as (regex, node) tuples
+        self.wildcard_children = []
+        # The indexes of the routes whose literal prefix ends in this node
+        self.routes = []
+
+    def child(self, segment):
+        if "." not in segment:
+            return self.children.setdefault(segment, _Node())
+        for regex, node in self.wildcard_children:
+            if regex.pattern == _segment_regex(segment):
+                return node
+        node = _Node()
+        self.wildcard_children.append((re.compile(_segment_regex(segment)), node))
+        return node
+
+    def matching_children(self, segment):
+        node = self.children.get(segment)
+        if node is not None:
+            yield node
+        for regex, node in self.wildcard_children:
+            if regex.match(segment):
+                yield node
+
+
+def _segment_regex(segment):
+    # Escaped dots are matched as wildcards too, which only adds candidates to try
+    return re.escape(segment).replace("\\.", ".") + "$"
+
+
+class CompiledRouter(ReversibleRouter):
+    """
+    A tornado router for a list of routes, see the module documentation
+
+    Use RouteService.create_application, or create_application in this module, rather
+    than creating it directly, since the router needs the application it routes for.
+    """
+
+    def __init__(self, routes, application=None):
+        self.application = application
+        self._specs = [self._to_spec(route) for route in routes]
+        self._static = {}
+        self._root = _Node()
+        self._named = {}
+        for index, spec in enumerate(self._specs):
+            if spec.name:
+                self._named.setdefault(spec.name, spec)
+            prefix, wildcards, complete = literal_prefix(spec.regex.pattern)
+            if complete and not wildcards:
+                self._static.setdefault(prefix, index)
+            else:
+                self._index(prefix, complete, index)
+
+    @staticmethod
+    def _to_spec(route):
+        if isinstance(route, tornado.web.URLSpec):
+            return route
+        if len(route) > 1 and isinstance(route[1], str):
+            route = (route[0], import_object(route[1])) + tuple(route[2:])
+        return tornado.web.URLSpec(*route)
+
+    def _index(self, prefix, complete, index):
+        node = self._root
+        if prefix.startswith("/"):
+            segments = prefix[1:].split("/")
+            if not complete:
+                # The last segment may continue in the rest of the pattern
+                segments.pop()
+            for segment in segments:
+                node = node.child(segment)
+        node.routes.append(index)
+
+    def _candidates(self, path):
+        nodes = [self._root]
+        candidates = list(self._root.routes)
+        for segment in path[1:].split("/"):
+            nodes = [child for node in nodes for child in node.matching_children(segment)]
+            if not nodes:
+                break
+            for node in nodes:
+                candidates.extend(node.routes)
+        return candidates
+
+    def match(self, request):
+        """Returns the first matching (spec, path_args, path_kwargs), or None"""
+        path = request.path
+        static_index = self._static.get(path)
+        candidates = self._candidates(path)
+        if static_index is not None:
+            # A route earlier in the list may still match the path
+            candidates = [index for index in candidates if index < static_index]
+        candidates.sort()
+        for index in candidates:
+            spec = self._specs[index]
+            params = spec.matcher.match(request)
+            if params is not None:
+                return spec, params.get("path_args", []), params.get("path_kwargs", {})
+        if static_index is not None:
+            return self._specs[static_index], [], {}
+        return None
+
+    def find_handler(self, request, **kwargs):
+        match = self.match(request)
+        if match is None:
+            # The application responds with its default handler
+            return None
+        spec, path_args, path_kwargs = match
+        return self.application.get_handler_delegate(request, spec.handler_class, spec.kwargs,
+                                                     path_args, path_kwargs)
+
+    def reverse_url(self, name, *args):
+        spec = self._named.get(name)
+        return spec.reverse(*args) if spec is not None else None
+
+
+def create_application(routes, min_routes=32, **settings):
+    """
+    Returns a tornado Application serving the routes through a CompiledRouter
+
+    Tornado's own routing is used if there are fewer than min_routes routes, since it is
+    faster for a few routes. It is also used with tornado versions older than 4.5, and if
+    any of the routes isn't a (pattern, handler, ...) tuple or a URLSpec, e.g. a
+    tornado.routing.Rule matching on the host.
+    """
+    compilable = Rule is not None and len(routes) >= min_routes and \
+        all(isinstance(route, (tuple, list, tornado.web.URLSpec)) for route in routes)
+    if not compilable:
+        return tornado.web.Application(routes, **settings)
+    router = CompiledRouter(routes)
+    application = tornado.web.Application([Rule(AnyMatches(), router)], **settings)
+    router.application = application
+    return application
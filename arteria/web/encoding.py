@@ -0,0 +1,78 @@
+"""
+JSON encoding for responses, using orjson or ujson when they are installed
+
+Objects the fast encoders can't handle, e.g. dicts with non-string keys,
+fall back to the json module.
+"""
+from collections import OrderedDict
+
+from tornado.escape import json_encode, utf8
+
+
+def _load_orjson():
+    import orjson
+    return orjson.dumps
+
+
+def _load_ujson():
+    import ujson
+    return ujson.dumps
+
+
+def _load_json():
+    return json_encode
+
+
+# In order of preference when auto-detecting
+_loaders = OrderedDict([("orjson", _load_orjson),
+                        ("ujson", _load_ujson),
+                        ("json", _load_json)])
+
+# Set on first use, so that importing this module doesn't import the encoders
+_dumps = None
+_name = None
+
+
+def set_json_encoder(name="auto"):
+    """
+    Sets the encoder used for JSON responses
+
+    :param name: 'orjson', 'ujson', 'json', or 'auto' for the fastest one installed
+    :raises: ValueError if the encoder is unknown, ImportError if it is not installed
+    """
+    global _dumps, _name
+    if name == "auto":
+        for candidate, loader in _loaders.items():
+            try:
+                _dumps, _name = loader(), candidate
+                return _name
+            except ImportError:
+                pass
+    if name not in _loaders:
+        raise ValueError("Unknown JSON encoder '{0}', expected one of: auto, {1}"
+                         .format(name, ", ".join(_loaders)))
+    _dumps, _name = _loaders[name](), name
+    return _name
+
+
+def _encoder():
+    if _dumps is None:
+        set_json_encoder("auto")
+    return _dumps
+
+
+def get_json_encoder():
+    """Returns the name of the encoder in use"""
+    _encoder()
+    return _name
+
+
+def json_dumps(obj):
+    """Encodes the object as JSON, returned as UTF-8 encoded bytes"""
+    dumps = _encoder()
+    try:
+        return utf8(dumps(obj))
+    except (TypeError, OverflowError):
+        if dumps is json_encode:
+            raise
+        return utf8(json_encode(obj))
@@ -0,0 +1,285 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+
+import tornado.ioloop
+import tornado.web
+import tornado.websocket
+from tornado import gen
+from tornado.concurrent import Future
+
+from arteria.web.handlers import BaseRestHandler
+from arteria.web.state import validate_state
+
+
+Event = namedtuple("Event", ["version", "entity_id", "state", "data", "timestamp"])
+
+
+class EventChannel(object):
+    """
+    Publishes state changes of tracked entities, e.g. jobs, to subscribers
+
+    Every event gets a version, increasing by one per event. Clients that keep track of
+    the last version they have seen can ask for the events since then, as long as they are
+    still in the history. Older clients get the latest event of each entity instead, for
+    the max_entities entities that changed most recently.
+
+    Events can be published from any thread. Subscribers are called on the IOLoop thread,
+    so fanning out events doesn't need a thread per subscriber. The channel should be
+    created on the IOLoop thread, or be given the IOLoop.
+
+    Usage example:
+        channel = EventChannel()
+        job_runner.add_listener(channel.job_listener)
+        routes = [
+            (r"/api/1.0/events", EventLongPollHandler, dict(channel=channel)),
+            (r"/api/1.0/events/stream", EventStreamHandler, dict(channel=channel)),
+            (r"/api/1.0/events/ws", EventWebSocketHandler, dict(channel=channel)),
+        ]
+    """
+
+    def __init__(self, history_size=1000, max_entities=10000, io_loop=None, logger=None):
+        self._logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._version = 0
+        self._history = deque(maxlen=history_size)
+        # The latest event per entity, least recently changed first
+        self._latest = OrderedDict()
+        self._max_entities = max_entities
+        # Subscribers by entity id, where None subscribes to all entities
+        self._subscribers = {}
+        self._io_loop = io_loop or tornado.ioloop.IOLoop.current()
+
+    @property
+    def version(self):
+        return self._version
+
+    def publish(self, entity_id, state, data=None):
+        """Publishes that the entity has changed state. Can be called from any thread."""
+        validate_state(state)
+        with self._lock:
+            self._version += 1
+            event = Event(self._version, entity_id, state, data, time.time())
+            self._history.append(event)
+            self._latest.pop(entity_id, None)
+            self._latest[entity_id] = event
+            if len(self._latest) > self._max_entities:
+                self._latest.popitem(last=False)
+        self._io_loop.add_callback(self._dispatch, event)
+        return event
+
+    def job_listener(self, job, state):
+        """A listener for JobRunner.add_listener, publishing the state changes of jobs"""
+        data = job.to_dict()
+        data["state"] = state
+        self.publish(job.id, state, data)
+
+    def events_since(self, since, entity_id=None):
+        """
+        Returns the events after the version since, optionally only for one entity. If
+        events after since have been dropped from the history, the latest event of each
+        entity is returned instead.
+        """
+        with self._lock:
+            if self._history and self._history[0].version > since + 1:
+                events = sorted(self._latest.values(), key=lambda event: event.version)
+            else:
+                events = [event for event in self._history if event.version > since]
+        if entity_id is not None:
+            events = [event for event in events if event.entity_id == entity_id]
+        return events
+
+    def subscribe(self, callback, entity_id=None):
+        """
+        Calls callback with every event published from now on, optionally only the events
+        of one entity. Must be called on the IOLoop thread.
+
+        :return: A subscription to pass to unsubscribe
+        """
+        subscription = (entity_id, callback)
+        self._subscribers.setdefault(entity_id, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        entity_id = subscription[0]
+        subscribers = self._subscribers.get(entity_id, [])
+        if subscription in subscribers:
+            subscribers.remove(subscription)
+            if not subscribers:
+                del self._subscribers[entity_id]
+
+    def wait(self, since, entity_id=None, timeout=30):
+        """
+        Returns a Future resolving to the events after the version since. If there are none
+        yet, it resolves when the next event is published, or to an empty list after timeout
+        seconds. Must be called on the IOLoop thread.
+        """
+        future = Future()
+        events = self.events_since(since, entity_id)
+        if events:
+            future.set_result(events)
+            return future
+
+        def on_event(event):
+            if event.version > since and not future.done():
+                future.set_result([event])
+
+        def on_timeout():
+            if not future.done():
+                future.set_result([])
+
+        subscription = self.subscribe(on_event, entity_id)
+        timeout_handle = self._io_loop.call_later(timeout, on_timeout)
+
+        def cleanup(_):
+            self.unsubscribe(subscription)
+            self._io_loop.remove_timeout(timeout_handle)
+
+        future.add_done_callback(cleanup)
+        return future
+
+    def _dispatch(self, event):
+        subscribers = self._subscribers.get(None, []) + self._subscribers.get(event.entity_id, [])
+        for _, callback in subscribers:
+            try:
+                callback(event)
+            except Exception:
+                self._logger.exception("Event subscriber failed for {0}".format(event))
+
+
+def _event_to_dict(event):
+    return event._asdict()
+
+
+class EventLongPollHandler(BaseRestHandler):
+    """
+    Handles long polling for state change events
+    """
+    MAX_WAIT = 60
+    # Waiting polls would hold their admission slots for up to MAX_WAIT seconds
+    admission = False
+
+    def initialize(self, channel):
+        self.channel = channel
+
+    @gen.coroutine
+    def get(self):
+        """
+        Get the events after the version since, e.g. ?since=10&wait=30. If there are none, waits
+        up to wait seconds (at most 60) for one. Filter on an entity with ?entity=<id>.
+        Responds with the current version, which should be used as since in the next call.
+        """
+        try:
+            since = int(self.get_argument("since", self.channel.version))
+            wait = min(float(self.get_argument("wait", 0)), self.MAX_WAIT)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, str(e))
+        entity_id = self.get_argument("entity", None)
+        if wait > 0:
+            events = yield self.channel.wait(since, entity_id, wait)
+        else:
+            events = self.channel.events_since(since, entity_id)
+        version = events[-1].version if events else max(since, 0)
+        self.write_object({"version": version,
+                           "events": [_event_to_dict(event) for event in events]})
+
+
+class EventStreamHandler(BaseRestHandler):
+    """
+    Handles streaming state change events as Server-Sent Events
+    """
+    KEEP_ALIVE_INTERVAL = 15
+    # Streams would hold their admission slots for as long as the client is connected
+    admission = False
+
+    def initialize(self, channel):
+        self.channel = channel
+        self._closed = None
+        self._keep_alive = None
+        self._subscription = None
+
+    @gen.coroutine
+    def get(self):
+        """
+        Stream events as Server-Sent Events. Resumes after the Last-Event-ID header, or ?since=,
+        if supplied. Filter on an entity with ?entity=<id>.
+        """
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        entity_id = self.get_argument("entity", None)
+        since = self.request.headers.get("Last-Event-ID") or self.get_argument("since", None)
+        self._closed = Future()
+
+        if since is not None:
+            try:
+                backlog = self.channel.events_since(int(since), entity_id)
+            except ValueError as e:
+                raise tornado.web.HTTPError(400, str(e))
+            for event in backlog:
+                self._write_event(event)
+        self._subscription = self.channel.subscribe(self._write_event, entity_id)
+        self._keep_alive = tornado.ioloop.PeriodicCallback(
+            self._write_keep_alive, self.KEEP_ALIVE_INTERVAL * 1000)
+        self._keep_alive.start()
+        self.flush()
+        yield self._closed
+
+    def _write_event(self, event):
+        self.write("id: {0}\nevent: {1}\ndata: {2}\n\n".format(
+            event.version, event.state, json.dumps(_event_to_dict(event))))
+        self.flush()
+
+    def _write_keep_alive(self):
+        self.write(": keep-alive\n\n")
+        self.flush()
+
+    def on_connection_close(self):
+        super(EventStreamHandler, self).on_connection_close()
+        if self._subscription is not None:
+            self.channel.unsubscribe(self._subscription)
+        if self._keep_alive is not None:
+            self._keep_alive.stop()
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(None)
+
+
+class EventWebSocketHandler(tornado.websocket.WebSocketHandler):
+    """
+    Handles streaming state change events over a WebSocket, as one JSON message per event.
+    Filter on an entity with ?entity=<id>, and resume after a version with ?since=<version>.
+    """
+
+    def initialize(self, channel):
+        self.channel = channel
+        self._subscription = None
+
+    def open(self):
+        entity_id = self.get_argument("entity", None)
+        if self._since is not None:
+            for event in self.channel.events_since(self._since, entity_id):
+                self._send_event(event)
+        self._subscription = self.channel.subscribe(self._send_event, entity_id)
+
+    def prepare(self):
+        # Validated before the WebSocket handshake, so that invalid requests get a 400
+        since = self.get_argument("since", None)
+        try:
+            self._since = int(since) if since is not None else None
+        except ValueError:
+            raise tornado.web.HTTPError(400, "Invalid version '{0}'".format(since))
+
+    def _send_event(self, event):
+        try:
+            self.write_message(json.dumps(_event_to_dict(event)))
+        except tornado.websocket.WebSocketClosedError:
+            self.on_close()
+
+    def on_message(self, message):
+        pass
+
+    def on_close(self):
+        if self._subscription is not None:
+            self.channel.unsubscribe(self._subscription)
+            self._subscription = None
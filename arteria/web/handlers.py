@@ -1,12 +1,151 @@
 import tornado.web
+from tornado import gen
+from tornado.httputil import url_concat
+import codecs
 import json
+import tempfile
+
+from arteria.exceptions import ArteriaUsageException, InvalidArteriaStateException
+from arteria.executors import PoolSaturatedError
+from arteria.jobs import JobQueueFullError, UnknownJobError
+from arteria.web.admission import AdmissionCancelledError, AdmissionRejectedError
+from arteria.web.encoding import json_dumps
+from arteria.web.metrics import timer
+from arteria.web.pagination import InvalidCursorError, paginate, project
+from arteria.web.profiling import ProfilingError
+from arteria.web.tracing import NULL_SPAN
 
 class BaseRestHandler(tornado.web.RequestHandler):
     """
     A request handler for a REST web interface, taking care of
     writing and reading JSON request/responses
+
+    If the application settings contain a MetricsRegistry under the key 'metrics',
+    the requests are recorded in it. If they contain an AdmissionController under the key
+    'admission', requests wait to be admitted by it before they are handled. If they contain
+    a Tracer under the key 'tracing', requests are traced, see arteria.web.tracing.
+    Subclasses overriding prepare, finish, on_finish or on_connection_close need to call the
+    base class methods, and return the result of prepare, for this to work.
+
+    Handlers of long-lived requests, e.g. long polls and event streams, set the class
+    attribute admission to False, since they would hold a slot of the admission controller
+    for as long as the client is connected.
     """
 
+    # Whether the requests are limited by the AdmissionController in the settings
+    admission = True
+
+    _route_metrics = None
+    _admission = None
+    _retry_after = None
+    _trace = None
+    _handler_start = None
+
+    def prepare(self):
+        tracer = self.settings.get("tracing")
+        if tracer is not None:
+            self._trace = tracer.start(self.request)
+            self.set_header(tracer.header, self._trace.request_id)
+        metrics = self.settings.get("metrics")
+        if metrics is not None:
+            self._request_start = timer()
+            self._route_metrics = metrics.start_request(type(self), self.request.path)
+        admission = self.settings.get("admission")
+        if admission is not None and self.admission:
+            waiter = self._admit(admission)
+            if waiter is not None:
+                return waiter
+        if self._trace is not None:
+            self._start_handler_span()
+
+    def _start_handler_span(self):
+        self._handler_start = timer()
+        self._trace.add("prepare", self._handler_start - self._trace.start)
+
+    @property
+    def request_id(self):
+        """The ID of the request when tracing is enabled, to pass on to other services"""
+        return self._trace.request_id if self._trace is not None else None
+
+    def span(self, name):
+        """
+        Returns a context manager timing the code in it as the named span of the request.
+        Does nothing when tracing is disabled.
+        """
+        if self._trace is None:
+            return NULL_SPAN
+        return self._trace.span(name)
+
+    def finish(self, chunk=None):
+        trace = self._trace
+        if trace is None:
+            return super(BaseRestHandler, self).finish(chunk)
+        if self._handler_start is not None:
+            trace.add("handler", timer() - self._handler_start)
+            self._handler_start = None
+        # Set here, since send_error clears the headers set before it
+        if not self._headers_written:
+            tracer = self.settings["tracing"]
+            self.set_header(tracer.header, trace.request_id)
+            if tracer.server_timing:
+                self.set_header("Server-Timing", trace.server_timing())
+        # Logged here rather than in on_finish, which is called before the flush span ends
+        self._trace = None
+        try:
+            with trace.span("flush"):
+                return super(BaseRestHandler, self).finish(chunk)
+        finally:
+            self.settings["tracing"].finish(trace, self.request, self.get_status())
+
+    def on_finish(self):
+        if self._admission is not None:
+            self._admission.release()
+            self._admission = None
+        if self._route_metrics is not None:
+            self.settings["metrics"].finish_request(self._route_metrics, self.get_status(),
+                                                    timer() - self._request_start)
+            self._route_metrics = None
+
+    def _admit(self, admission):
+        # Returns None when admitted right away, so that prepare stays synchronous
+        self._admission = admission.enter(type(self))
+        if self._admission is None:
+            return None
+        try:
+            waiter = self._admission.start()
+        except AdmissionRejectedError as e:
+            self._reject(e)
+        if waiter is not None:
+            return self._wait_for_admission(waiter)
+
+    @gen.coroutine
+    def _wait_for_admission(self, waiter):
+        try:
+            yield waiter
+        except AdmissionRejectedError as e:
+            self._reject(e)
+        except AdmissionCancelledError:
+            # The client has disconnected, so there is no one to respond to
+            raise tornado.web.Finish()
+        if self._trace is not None:
+            self._start_handler_span()
+
+    def on_connection_close(self):
+        super(BaseRestHandler, self).on_connection_close()
+        if self._admission is not None:
+            # Gives up the place in the queue, if the request is still waiting to be admitted
+            self._admission.cancel()
+
+    def _reject(self, e):
+        self._retry_after = e.retry_after
+        raise tornado.web.HTTPError(503, str(e))
+
+    def write_error(self, status_code, **kwargs):
+        # send_error clears the headers, so Retry-After is set here
+        if status_code == 503 and self._retry_after is not None:
+            self.set_header("Retry-After", str(self._retry_after))
+        super(BaseRestHandler, self).write_error(status_code, **kwargs)
+
     def data_received(self, chunk):
         raise NotImplementedError("Should be implemented by subclass!")
 
@@ -16,15 +155,106 @@ class BaseRestHandler(tornado.web.RequestHandler):
 
         Only dictionaries or objects containing the __dict__ attribute get serialized.
         """
+        resp = BaseRestHandler._as_dict(obj)
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        if self._trace is None:
+            self.write(json_dumps(resp))
+            return
+        with self._trace.span("serialize"):
+            body = json_dumps(resp)
+        self.write(body)
+
+    @gen.coroutine
+    def write_stream(self, items, key="items", batch_size=100):
+        """
+        Writes the items as a JSON list in an object, i.e. {"<key>": [item, ...]},
+        flushing the response after every batch of items. Use this for large
+        lists, e.g. from a generator, since the full response is never built in memory.
+
+        Items that are neither dicts nor lists are serialized like in write_object.
+        Should be yielded from a coroutine, e.g.:
+
+            @gen.coroutine
+            def get(self):
+                yield self.write_stream(self.service.samples())
+        """
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.write(b"{" + json_dumps(key) + b": [")
+        batch = []
+        separator = b""
+        for item in items:
+            if not isinstance(item, (dict, list)) and hasattr(item, "__dict__"):
+                item = item.__dict__
+            batch.append(json_dumps(item))
+            if len(batch) >= batch_size:
+                self.write(separator + b",".join(batch))
+                separator = b","
+                batch = []
+                with self.span("flush"):
+                    yield self.flush()
+        if batch:
+            self.write(separator + b",".join(batch))
+        self.write(b"]}")
+
+    @staticmethod
+    def _as_dict(obj):
         if isinstance(obj, dict):
-            resp = obj
+            return obj
         elif hasattr(obj, "__dict__"):
-            resp = obj.__dict__
+            return obj.__dict__
         else:
             raise TypeError("The object needs either to be a dict or have the __dict__ attribute")
 
-        # Send to Tornado, which handles the json serialization and content-type header
-        self.write(resp)
+    def fields(self):
+        """Returns the fields requested with e.g. ?fields=name,state, or None for all fields"""
+        fields = self.get_argument("fields", None)
+        if not fields:
+            return None
+        return [field.strip() for field in fields.split(",") if field.strip()]
+
+    def project(self, obj):
+        """Returns the object with only the fields requested with ?fields="""
+        return project(obj, self.fields())
+
+    def write_page(self, source, key="items", default_limit=100, max_limit=1000,
+                   sort_key=None, reverse=False):
+        """
+        Writes a page of the items in the source, as {"<key>": [item, ...], "next_cursor": ...},
+        with only the fields requested with ?fields=. The page size is set with ?limit=<n>, and
+        the next page is requested with ?cursor=<next_cursor>. The URL of the next page is
+        also in the Link header, with rel="next".
+
+        The source can be a generator, only the items of the page are read from it.
+        See arteria.web.pagination.paginate for the sort_key, reverse and callable sources.
+
+        Usage example:
+            def get(self):
+                self.write_page(self.runfolder_svc.runfolders(), sort_key=lambda r: r.path)
+
+        :raises: HTTPError with status 400 if the limit or the cursor is invalid
+        """
+        try:
+            limit = int(self.get_argument("limit", default_limit))
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= max_limit:
+            raise tornado.web.HTTPError(400, "The limit must be between 1 and {0}".format(
+                max_limit))
+        try:
+            page = paginate(source, limit, self.get_argument("cursor", None), sort_key, reverse)
+        except InvalidCursorError as e:
+            raise tornado.web.HTTPError(400, str(e))
+        if page.next_cursor is not None:
+            args = [(name, value.decode("utf-8"))
+                    for name, values in sorted(self.request.query_arguments.items())
+                    if name != "cursor" for value in values]
+            next_url = url_concat("{0}://{1}{2}".format(
+                self.request.protocol, self.request.host, self.request.path),
+                args + [("cursor", page.next_cursor)])
+            self.set_header("Link", '<{0}>; rel="next"'.format(next_url))
+        fields = self.fields()
+        self.write_object({key: [project(item, fields) for item in page.items],
+                           "next_cursor": page.next_cursor})
 
     def write_json(self, json):
         self.set_header("Content-Type", "application/json")
@@ -33,14 +263,146 @@ class BaseRestHandler(tornado.web.RequestHandler):
     def body_as_object(self, required_members=[]):
         """Returns the JSON encoded body as a Python object"""
         obj = json.loads(self.request.body)
+        BaseRestHandler.validate_members(obj, required_members)
+        return obj
+
+    @staticmethod
+    def validate_members(obj, required_members):
+        """Raises a 400 HTTPError if any of the required members is missing from the object"""
         for member in required_members:
             if member not in obj:
-                raise tornado.web.HTTPError("400", "Expecting '{0}' in the JSON body".format(member))
-        return obj
+                raise tornado.web.HTTPError(400, "Expecting '{0}' in the JSON body".format(member))
+
+    def run_in_pool(self, pool, fn, *args, **kwargs):
+        """
+        Runs fn in the named pool of the ExecutorService in the application settings,
+        under the key 'executors'. Returns a future that can be yielded from a coroutine.
+
+        :raises: HTTPError with status 503 if the pool is saturated
+        """
+        executors = self.settings.get("executors")
+        if executors is None:
+            raise ArteriaUsageException("There is no ExecutorService in the application settings")
+        try:
+            return executors.submit(pool, fn, *args, **kwargs)
+        except PoolSaturatedError as e:
+            raise tornado.web.HTTPError(503, str(e))
 
     def api_link(self, version="1.0"):
         return "%s://%s/api/%s" % (self.request.protocol, self.request.host, version)
 
+@tornado.web.stream_request_body
+class StreamingBodyHandler(BaseRestHandler):
+    """
+    A request handler for large request bodies, e.g. sample sheets or bulk manifests,
+    which are processed as they arrive instead of being buffered by Tornado
+
+    With body_mode "spool" (the default), the body is written to self.body_file, which is
+    kept in memory up to spool_threshold bytes and spooled to disk after that. The body can
+    then be read in e.g. post with body_as_object, or directly from self.body_file.
+
+    With body_mode "ndjson", the body is parsed as newline delimited JSON while it arrives,
+    and on_json_object is called with each object. Each object is validated against
+    ndjson_required_members. Call finish_ndjson in e.g. post to parse the last line, and to
+    respond with 400 if the body was invalid.
+
+    Usage example:
+        class ManifestHandler(StreamingBodyHandler):
+            body_mode = "ndjson"
+            ndjson_required_members = ["sample", "path"]
+
+            def on_json_object(self, obj):
+                self.manifest_svc.add(obj)
+
+            def post(self):
+                self.write_object({"added": self.finish_ndjson()})
+    """
+
+    max_body_size = 10 * 1024 ** 3
+    spool_threshold = 1024 ** 2
+    body_mode = "spool"
+    ndjson_required_members = []
+    max_line_size = 1024 ** 2
+
+    body_file = None
+    objects_received = 0
+    _body_error = None
+
+    def prepare(self):
+        admitted = super(StreamingBodyHandler, self).prepare()
+        self.request.connection.set_max_body_size(self.max_body_size)
+        if self.body_mode == "spool":
+            self.body_file = tempfile.SpooledTemporaryFile(max_size=self.spool_threshold)
+        elif self.body_mode == "ndjson":
+            self._line_buffer = b""
+        else:
+            raise ValueError("Unknown body_mode '{0}'".format(self.body_mode))
+        return admitted
+
+    def data_received(self, chunk):
+        if self.body_mode == "spool":
+            self.body_file.write(chunk)
+            return
+        if self._body_error is not None:
+            return
+        # Errors can't be sent until the whole body has been received, so they are
+        # kept until finish_ndjson is called
+        try:
+            lines = (self._line_buffer + chunk).split(b"\n")
+            self._line_buffer = lines.pop()
+            if len(self._line_buffer) > self.max_line_size:
+                raise tornado.web.HTTPError(400, "Line longer than {0} bytes in the body"
+                                            .format(self.max_line_size))
+            for line in lines:
+                self._parse_line(line)
+        except tornado.web.HTTPError as e:
+            self._body_error = e
+
+    def _parse_line(self, line):
+        if not line.strip():
+            return
+        try:
+            obj = json.loads(line.decode("utf-8"))
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, "Invalid JSON on line {0} of the body: {1}"
+                                        .format(self.objects_received + 1, e))
+        BaseRestHandler.validate_members(obj, self.ndjson_required_members)
+        self.objects_received += 1
+        self.on_json_object(obj)
+
+    def on_json_object(self, obj):
+        """Called with each object in the body when body_mode is ndjson"""
+        raise NotImplementedError("Should be implemented by subclass!")
+
+    def finish_ndjson(self):
+        """
+        Parses the last line of a newline delimited JSON body, which may lack a trailing
+        newline, and returns the number of objects received
+
+        :raises: HTTPError with status 400 if the body was invalid
+        """
+        if self._body_error is not None:
+            raise self._body_error
+        self._parse_line(self._line_buffer)
+        self._line_buffer = b""
+        return self.objects_received
+
+    def body_as_object(self, required_members=[]):
+        """Returns the spooled JSON encoded body as a Python object"""
+        if self.body_mode != "spool":
+            raise ValueError("body_as_object is only available when body_mode is spool")
+        self.body_file.seek(0)
+        # Decoded while it is read, so that there is no bytes copy of the body next to the text
+        obj = json.load(codecs.getreader("utf-8")(self.body_file))
+        BaseRestHandler.validate_members(obj, required_members)
+        return obj
+
+    def on_finish(self):
+        super(StreamingBodyHandler, self).on_finish()
+        if self.body_file is not None:
+            self.body_file.close()
+
+
 class LogLevelHandler(BaseRestHandler):
     """
     Handles getting/setting the log_level of the running application
@@ -50,21 +412,110 @@ class LogLevelHandler(BaseRestHandler):
 
     def get(self):
         """
-        Get the current log_level of the running server
+        Get the current log_level of the running server. Get the level of a named
+        logger or handler with ?logger=<name> or ?handler=<name>.
         """
-        log_level = self.app_svc.get_log_level()
+        try:
+            log_level = self.app_svc.get_log_level(logger=self.get_argument("logger", None),
+                                                   handler=self.get_argument("handler", None))
+        except ArteriaUsageException as e:
+            raise tornado.web.HTTPError(400, str(e))
         self.write_object({"log_level": log_level})
 
     def put(self):
         """
-        Set the current log_level of the running server. Call with e.g. {'log_level': 'DEBUG'}
+        Set the current log_level of the running server. Call with e.g. {'log_level': 'DEBUG'},
+        optionally with the name of a 'logger' or 'handler' to set the level of.
         """
         json_body = self.body_as_object(["log_level"])
         log_level = json_body["log_level"]
-        self.app_svc.set_log_level(log_level)
+        try:
+            self.app_svc.set_log_level(log_level, logger=json_body.get("logger"),
+                                       handler=json_body.get("handler"))
+        except ArteriaUsageException as e:
+            raise tornado.web.HTTPError(400, str(e))
         self.write_object({"log_level": log_level})
 
 
+class MetricsHandler(BaseRestHandler):
+    """
+    Handles getting the metrics of the running application
+    """
+    def initialize(self, metrics):
+        self.metrics = metrics
+
+    def get(self):
+        """
+        Get request counts, latencies and process metrics, in the Prometheus text format
+        """
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(self.metrics.render())
+
+
+class HealthHandler(BaseRestHandler):
+    """
+    Handles getting the health of the running application
+    """
+    def initialize(self, watchdog):
+        self.watchdog = watchdog
+
+    def get(self):
+        """
+        Get the IOLoop lag, its histogram and how often the IOLoop has been blocked.
+        Responds with 503 if the IOLoop was recently blocked for longer than the threshold.
+        """
+        health = self.watchdog.health()
+        if health["status"] != "ok":
+            self.set_status(503)
+        self.write_object(health)
+
+
+class ProfilingHandler(BaseRestHandler):
+    """
+    Handles profiling of the running application, see ProfilingService
+    """
+    def initialize(self, profiling_svc):
+        self.profiling_svc = profiling_svc
+
+    def get(self):
+        """
+        Get the status of the profiling session. Download the result of the
+        last session with ?format=pstats, ?format=text or ?format=collapsed
+        """
+        result_format = self.get_argument("format", None)
+        if result_format is None:
+            self.write_object(self.profiling_svc.status())
+            return
+        try:
+            content_type, content = self.profiling_svc.result(result_format)
+        except ProfilingError as e:
+            raise tornado.web.HTTPError(400, str(e))
+        self.set_header("Content-Type", content_type)
+        if result_format == "pstats":
+            self.set_header("Content-Disposition", "attachment; filename=profile.pstats")
+        self.write(content)
+
+    def put(self):
+        """
+        Start profiling. Call with e.g. {'mode': 'sampling', 'duration': 30}, where the
+        mode is 'cprofile' or 'sampling'. Optionally set the sampling 'interval' in seconds.
+        """
+        json_body = self.body_as_object(["mode", "duration"])
+        try:
+            self.profiling_svc.start(json_body["mode"], float(json_body["duration"]),
+                                     float(json_body.get("interval", 0.01)))
+        except (ProfilingError, ValueError) as e:
+            raise tornado.web.HTTPError(400, str(e))
+        self.write_object(self.profiling_svc.status())
+
+    def delete(self):
+        """
+        Stop the running profiling session
+        """
+        self.profiling_svc.stop()
+        self.write_object(self.profiling_svc.status())
+
+
 class ApiHelpHandler(BaseRestHandler):
     """
     Handles requests for the api help, available at the root of the application
@@ -75,7 +526,82 @@ class ApiHelpHandler(BaseRestHandler):
     def get(self):
         """Returns the help for the API"""
         base_url = "{0}://{1}".format(self.request.protocol, self.request.host)
-        help_doc = self.route_svc.get_help(base_url)
-        self.write_object(help_doc)
+        etag, body = self.route_svc.get_help_response(base_url)
+        self.set_header("Etag", etag)
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.write(body)
+
+
+class JobsHandler(BaseRestHandler):
+    """
+    Submits jobs to a JobRunner and lists them
+
+    The target is called in the job runner's pool with the JSON body of the POST, e.g.:
+        (r"/api/1.0/jobs", JobsHandler, dict(job_runner=job_runner, target=start_checksum)),
+        (r"/api/1.0/jobs/(\\w+)", JobHandler, dict(job_runner=job_runner))
+    """
+    def initialize(self, job_runner, target):
+        self.job_runner = job_runner
+        self.target = target
+
+    def get(self):
+        """
+        Lists the most recently updated jobs, and the number of jobs per state.
+        Filter on the state of the jobs with e.g. ?state=started, and set the
+        maximum number of jobs with ?limit=<n> (default 100).
+        """
+        state = self.get_argument("state", None)
+        try:
+            limit = int(self.get_argument("limit", 100))
+            jobs = self.job_runner.list(state, limit)
+        except (InvalidArteriaStateException, ValueError) as e:
+            raise tornado.web.HTTPError(400, str(e))
+        self.write_object({"jobs": [self._job_with_link(job) for job in jobs],
+                           "counts": self.job_runner.counts()})
+
+    def post(self):
+        """
+        Submits a job, which gets the JSON body as its argument. Responds with 202 and the
+        pending job, or 503 if the job queue is full.
+        """
+        body = self.body_as_object()
+        try:
+            job = self.job_runner.submit(self.target, args=(body,))
+        except JobQueueFullError as e:
+            raise tornado.web.HTTPError(503, str(e))
+        job_dict = self._job_with_link(job)
+        self.set_status(202)
+        self.set_header("Location", job_dict["link"])
+        self.write_object(job_dict)
+
+    def _job_with_link(self, job):
+        job_dict = job.to_dict()
+        job_dict["link"] = "{0}://{1}{2}/{3}".format(
+            self.request.protocol, self.request.host, self.request.path.rstrip("/"), job.id)
+        return job_dict
+
+
+class JobHandler(BaseRestHandler):
+    """
+    Polls and cancels a job in a JobRunner. See JobsHandler.
+    """
+    def initialize(self, job_runner):
+        self.job_runner = job_runner
+
+    def get(self, job_id):
+        """Returns the job, including its state"""
+        self.write_object(self._get_job(job_id).to_dict())
 
+    def delete(self, job_id):
+        """Cancels the job, unless it has already finished"""
+        self._get_job(job_id)
+        self.write_object(self.job_runner.cancel(job_id).to_dict())
 
+    def _get_job(self, job_id):
+        try:
+            return self.job_runner.get(job_id)
+        except UnknownJobError as e:
+            raise tornado.web.HTTPError(404, str(e))
@@ -0,0 +1,174 @@
+import logging
+import logging.handlers
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from arteria.exceptions import ArteriaUsageException
+
+# The handler that log levels are set on when no logger or handler is named,
+# as defined in the default logger config
+DEFAULT_HANDLER_NAME = "file_handler"
+
+# QueueHandler and QueueListener are not available on Python 2
+_QueueHandler = getattr(logging.handlers, "QueueHandler", logging.Handler)
+
+
+class BoundedQueueHandler(_QueueHandler):
+    """
+    Puts log records on a bounded queue, handling a full queue according to the overflow policy:
+     - drop_new: The new record is dropped
+     - drop_oldest: The oldest record in the queue is dropped to make room for the new one
+     - block: Waits until there is room in the queue
+    """
+
+    OVERFLOW_POLICIES = ("drop_new", "drop_oldest", "block")
+
+    # The handlers that the queued records are passed on to
+    listener_handlers = ()
+
+    def __init__(self, log_queue, overflow="drop_new"):
+        if overflow not in BoundedQueueHandler.OVERFLOW_POLICIES:
+            raise ArteriaUsageException("Unknown overflow policy '{0}', expected one of {1}"
+                                        .format(overflow,
+                                                ", ".join(BoundedQueueHandler.OVERFLOW_POLICIES)))
+        _QueueHandler.__init__(self, log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if self.overflow == "drop_oldest":
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(record)
+                self.dropped += 1
+                return
+            except (queue.Empty, queue.Full):
+                pass
+        self.dropped += 1
+
+
+class AsyncLogging(object):
+    """
+    Moves the handlers of the root logger, e.g. file handlers, to a background thread
+
+    The root logger gets a BoundedQueueHandler instead, so that logging on e.g. the IOLoop
+    thread never waits for I/O. Handler levels are still respected, and can be changed
+    while running.
+
+    The listener thread doesn't survive a fork, so install must be called after forking.
+    """
+
+    def __init__(self, queue_size=10000, overflow="drop_new"):
+        self._queue_size = queue_size
+        self._overflow = overflow
+        self._queue_handler = None
+        self._listener = None
+        self._handlers = []
+
+    def install(self):
+        if not hasattr(logging.handlers, "QueueListener"):
+            raise ArteriaUsageException("Asynchronous logging requires Python 3")
+        root = logging.getLogger()
+        self._handlers = list(root.handlers)
+        log_queue = queue.Queue(self._queue_size)
+        self._queue_handler = BoundedQueueHandler(log_queue, self._overflow)
+        self._queue_handler.listener_handlers = self._handlers
+        self._listener = logging.handlers.QueueListener(log_queue, *self._handlers,
+                                                        respect_handler_level=True)
+        for handler in self._handlers:
+            root.removeHandler(handler)
+        root.addHandler(self._queue_handler)
+        self._listener.start()
+
+    def uninstall(self):
+        """Stops the listener, after it has handled the queued records, and restores the handlers"""
+        if self._listener is None:
+            return
+        root = logging.getLogger()
+        root.removeHandler(self._queue_handler)
+        self._listener.stop()
+        for handler in self._handlers:
+            root.addHandler(handler)
+        self._listener = None
+
+    @property
+    def dropped(self):
+        """The number of records dropped because the queue was full"""
+        return self._queue_handler.dropped if self._queue_handler is not None else 0
+
+    def collect(self):
+        """A collector for the MetricsRegistry"""
+        return [("arteria_log_records_dropped_total", "counter",
+                 "Number of log records dropped because the log queue was full",
+                 [(None, self.dropped)])]
+
+
+def find_handler(name):
+    """Returns the handler with the name, as configured with logging.config, or None"""
+    for handler in _all_handlers():
+        if handler.get_name() == name:
+            return handler
+    return None
+
+
+def _all_handlers():
+    loggers = [logging.getLogger()] + [logger for logger in logging.Logger.manager.loggerDict.values()
+                                       if isinstance(logger, logging.Logger)]
+    seen = set()
+    for logger in loggers:
+        for handler in logger.handlers:
+            if id(handler) not in seen:
+                seen.add(id(handler))
+                yield handler
+                # Include handlers moved to a background thread by AsyncLogging
+                for listener_handler in getattr(handler, "listener_handlers", ()):
+                    yield listener_handler
+
+
+def _target(logger=None, handler=None):
+    if logger is not None and handler is not None:
+        raise ArteriaUsageException("Specify either a logger or a handler, not both")
+    if logger is not None:
+        return logging.getLogger(logger)
+    target = find_handler(handler or DEFAULT_HANDLER_NAME)
+    if target is None:
+        if handler is not None:
+            raise ArteriaUsageException("There is no log handler named '{0}'".format(handler))
+        # No default handler configured, fall back to the root logger
+        return logging.getLogger()
+    return target
+
+
+def set_level(level, logger=None, handler=None):
+    """
+    Sets the level of the live logger or handler, without reconfiguring logging
+
+    :param level: A level name, e.g. 'DEBUG'
+    :param logger: The name of a logger
+    :param handler: The name of a handler. If neither logger nor handler is supplied,
+                    the level of the handler named file_handler is set, or of the root
+                    logger if there is no such handler.
+    :raises: ArteriaUsageException if the level or handler is unknown
+    """
+    if not isinstance(logging.getLevelName(level), int):
+        raise ArteriaUsageException("Unknown log level '{0}'".format(level))
+    _target(logger, handler).setLevel(level)
+
+
+def get_level(logger=None, handler=None):
+    """Returns the name of the level of the logger or handler, see set_level"""
+    target = _target(logger, handler)
+    if isinstance(target, logging.Logger):
+        return logging.getLevelName(target.getEffectiveLevel())
+    return logging.getLevelName(target.level)
@@ -0,0 +1,179 @@
+import bisect
+import os
+import re
+import resource
+import timeit
+
+from tornado.web import URLSpec
+
+# Upper bounds in seconds of the request latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Requests are timed with the highest resolution clock available
+timer = timeit.default_timer
+
+
+class RouteMetrics(object):
+    """
+    Request metrics for one route. All counters are preallocated, so that recording
+    a request doesn't allocate any containers.
+    """
+
+    __slots__ = ("route", "count", "in_flight", "statuses", "buckets", "latency_sum")
+
+    def __init__(self, route, bucket_count):
+        self.route = route
+        self.count = 0
+        self.in_flight = 0
+        # Indexed by the HTTP status code
+        self.statuses = [0] * 600
+        # One count per bucket, plus one for latencies above the largest bucket
+        self.buckets = [0] * (bucket_count + 1)
+        self.latency_sum = 0.0
+
+
+class MetricsRegistry(object):
+    """
+    Collects request metrics per route, plus metrics from registered collectors, and
+    renders them in the Prometheus text format.
+
+    BaseRestHandler records the requests when the registry is available in the application
+    settings under the key 'metrics'. Requests are recorded on the IOLoop thread without
+    locking. When running with several workers, each worker process has its own metrics.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._by_handler = {}
+        self._collectors = []
+
+    def register_routes(self, routes):
+        """
+        Sets up metrics for the routes of the handlers in the tornado routes. A handler class
+        that is used in several routes gets one set of metrics per route, and its requests
+        are matched against the patterns of its routes to find theirs.
+        """
+        by_handler = {}
+        for route in routes:
+            if isinstance(route, URLSpec):
+                pattern, handler_class = route.regex.pattern, route.handler_class
+            else:
+                pattern, handler_class = route[0], route[1]
+            # Like tornado, match the whole path
+            regex = re.compile(pattern if pattern.endswith("$") else pattern + "$")
+            by_handler.setdefault(handler_class, []).append(
+                (regex, RouteMetrics(pattern, len(self._buckets))))
+        self._by_handler.update(by_handler)
+
+    def add_collector(self, collector):
+        """
+        Registers a callable that is called when the metrics are rendered. It should return
+        an iterable of (name, type, help, samples) tuples, where samples is a list of
+        (labels, value) tuples and labels is a dict (or None).
+        """
+        self._collectors.append(collector)
+
+    def start_request(self, handler_class, path=None):
+        """
+        Records the start of a request, returning the RouteMetrics to finish it with
+
+        :param handler_class: The class of the handler of the request
+        :param path: The path of the request, to tell the routes of the handler class apart
+        """
+        routes = self._by_handler.get(handler_class)
+        if routes is None:
+            routes = [(None, RouteMetrics(handler_class.__name__, len(self._buckets)))]
+            self._by_handler[handler_class] = routes
+        route_metrics = routes[0][1]
+        if len(routes) > 1 and path is not None:
+            # Only handler classes used in several routes pay for matching the path
+            for regex, metrics in routes:
+                if regex.match(path):
+                    route_metrics = metrics
+                    break
+        route_metrics.in_flight += 1
+        return route_metrics
+
+    def finish_request(self, route_metrics, status, latency):
+        route_metrics.in_flight -= 1
+        route_metrics.count += 1
+        if 0 <= status < 600:
+            route_metrics.statuses[status] += 1
+        route_metrics.buckets[bisect.bisect_left(self._buckets, latency)] += 1
+        route_metrics.latency_sum += latency
+
+    def collect(self):
+        """Returns the metrics as (name, type, help, samples) tuples"""
+        routes = sorted((route_metrics for handler_routes in self._by_handler.values()
+                         for _, route_metrics in handler_routes),
+                        key=lambda route_metrics: route_metrics.route)
+        metrics = [
+            ("arteria_http_requests_total", "counter", "Number of finished requests",
+             [({"route": route.route, "status": str(status)}, count)
+              for route in routes
+              for status, count in enumerate(route.statuses) if count]),
+            ("arteria_http_requests_in_flight", "gauge", "Number of requests being handled",
+             [({"route": route.route}, route.in_flight) for route in routes]),
+            ("arteria_http_request_duration_seconds", "histogram", "Request latency",
+             [sample for route in routes for sample in self._histogram_samples(route)]),
+        ]
+        for collector in self._collectors:
+            metrics.extend(collector())
+        return metrics
+
+    def _histogram_samples(self, route):
+        cumulative = 0
+        for bound, count in zip(self._buckets + (float("inf"),), route.buckets):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            yield {"route": route.route, "le": le}, cumulative, "_bucket"
+        yield {"route": route.route}, route.latency_sum, "_sum"
+        yield {"route": route.route}, route.count, "_count"
+
+    def render(self):
+        """Renders the metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, metric_type, help_text, samples in self.collect():
+            lines.append("# HELP {0} {1}".format(name, help_text))
+            lines.append("# TYPE {0} {1}".format(name, metric_type))
+            for sample in samples:
+                labels, value = sample[0], sample[1]
+                suffix = sample[2] if len(sample) > 2 else ""
+                lines.append("{0}{1}{2} {3}".format(name, suffix, _format_labels(labels),
+                                                   _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = ('{0}="{1}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+               for key, value in sorted(labels.items()))
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def process_metrics():
+    """A collector for the resident memory and the number of open file descriptors"""
+    metrics = []
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        # ru_maxrss is the peak rather than the current value, and in kilobytes on Linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    metrics.append(("process_resident_memory_bytes", "gauge", "Resident memory size",
+                    [(None, rss)]))
+    try:
+        open_fds = len(os.listdir("/proc/self/fd"))
+        metrics.append(("process_open_fds", "gauge", "Number of open file descriptors",
+                        [(None, open_fds)]))
+    except OSError:
+        pass
+    return metrics
+
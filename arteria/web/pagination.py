@@ -0,0 +1,163 @@
+"""
+Cursor pagination and field projection of listings
+
+A page is read from a source without materializing the rest of it, so the source can be a
+generator, e.g. over a directory or a database cursor. Cursors are opaque to clients: they
+are base64 encoded JSON with the position after the last item of the page.
+
+There are two kinds of positions:
+ - offset: The number of items to skip. Works with any iterable, but skipping is linear in
+   the offset for iterators, and items added or removed between requests shift the pages.
+ - key: The sort key of the last item, and the number of items with that key on the pages so
+   far, so that items with the same key are neither repeated nor left out. Used when a
+   sort_key is given, for sources sorted by it. Pages are then stable while items are added.
+   If the source is a callable, it is called with the key to continue from (None for the
+   first page) and returns the items from the first one with that key, e.g. from an index,
+   so that only the items with the key are skipped.
+"""
+import base64
+import itertools
+import json
+
+from arteria.exceptions import ArteriaUsageException
+
+
+def encode_cursor(position):
+    """Returns an opaque cursor for the position, a JSON serializable dict"""
+    data = json.dumps(position, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Returns the position of the cursor
+
+    :raises: InvalidCursorError if the cursor wasn't created by encode_cursor
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(data.decode("utf-8"))
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursorError("Invalid cursor '{0}'".format(cursor))
+    if not isinstance(position, dict):
+        raise InvalidCursorError("Invalid cursor '{0}'".format(cursor))
+    return position
+
+
+class Page(object):
+    """The items of a page, and the cursor of the next page, or None if this is the last one"""
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+
+def paginate(source, limit, cursor=None, sort_key=None, reverse=False):
+    """
+    Returns a Page of at most limit items from the source, see the module documentation
+
+    :param source: An iterable, or a callable returning one when sort_key is given
+    :param limit: The maximum number of items in the page
+    :param cursor: The cursor from the previous page, or None for the first page
+    :param sort_key: A function returning the JSON serializable sort key of an item
+    :param reverse: True if the source is sorted in descending order of sort_key
+    :raises: InvalidCursorError if the cursor is invalid
+    """
+    position = decode_cursor(cursor) if cursor else {}
+    if sort_key is None:
+        offset = position.get("offset", 0)
+        if not isinstance(offset, int) or offset < 0:
+            raise InvalidCursorError("Invalid cursor '{0}'".format(cursor))
+        if isinstance(source, (list, tuple)):
+            items = list(source[offset:offset + limit + 1])
+        else:
+            items = list(itertools.islice(source, offset, offset + limit + 1))
+    else:
+        key, skip = _sort_position(position, cursor)
+        items = source(key) if callable(source) else source
+        if key is not None:
+            items = _continue_from(items, key, skip, sort_key, reverse, cursor)
+        items = list(itertools.islice(items, limit + 1))
+    # One item more than the limit is read, to know if there is a next page
+    if len(items) <= limit:
+        return Page(items, None)
+    items = items[:limit]
+    if sort_key is None:
+        next_position = {"offset": offset + limit}
+    else:
+        next_key = sort_key(items[-1])
+        next_skip = 0
+        for item in reversed(items):
+            if sort_key(item) != next_key:
+                break
+            next_skip += 1
+        if next_skip == len(items) and next_key == key:
+            # All of the page has the key of the cursor, as had items on the previous pages
+            next_skip += skip
+        next_position = {"key": next_key, "skip": next_skip}
+    return Page(items, encode_cursor(next_position))
+
+
+def _sort_position(position, cursor):
+    """Returns the key and skip count of a position from a cursor, (None, 0) if it is empty"""
+    if not position:
+        return None, 0
+    key, skip = position.get("key"), position.get("skip")
+    if set(position) != set(["key", "skip"]) or not _is_key(key) or \
+            not isinstance(skip, int) or isinstance(skip, bool) or skip < 0:
+        raise InvalidCursorError("Invalid cursor '{0}'".format(cursor))
+    return _to_key(key), skip
+
+
+def _is_key(key):
+    if isinstance(key, list):
+        return all(_is_key(part) for part in key)
+    return key is None or isinstance(key, (bool, int, float, type(u""), str))
+
+
+def _to_key(key):
+    # JSON has no tuples, so tuple sort keys come back from the cursor as lists
+    if isinstance(key, list):
+        return tuple(_to_key(part) for part in key)
+    return key
+
+
+def _continue_from(items, key, skip, sort_key, reverse, cursor):
+    """Yields the items after the first skip items with the key, of items sorted by sort_key"""
+    items = iter(items)
+    for item in items:
+        item_key = sort_key(item)
+        try:
+            before = item_key > key if reverse else item_key < key
+        except TypeError:
+            # The key in the cursor is of another type than the keys of the items
+            raise InvalidCursorError("Invalid cursor '{0}'".format(cursor))
+        if item_key == key:
+            if skip > 0:
+                skip -= 1
+                continue
+        elif before:
+            continue
+        yield item
+        break
+    for item in items:
+        yield item
+
+
+def project(item, fields):
+    """
+    Returns the item, a dict or an object with the __dict__ attribute, as a dict with only
+    the fields. Fields the item doesn't have are left out. All fields are kept if fields
+    is None, and other items are returned as they are.
+    """
+    if not isinstance(item, dict):
+        if not hasattr(item, "__dict__"):
+            return item
+        item = item.__dict__
+    if fields is None:
+        return item
+    return dict((field, item[field]) for field in fields if field in item)
+
+
+class InvalidCursorError(ArteriaUsageException):
+    pass
@@ -0,0 +1,196 @@
+import io
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import tornado.ioloop
+
+from arteria.exceptions import ArteriaUsageException
+
+
+class ProfilingService(object):
+    """
+    Profiles a running service, one session at a time, for a bounded duration
+
+    Two modes are supported:
+     - cprofile: Deterministic profiling of the IOLoop thread with cProfile. The result
+       can be downloaded as a pstats file, or as a text summary.
+     - sampling: Samples the stacks of all threads (i.e. the IOLoop thread and any pool
+       threads) at a fixed interval. The result is in the collapsed stack format used
+       by flamegraph tools. The overhead is low enough to use in production.
+    """
+
+    MODES = ("cprofile", "sampling")
+    FORMATS = {"cprofile": ("pstats", "text"), "sampling": ("collapsed",)}
+
+    def __init__(self, max_duration=300, logger=None):
+        """
+        :param max_duration: The maximum duration in seconds of a profiling session
+        """
+        self._max_duration = max_duration
+        self._logger = logger or logging.getLogger(__name__)
+        self._session = None
+
+    def start(self, mode, duration, interval=0.01):
+        """
+        Starts a profiling session. cprofile sessions must be started on the IOLoop thread.
+
+        :param mode: One of ProfilingService.MODES
+        :param duration: Seconds after which the session is stopped
+        :param interval: Seconds between samples in the sampling mode
+        :raises: ProfilingError if a session is running or the arguments are invalid
+        """
+        if self.is_running():
+            raise ProfilingError("A profiling session is already running")
+        if mode not in ProfilingService.MODES:
+            raise ProfilingError("Unknown profiling mode '{0}', expected one of {1}"
+                                 .format(mode, ", ".join(ProfilingService.MODES)))
+        if not 0 < duration <= self._max_duration:
+            raise ProfilingError("The duration must be between 0 and {0} seconds"
+                                 .format(self._max_duration))
+        if not interval > 0:
+            # A zero interval would make the sampling thread spin for the whole session
+            raise ProfilingError("The sampling interval must be greater than 0 seconds")
+        if mode == "cprofile":
+            session = _CProfileSession(duration)
+        else:
+            session = _SamplingSession(duration, interval)
+        session.start()
+        self._session = session
+        self._logger.warning("Started {0} profiling for {1} seconds".format(mode, duration))
+
+    def stop(self):
+        """Stops the running session, if any"""
+        if self.is_running():
+            self._session.stop()
+            self._logger.warning("Stopped profiling")
+
+    def is_running(self):
+        return self._session is not None and self._session.running
+
+    def status(self):
+        if self._session is None:
+            return {"running": False}
+        return {"running": self._session.running,
+                "mode": self._session.mode,
+                "started": self._session.started,
+                "duration": self._session.duration,
+                "formats": list(ProfilingService.FORMATS[self._session.mode])}
+
+    def result(self, result_format):
+        """
+        Returns the result of the last session as (content type, content)
+
+        :raises: ProfilingError if there is no finished session or the format is not
+                 supported by the mode of the session
+        """
+        if self._session is None or self._session.running:
+            raise ProfilingError("There is no finished profiling session")
+        if result_format not in ProfilingService.FORMATS[self._session.mode]:
+            raise ProfilingError("The format '{0}' is not supported for {1} profiling"
+                                 .format(result_format, self._session.mode))
+        return self._session.result(result_format)
+
+
+class _CProfileSession(object):
+    mode = "cprofile"
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.started = None
+        self.running = False
+        import cProfile
+        self._profile = cProfile.Profile()
+        self._timeout = None
+
+    def start(self):
+        self.started = time.time()
+        self._profile.enable()
+        self.running = True
+        io_loop = tornado.ioloop.IOLoop.current()
+        self._timeout = io_loop.call_later(self.duration, self.stop)
+
+    def stop(self):
+        if not self.running:
+            return
+        self._profile.disable()
+        self.running = False
+        tornado.ioloop.IOLoop.current().remove_timeout(self._timeout)
+
+    def result(self, result_format):
+        if result_format == "pstats":
+            # The same format as written by pstats.Stats.dump_stats
+            import marshal
+            self._profile.create_stats()
+            return "application/octet-stream", marshal.dumps(self._profile.stats)
+        import pstats
+        out = io.StringIO() if sys.version_info[0] >= 3 else io.BytesIO()
+        stats = pstats.Stats(self._profile, stream=out)
+        stats.sort_stats("cumulative").print_stats(100)
+        return "text/plain; charset=utf-8", out.getvalue()
+
+
+class _SamplingSession(object):
+    mode = "sampling"
+
+    def __init__(self, duration, interval):
+        self.duration = duration
+        self.started = None
+        self.running = False
+        self._interval = interval
+        self._stacks = Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.time()
+        self.running = True
+        self._thread = threading.Thread(target=self._sample_until_stopped,
+                                        name="arteria-sampling-profiler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _sample_until_stopped(self):
+        own_ident = threading.current_thread().ident
+        deadline = self.started + self.duration
+        try:
+            while True:
+                # Waits no longer than the deadline, so long intervals don't overrun it
+                remaining = deadline - time.time()
+                if remaining <= 0 or self._stop_event.wait(min(self._interval, remaining)) \
+                        or time.time() >= deadline:
+                    break
+                names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+                for ident, frame in sys._current_frames().items():
+                    if ident != own_ident:
+                        self._stacks[_collapse(names.get(ident, str(ident)), frame)] += 1
+        finally:
+            self.running = False
+
+    def result(self, result_format):
+        lines = ("{0} {1}".format(stack, count)
+                 for stack, count in sorted(self._stacks.items()))
+        return "text/plain; charset=utf-8", "\n".join(lines) + "\n"
+
+
+def _collapse(thread_name, frame):
+    """Formats the stack as 'thread;outermost;...;innermost'"""
+    functions = []
+    while frame is not None:
+        code = frame.f_code
+        functions.append("{0}:{1}".format(os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    functions.append(thread_name.replace(";", "_").replace(" ", "_"))
+    return ";".join(reversed(functions))
+
+
+class ProfilingError(ArteriaUsageException):
+    pass
@@ -1,8 +1,13 @@
+import hashlib
 import threading
 import re
 import itertools
+from collections import OrderedDict
 from tornado.web import URLSpec
 
+from arteria.web import dispatch
+from arteria.web.encoding import json_dumps
+
 class RouteInfo:
     """Information about a method in a route"""
     def __init__(self, route, method, description):
@@ -15,7 +20,16 @@ class RouteInfo:
 
 
 class RouteService:
-    """Encapsulates Tornado routes and generates help from their class definitions"""
+    """
+    Encapsulates Tornado routes and generates help from their class definitions
+
+    The help is generated once per set of routes, independent of the base url. The
+    serialized help is then cached per base url, since the service may be reached
+    through several host names.
+    """
+
+    # The maximum number of base urls to cache the serialized help for
+    MAX_CACHED_BASE_URLS = 32
 
     def __init__(self, app_svc, debug):
         """
@@ -26,22 +40,60 @@ class RouteService:
         """
         self._app_svc = app_svc
         self._debug = debug
-        self._help_generated_lock = threading.Lock()
-        self._help_generated = False
+        self._help_lock = threading.Lock()
+        self._help_template = None
+        self._help_responses = OrderedDict()
 
         # NOTE: The routes are not set in the constructor because a reference
         # to the route service is needed in the api help route handler
         self._routes = None
 
     def set_routes(self, routes):
-        self._routes = routes
+        with self._help_lock:
+            self._routes = routes
+            self._help_template = None
+            self._help_responses = OrderedDict()
 
     def get_routes(self):
         return self._routes
 
+    def create_application(self, **settings):
+        """
+        Returns a tornado Application serving the routes. Requests are dispatched with
+        a CompiledRouter, so that services with hundreds of routes dispatch as fast as
+        services with a few, see arteria.web.dispatch.
+        """
+        return dispatch.create_application(self._routes, **settings)
+
     def get_help(self, base_url):
         """Returns the API help based on the routes"""
-        return self._generate_help(False, base_url)
+        return {"doc": [{"route": base_url + entry["route"], "methods": dict(entry["methods"])}
+                        for entry in self._get_help_template()]}
+
+    def get_help_response(self, base_url):
+        """
+        Returns the API help for the base url serialized as JSON, as a tuple of
+        (etag, UTF-8 encoded bytes)
+        """
+        response = self._help_responses.get(base_url)
+        if response is None:
+            body = json_dumps(self.get_help(base_url))
+            response = ('"{0}"'.format(hashlib.sha1(body).hexdigest()), body)
+            with self._help_lock:
+                if len(self._help_responses) >= RouteService.MAX_CACHED_BASE_URLS:
+                    self._help_responses.popitem(last=False)
+                self._help_responses[base_url] = response
+        return response
+
+    def _get_help_template(self):
+        """Returns the help with routes relative to the base url, generating it if needed"""
+        template = self._help_template
+        if template is None:
+            with self._help_lock:
+                if self._help_template is None:
+                    self._help_template = self._get_route_infos_grouped(self._routes, "")
+                template = self._help_template
+        return template
 
     def _get_route_infos(self, tornado_routes, base_url):
         """
@@ -113,14 +165,5 @@ class RouteService:
         routes = sorted(routes, key=lambda item: item["route"])
         return routes
 
-    def _generate_help(self, regenerate, base_url):
-        """Generates help from self._routes"""
-        if not self._help_generated or regenerate:
-            with self._help_generated_lock:
-                if not self._help_generated:
-                    self._route_infos = self._get_route_infos_grouped(self._routes, base_url)
-                    self._help_generated = True
-        return {"doc": self._route_infos}
-
 class RoutesNotSetError(Exception):
     pass
@@ -16,6 +16,9 @@ class State:
 
 valid_states = set([State.NONE, State.PENDING, State.READY, State.STARTED, State.DONE, State.ERROR, State.CANCELLED])
 
+# States that are final, i.e. that a job will not leave
+terminal_states = frozenset([State.DONE, State.ERROR, State.CANCELLED])
+
 def validate_state(state):
     """
     Raises InvalidRunfolderState if the state is not known
@@ -0,0 +1,147 @@
+"""
+Per-request tracing: request IDs, timed spans and Server-Timing headers
+
+When the application settings contain a Tracer under the key 'tracing', BaseRestHandler
+gives each request an ID, taken from the X-Request-ID request header if the client sent a
+valid one, and returns it in the X-Request-ID response header. The request is timed in spans:
+
+ - prepare: From the start of the request until it is admitted and the handler method is called
+ - handler: The handler method, including the spans below
+ - serialize: Encoding objects as JSON in write_object
+ - flush: Writing the response to the connection, including the flushes in write_stream
+
+Handlers add their own spans with e.g.:
+
+    with self.span("lookup"):
+        runfolder = self.runfolder_svc.get(path)
+
+The spans are sent in the Server-Timing response header, which browser developer tools show,
+and a sample of the requests are logged as a JSON line with the request ID and all spans.
+The flush span is only known after the headers have been written, so it is only in the log.
+
+With no Tracer in the settings, the cost per request is a dict lookup, and self.span returns
+a shared context manager that does nothing.
+"""
+import json
+import logging
+import random
+import re
+import uuid
+from collections import OrderedDict
+
+from arteria.web.metrics import timer
+
+# Request IDs from clients are used if they are short and safe to log and send on
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:/+=-]{1,128}$")
+
+
+class _NullSpan(object):
+    """The span used when tracing is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    __slots__ = ("_trace", "_name", "_start")
+
+    def __init__(self, trace, name):
+        self._trace = trace
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._trace.add(self._name, timer() - self._start)
+        return False
+
+
+class RequestTrace(object):
+    """
+    The spans of one request. Spans with the same name, e.g. from a span in a loop,
+    are added up.
+    """
+
+    def __init__(self, request_id, sampled=False):
+        self.request_id = request_id
+        self.sampled = sampled
+        self.start = timer()
+        # Durations in seconds by span name, in the order the spans were first recorded
+        self.spans = OrderedDict()
+
+    def span(self, name):
+        """Returns a context manager timing the code in it as the named span"""
+        return _Span(self, name)
+
+    def add(self, name, duration):
+        self.spans[name] = self.spans.get(name, 0.0) + duration
+
+    def elapsed(self):
+        return timer() - self.start
+
+    def server_timing(self):
+        """Returns the spans, and the total so far, as a Server-Timing header value"""
+        entries = ["{0};dur={1:.3f}".format(name, duration * 1000)
+                   for name, duration in self.spans.items()]
+        entries.append("total;dur={0:.3f}".format(self.elapsed() * 1000))
+        return ", ".join(entries)
+
+    def to_dict(self):
+        """Returns the request ID and the span durations in milliseconds"""
+        return {"request_id": self.request_id,
+                "spans": OrderedDict((name, round(duration * 1000, 3))
+                                     for name, duration in self.spans.items())}
+
+
+class Tracer(object):
+    """
+    Starts the traces of requests and logs them, see the module documentation
+
+    Usage example:
+        tracer = Tracer(sample_rate=0.05, slow_threshold=1.0)
+        application = tornado.web.Application(routes, tracing=tracer)
+
+    :param sample_rate: The fraction of the requests to log
+    :param slow_threshold: If set, requests taking longer than this many seconds are
+                           always logged
+    :param server_timing: If False, the Server-Timing header is not sent, e.g. for services
+                          that shouldn't expose their timings to clients
+    :param header: The request and response header with the request ID
+    """
+
+    def __init__(self, sample_rate=0.01, slow_threshold=None, server_timing=True,
+                 header="X-Request-ID", logger=None):
+        self._logger = logger or logging.getLogger(__name__)
+        self.sample_rate = float(sample_rate)
+        self.slow_threshold = slow_threshold
+        self.server_timing = server_timing
+        self.header = header
+
+    def start(self, request):
+        """Returns the RequestTrace of the tornado request"""
+        request_id = request.headers.get(self.header)
+        if request_id is None or not _VALID_REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        return RequestTrace(request_id, sampled=random.random() < self.sample_rate)
+
+    def finish(self, trace, request, status):
+        """Logs the trace of the finished request, if it is sampled or slow"""
+        total = trace.elapsed()
+        slow = self.slow_threshold is not None and total > self.slow_threshold
+        if not (trace.sampled or slow):
+            return
+        entry = trace.to_dict()
+        entry["method"] = request.method
+        entry["path"] = request.path
+        entry["status"] = status
+        entry["total"] = round(total * 1000, 3)
+        self._logger.log(logging.WARNING if slow else logging.INFO, json.dumps(entry))
@@ -0,0 +1,144 @@
+import bisect
+import logging
+import sys
+import threading
+import traceback
+
+import tornado.ioloop
+
+from arteria.web.metrics import timer
+
+# Upper bounds in seconds of the IOLoop lag histogram buckets
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+
+class IOLoopWatchdog(object):
+    """
+    Finds the code that blocks the IOLoop
+
+    A heartbeat callback is scheduled on the IOLoop every interval seconds, and the lag of
+    each one, i.e. how late it ran, is recorded in a histogram. A watcher thread checks
+    that the heartbeats keep coming. When the IOLoop has been blocked for more than
+    threshold seconds, the watcher captures the stack of the IOLoop thread and logs it,
+    which shows the call that is blocking it. When the IOLoop is running again, the total
+    time it was blocked is logged too.
+
+    The cost is one callback per interval on the IOLoop and a thread waking up a few times
+    per threshold, so it can be left on in production.
+
+    Must be started on the IOLoop thread, and after forking any workers.
+    """
+
+    def __init__(self, interval=0.5, threshold=1.0, buckets=LAG_BUCKETS, logger=None):
+        self._logger = logger or logging.getLogger(__name__)
+        self.interval = interval
+        self.threshold = threshold
+        self._buckets = tuple(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._lag_sum = 0.0
+        self._io_loop = None
+        self._loop_thread_id = None
+        self._expected = None
+        self._last_beat = None
+        self._timeout = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._watcher = None
+        # Set by the watcher thread when it has reported the current stall
+        self._stall_started = None
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+
+    def start(self):
+        self._io_loop = tornado.ioloop.IOLoop.current()
+        self._loop_thread_id = threading.current_thread().ident
+        self._stopped.clear()
+        self._last_beat = timer()
+        self._schedule()
+        self._watcher = threading.Thread(target=self._watch, name="IOLoopWatchdog")
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._timeout is not None:
+            self._io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def _schedule(self):
+        self._expected = self._io_loop.time() + self.interval
+        self._timeout = self._io_loop.call_at(self._expected, self._beat)
+
+    def _beat(self):
+        lag = max(0.0, self._io_loop.time() - self._expected)
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self._lag_sum += lag
+        self._counts[bisect.bisect_left(self._buckets, lag)] += 1
+        with self._lock:
+            self._last_beat = timer()
+            stall_started, self._stall_started = self._stall_started, None
+        if stall_started is not None:
+            self._logger.warning("The IOLoop was blocked for {0:.2f}s".format(
+                self._last_beat - stall_started))
+        self._schedule()
+
+    def _watch(self):
+        check_interval = min(self.interval, self.threshold) / 2.0
+        while not self._stopped.wait(check_interval):
+            with self._lock:
+                overdue = timer() - self._last_beat - self.interval
+                if overdue <= self.threshold or self._stall_started is not None:
+                    continue
+                self._stall_started = self._last_beat + self.interval
+                self.stalls += 1
+            self._logger.warning("The IOLoop has been blocked for {0:.2f}s, in:\n{1}".format(
+                overdue, self.loop_stack()))
+
+    def loop_stack(self):
+        """Returns the current stack of the IOLoop thread, formatted like a traceback"""
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return "(the IOLoop thread is not running)"
+        return "".join(traceback.format_stack(frame))
+
+    def health(self):
+        """
+        Returns a summary of the IOLoop lag. The status is 'degraded' if the last
+        heartbeat was later than the threshold.
+        """
+        count = sum(self._counts)
+        return {"status": "degraded" if self.last_lag > self.threshold else "ok",
+                "threshold": self.threshold,
+                "last_lag": self.last_lag,
+                "max_lag": self.max_lag,
+                "mean_lag": self._lag_sum / count if count else 0.0,
+                "stalls": self.stalls,
+                "lag_histogram": dict(("+Inf" if bound is None else repr(bound), cumulative)
+                                      for bound, cumulative in self._cumulative())}
+
+    def _cumulative(self):
+        cumulative = 0
+        for bound, count in zip(self._buckets + (None,), self._counts):
+            cumulative += count
+            yield bound, cumulative
+
+    def collect(self):
+        """A collector for the MetricsRegistry"""
+        samples = [({"le": "+Inf" if bound is None else repr(bound)}, cumulative, "_bucket")
+                   for bound, cumulative in self._cumulative()]
+        samples.append((None, self._lag_sum, "_sum"))
+        samples.append((None, sum(self._counts), "_count"))
+        return [("arteria_ioloop_lag_seconds", "gauge", "Last measured IOLoop scheduling lag",
+                 [(None, self.last_lag)]),
+                ("arteria_ioloop_lag_max_seconds", "gauge", "Largest measured IOLoop lag",
+                 [(None, self.max_lag)]),
+                ("arteria_ioloop_scheduling_lag_seconds", "histogram", "IOLoop scheduling lag",
+                 samples),
+                ("arteria_ioloop_stalls_total", "counter",
+                 "Number of times the IOLoop was blocked for longer than the threshold",
+                 [(None, self.stalls)])]
@@ -0,0 +1,67 @@
+class SharedSetting:
+    """
+    A short string value shared between the worker processes of a multi-process AppService
+
+    Must be created before the workers are forked. A worker that changes the value writes it
+    here, and all workers pick it up when they poll and notice that the generation changed.
+    Workers that are restarted by the supervisor pick up the current value on their first poll.
+    Values made up of several parts, e.g. a JSON encoded dict, are changed with update, so that
+    changes made by different workers at the same time aren't lost.
+
+    Usage example:
+        log_level = SharedSetting()
+        # ...fork the workers...
+        log_level.set("DEBUG")  # in one of the workers
+        log_level.poll()  # in all workers, returns "DEBUG" once, then None until set again
+    """
+
+    MAX_LENGTH = 256
+
+    def __init__(self, max_length=MAX_LENGTH):
+        """
+        :param max_length: The size in bytes of the shared memory for the value
+        """
+        import multiprocessing
+        self._max_length = max_length
+        self._generation = multiprocessing.Value('i', 0)
+        self._value = multiprocessing.Array('c', max_length, lock=False)
+        self._seen_generation = 0
+
+    def set(self, value):
+        with self._generation.get_lock():
+            self._store(value)
+
+    def update(self, function):
+        """
+        Sets the value to function(current value), where the current value is None if it
+        has never been set, while holding the lock. Returns the new value.
+        """
+        with self._generation.get_lock():
+            current = self._value.value.decode("utf-8") if self._generation.value else None
+            value = function(current)
+            self._store(value)
+            return value
+
+    def _store(self, value):
+        encoded = value.encode("utf-8")
+        if len(encoded) >= self._max_length:
+            raise ValueError("The value can be at most {0} bytes".format(self._max_length - 1))
+        self._value.value = encoded
+        self._generation.value += 1
+        self._seen_generation = self._generation.value
+
+    def get(self):
+        """Returns the current value, or None if it has never been set"""
+        with self._generation.get_lock():
+            if self._generation.value == 0:
+                return None
+            return self._value.value.decode("utf-8")
+
+    def poll(self):
+        """Returns the value if it has been changed since the last poll or set, otherwise None"""
+        with self._generation.get_lock():
+            generation = self._generation.value
+            if generation == self._seen_generation:
+                return None
+            self._seen_generation = generation
+            return self._value.value.decode("utf-8")
@@ -0,0 +1,75 @@
+"""
+Benchmarks the time it takes to load a large app.config on startup, using the
+pure-Python YAML loader, the libyaml loader and the compiled config cache.
+
+Usage: python benchmarks/config_startup.py [--samples N] [--repeat N]
+"""
+import os
+import shutil
+import tempfile
+import timeit
+from argparse import ArgumentParser
+
+import yaml
+
+from arteria.configuration import ConfigurationService
+
+
+def write_large_config(path, samples):
+    """Writes an app.config with a sample table and a project table"""
+    config = {
+        "port": 10000,
+        "samples": [{"name": "sample_{0}".format(i),
+                     "project": "project_{0}".format(i % 100),
+                     "lane": i % 8 + 1,
+                     "barcode": "ACGT{0:06d}".format(i),
+                     "paths": ["/data/runfolders/run_{0}/sample_{1}.fastq.gz".format(i % 10, i)]}
+                    for i in range(samples)],
+        "projects": dict(("project_{0}".format(i), {"owner": "owner_{0}".format(i),
+                                                     "delivery": True})
+                         for i in range(100)),
+    }
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    config_dir = tempfile.mkdtemp()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(config_dir, "app.config")
+        write_large_config(path, args.samples)
+
+        def load_pure_python():
+            with open(path, "rb") as f:
+                yaml.load(f.read(), Loader=yaml.SafeLoader)
+
+        def load_service(**kwargs):
+            ConfigurationService(app_config_path=path, **kwargs).get_app_config()
+
+        # Populate the compiled cache
+        load_service(compiled_cache_dir=cache_dir)
+
+        print("app.config with {0} samples, {1:.1f} MB".format(
+            args.samples, os.path.getsize(path) / 1024.0 / 1024.0))
+        cases = [
+            ("yaml.SafeLoader (pure Python)", load_pure_python),
+            ("ConfigurationService (libyaml)", load_service),
+            ("ConfigurationService (compiled cache)",
+             lambda: load_service(compiled_cache_dir=cache_dir)),
+        ]
+        for name, func in cases:
+            best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+            print("{0:<40} {1:>10.1f} ms".format(name, best * 1000))
+    finally:
+        shutil.rmtree(config_dir)
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == "__main__":
+    main()
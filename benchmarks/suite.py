@@ -0,0 +1,318 @@
+"""
+Benchmarks of the hot paths of arteria, compared against a stored baseline
+
+Each benchmark is timed over a number of repeats, and reports the median time per
+operation, together with its noise: the median absolute deviation of the repeats, relative
+to the median. The medians are compared with a baseline, and the run fails if any benchmark
+is slower than its baseline by more than the threshold, or by more than three times the noise
+of either run, whichever is larger.
+
+Baselines are only comparable between runs on the same machine and Python version, so there
+are two kinds:
+ - Reference baselines, kept in the repository under benchmarks/baselines/, named by the
+   machine and Python version, e.g. x86_64-py3.11.json. They are stored for each release
+   with --save --reference, on the same machine, to compare the performance of releases.
+ - A local baseline, benchmarks/baseline.json, which is not kept in the repository. Store
+   one with --save before making a change to measure.
+
+By default, runs are compared with the local baseline if there is one, and otherwise with
+the reference baseline of the machine.
+
+Usage: python benchmarks/suite.py [--save] [--reference] [--baseline PATH]
+                                  [--threshold 0.2] [--repeat N] [--filter NAME]
+"""
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+from argparse import ArgumentParser
+from collections import OrderedDict
+
+# Run as a script, only the benchmarks directory is on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tornado.httpclient
+import tornado.httpserver
+import tornado.httputil
+import tornado.ioloop
+import tornado.testing
+import tornado.web
+from tornado import gen
+
+from arteria.configuration import ConfigurationService
+from arteria.web.app import AppService
+from arteria.web.dispatch import create_application
+from arteria.web.handlers import BaseRestHandler
+from arteria.web.routes import RouteService
+
+from config_startup import write_large_config
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_BASELINE = os.path.join(BENCHMARKS_DIR, "baseline.json")
+REFERENCE_BASELINE = os.path.join(BENCHMARKS_DIR, "baselines", "{0}-py{1}.json".format(
+    platform.machine(), ".".join(platform.python_version_tuple()[:2])))
+
+# Benchmarks by name, as (setup, number, ops) tuples
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name, number=1, ops=1):
+    """
+    Registers a benchmark. The decorated setup function is a generator getting a temporary
+    directory, that yields the function to time and then cleans up.
+
+    :param number: The number of calls to the function per repeat
+    :param ops: The number of operations per call, e.g. requests sent
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = (setup, number, ops)
+        return setup
+    return decorator
+
+
+@benchmark("config.load", number=5)
+def bench_config_load(tmp_dir):
+    path = os.path.join(tmp_dir, "app.config")
+    write_large_config(path, 2000)
+    yield lambda: ConfigurationService(app_config_path=path).get_app_config()
+
+
+@benchmark("config.lookup", number=100000)
+def bench_config_lookup(tmp_dir):
+    path = os.path.join(tmp_dir, "app.config")
+    write_large_config(path, 10)
+    config_svc = ConfigurationService(app_config_path=path)
+    yield lambda: config_svc["port"]
+
+
+class DocumentedHandler(BaseRestHandler):
+    def get(self):
+        """Returns the item"""
+
+    def put(self):
+        """Updates the item"""
+
+    def delete(self):
+        """Deletes the item"""
+
+
+@benchmark("routes.help_grouped", number=20)
+def bench_routes_grouped(tmp_dir):
+    route_svc = RouteService(None, debug=False)
+    routes = [(r"/api/1.0/resource_{0}/(\w+)".format(i), DocumentedHandler) for i in range(500)]
+    yield lambda: route_svc._get_route_infos_grouped(routes, "http://localhost:10000")
+
+
+def bench_dispatch(tmp_dir, route_count, application_factory):
+    routes = [(r"/api/1.0/instruments/instrument_{0}/(\w+)".format(i), DocumentedHandler)
+              for i in range(route_count)]
+    application = application_factory(routes)
+    # The last route, which tornado's own routing finds last
+    request = tornado.httputil.HTTPServerRequest(
+        method="GET", uri="/api/1.0/instruments/instrument_{0}/status".format(route_count - 1))
+    yield lambda: application.find_handler(request)
+
+
+for _count in (10, 100, 1000):
+    benchmark("dispatch.tornado_{0}_routes".format(_count), number=1000)(
+        functools.partial(bench_dispatch, route_count=_count,
+                          application_factory=tornado.web.Application))
+    benchmark("dispatch.compiled_{0}_routes".format(_count), number=1000)(
+        functools.partial(bench_dispatch, route_count=_count,
+                          application_factory=functools.partial(create_application, min_routes=0)))
+
+
+class _Connection(object):
+    """The part of the HTTP connection a RequestHandler needs outside of a server"""
+    def set_close_callback(self, callback):
+        pass
+
+
+def _large_payload():
+    return {"samples": [{"name": "sample_{0}".format(i), "lane": i % 8 + 1,
+                         "barcode": "ACGT{0:06d}".format(i), "reads": i * 1000,
+                         "paths": ["/data/runfolders/run_{0}/sample_{1}.fastq.gz".format(i % 10, i)]}
+                        for i in range(10000)]}
+
+
+def _handler(body=b""):
+    request = tornado.httputil.HTTPServerRequest(method="POST", uri="/", body=body,
+                                                 connection=_Connection())
+    return BaseRestHandler(tornado.web.Application(), request)
+
+
+@benchmark("handlers.write_object", number=10)
+def bench_write_object(tmp_dir):
+    payload = _large_payload()
+    handler = _handler()
+
+    def write():
+        handler._write_buffer = []
+        handler.write_object(payload)
+    yield write
+
+
+@benchmark("handlers.body_as_object", number=10)
+def bench_body_as_object(tmp_dir):
+    handler = _handler(json.dumps(_large_payload()).encode("utf-8"))
+    yield lambda: handler.body_as_object(["samples"])
+
+
+class PingHandler(BaseRestHandler):
+    def get(self):
+        """Returns pong"""
+        self.write_object({"ping": "pong"})
+
+
+@benchmark("http.requests", number=1, ops=500)
+def bench_http_requests(tmp_dir):
+    logger_config = os.path.join(tmp_dir, "logger.config")
+    with open(logger_config, "w") as f:
+        f.write("version: 1\ndisable_existing_loggers: False\n")
+    app_config = os.path.join(tmp_dir, "app.config")
+    with open(app_config, "w") as f:
+        f.write("port: 0\n")
+    config_svc = ConfigurationService(logger_config_path=logger_config,
+                                      app_config_path=app_config)
+    # The application is built the way AppService.start builds it
+    app_svc = AppService(config_svc, debug=False, port=0)
+    application = app_svc.build_application([(r"/api/1.0/ping", PingHandler)])
+    io_loop = tornado.ioloop.IOLoop()
+    state = {}
+
+    @gen.coroutine
+    def setup():
+        sock, port = tornado.testing.bind_unused_port()
+        state["server"] = tornado.httpserver.HTTPServer(application)
+        state["server"].add_sockets([sock])
+        state["client"] = tornado.httpclient.AsyncHTTPClient(force_instance=True, max_clients=10)
+        state["url"] = "http://127.0.0.1:{0}/api/1.0/ping".format(port)
+
+    @gen.coroutine
+    def send_requests():
+        # Ten concurrent clients sending 50 requests each
+        @gen.coroutine
+        def client():
+            for _ in range(50):
+                yield state["client"].fetch(state["url"])
+        yield [client() for _ in range(10)]
+
+    io_loop.run_sync(setup)
+    yield lambda: io_loop.run_sync(send_requests)
+    state["client"].close()
+    state["server"].stop()
+    io_loop.close(all_fds=True)
+
+
+# The noise of a benchmark is multiplied by this to get the change it can explain
+NOISE_FACTOR = 3
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def run(names, repeat):
+    """
+    Runs the benchmarks, returning dicts with the median seconds per operation and the
+    relative noise by name
+    """
+    results = OrderedDict()
+    for name in names:
+        setup, number, ops = BENCHMARKS[name]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            steps = setup(tmp_dir)
+            func = next(steps)
+            func()  # Warm up
+            times = [seconds / number / ops
+                     for seconds in timeit.repeat(func, number=number, repeat=repeat)]
+            next(steps, None)
+        finally:
+            shutil.rmtree(tmp_dir)
+        median = _median(times)
+        results[name] = {"median": median,
+                         "noise": _median([abs(t - median) for t in times]) / median}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Prints the results next to the baseline, returning the names of the regressions"""
+    regressions = []
+    print("{0:<28} {1:>14} {2:>14} {3:>8} {4:>14} {5:>9}".format(
+        "benchmark", "us/op", "ops/s", "noise", "baseline us/op", "change"))
+    for name, result in results.items():
+        seconds = result["median"]
+        line = "{0:<28} {1:>14.2f} {2:>14.1f} {3:>8.1%}".format(
+            name, seconds * 1e6, 1.0 / seconds, result["noise"])
+        if name in baseline:
+            change = seconds / baseline[name]["median"] - 1
+            line += " {0:>14.2f} {1:>+8.1%}".format(baseline[name]["median"] * 1e6, change)
+            noise = max(result["noise"], baseline[name]["noise"])
+            if change > max(threshold, NOISE_FACTOR * noise):
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--save", action="store_true", help="Store the results as the baseline")
+    parser.add_argument("--reference", action="store_true",
+                        help="Use the reference baseline of the machine in benchmarks/baselines")
+    parser.add_argument("--baseline", help="The path of the baseline to use instead")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="The slowdown, as a fraction, counted as a regression")
+    parser.add_argument("--repeat", type=int, default=15)
+    parser.add_argument("--filter", default="", help="Only run benchmarks containing this")
+    args = parser.parse_args()
+
+    if args.baseline is None:
+        if args.reference or (not args.save and not os.path.exists(LOCAL_BASELINE)):
+            args.baseline = REFERENCE_BASELINE
+        else:
+            args.baseline = LOCAL_BASELINE
+    print("Baseline: {0}".format(args.baseline))
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    results = run(names, args.repeat)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save:
+        baseline.update(results)
+        if not os.path.isdir(os.path.dirname(args.baseline)):
+            os.makedirs(os.path.dirname(args.baseline))
+        with open(args.baseline, "w") as f:
+            json.dump({"python": platform.python_version(),
+                       "implementation": platform.python_implementation(),
+                       "tornado": tornado.version,
+                       "machine": platform.machine(),
+                       "processor": platform.processor(),
+                       "cpu_count": multiprocessing.cpu_count(),
+                       "platform": platform.platform(),
+                       "results": baseline}, f, indent=4, sort_keys=True)
+            f.write("\n")
+        print("Stored the baseline in {0}".format(args.baseline))
+    elif regressions:
+        print("{0} regressions beyond {1:.0%}, or the noise".format(len(regressions),
+                                                                   args.threshold))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,8 +15,13 @@ setup(
     install_requires=[
         'tornado>=4.2.1',
         'PyYAML>=3.13',
-        'requests>=2.20.0'
+        'requests>=2.20.0',
+        'futures>=3.2.0; python_version < "3"'
         ],
+    extras_require={
+        # Keeps the connections of ArteriaClient alive and pools them
+        'client': ['pycurl>=7.43'],
+        },
     author='SNP&SEQ Technology Platform, Uppsala University',
     packages=find_packages(),
     include_package_data=True
@@ -0,0 +1,186 @@
+import json
+
+from tornado import gen
+from tornado.locks import Event
+from tornado.tcpclient import TCPClient
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application, URLSpec
+
+from arteria.exceptions import ArteriaUsageException
+from arteria.web.admission import AdmissionCancelledError, AdmissionController, \
+    AdmissionRejectedError, Gate
+from arteria.web.events import EventChannel, EventLongPollHandler
+from arteria.web.handlers import BaseRestHandler
+
+from unittest import TestCase
+
+
+class GateTest(TestCase):
+
+    def test_queues_then_rejects(self):
+        gate = Gate("test", max_concurrent=1, max_queue=1, retry_after=3)
+        self.assertIsNone(gate.enter())
+        waiter = gate.enter()
+        self.assertFalse(waiter.done())
+        with self.assertRaises(AdmissionRejectedError) as context:
+            gate.enter()
+        self.assertEqual(context.exception.retry_after, 3)
+
+        gate.leave()
+        self.assertTrue(waiter.done())
+        self.assertEqual((gate.active, gate.queued, gate.rejected), (1, 0, 1))
+        gate.leave()
+        self.assertEqual(gate.active, 0)
+
+    def test_cancelled_waiters_leave_the_queue(self):
+        gate = Gate("test", max_concurrent=1, max_queue=1)
+        self.assertIsNone(gate.enter())
+        waiter = gate.enter()
+        gate.cancel(waiter)
+        with self.assertRaises(AdmissionCancelledError):
+            waiter.result()
+        # The place in the queue is free again
+        self.assertEqual(gate.queued, 0)
+        gate.enter()
+        gate.leave()
+        gate.leave()
+        self.assertEqual(gate.active, 0)
+
+
+class RoutesTest(TestCase):
+
+    def test_handler_class_with_different_limits_is_rejected(self):
+        admission = AdmissionController({"routes": {"/b": {"max_concurrent": 2}}})
+        with self.assertRaises(ArteriaUsageException):
+            admission.register_routes([
+                (r"/a", OtherHandler, dict(admission=dict(max_concurrent=1))),
+                (r"/b", OtherHandler)])
+        with self.assertRaises(ArteriaUsageException):
+            admission.register_routes([
+                (r"/a", OtherHandler, dict(admission=dict(max_concurrent=1))),
+                (r"/c", OtherHandler)])
+
+    def test_handler_class_with_the_same_limits(self):
+        admission = AdmissionController({"routes": {"/b": {"max_concurrent": 1}}})
+        routes = admission.register_routes([
+            (r"/a", OtherHandler, dict(admission=dict(max_concurrent=1))),
+            (r"/b", OtherHandler)])
+        self.assertEqual(len(routes), 2)
+        metrics = dict((name, samples) for name, _, _, samples in admission.collect())
+        self.assertEqual(metrics["arteria_admission_active"], [({"route": "/a|/b"}, 0)])
+
+    def test_config_patterns_match_url_specs(self):
+        admission = AdmissionController({"routes": {"/a": {"max_concurrent": 1}}})
+        admission.register_routes([URLSpec(r"/a", OtherHandler)])
+        metrics = dict((name, samples) for name, _, _, samples in admission.collect())
+        self.assertEqual(metrics["arteria_admission_active"], [({"route": "/a"}, 0)])
+
+
+class SlowHandler(BaseRestHandler):
+
+    def initialize(self, release):
+        self.release = release
+
+    @gen.coroutine
+    def get(self):
+        yield self.release.wait()
+        self.write_object({"done": True})
+
+
+class OtherHandler(BaseRestHandler):
+
+    def get(self):
+        self.write_object({"done": True})
+
+
+class AdmissionControlTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.release = Event()
+        self.admission = AdmissionController({"retry_after": 7})
+        routes = self.admission.register_routes([
+            (r"/slow", SlowHandler, dict(release=self.release,
+                                         admission=dict(max_concurrent=1, max_queue=1))),
+            (r"/other", OtherHandler),
+        ])
+        return Application(routes, admission=self.admission)
+
+    def _get(self, path):
+        return self.http_client.fetch(self.get_url(path), raise_error=False)
+
+    @gen_test
+    def test_excess_requests_are_queued_then_rejected(self):
+        first = self._get("/slow")
+        second = self._get("/slow")
+        yield gen.sleep(0.05)
+        rejected = yield self._get("/slow")
+        self.assertEqual(rejected.code, 503)
+        self.assertEqual(rejected.headers["Retry-After"], "7")
+
+        # Routes without limits are not affected
+        other = yield self._get("/other")
+        self.assertEqual(other.code, 200)
+
+        self.release.set()
+        responses = yield [first, second]
+        self.assertEqual([resp.code for resp in responses], [200, 200])
+        metrics = dict((name, samples) for name, _, _, samples in self.admission.collect())
+        self.assertEqual(metrics["arteria_admission_rejected_total"], [({"route": "/slow"}, 1)])
+        self.assertIn(({"route": "/slow"}, 1, "_count"), metrics["arteria_admission_wait_seconds"])
+        self.assertEqual(metrics["arteria_admission_active"], [({"route": "/slow"}, 0)])
+
+    @gen_test
+    def test_disconnected_clients_leave_the_queue(self):
+        first = self._get("/slow")
+        yield gen.sleep(0.05)
+        stream = yield TCPClient().connect("127.0.0.1", self.get_http_port())
+        yield stream.write(b"GET /slow HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        yield gen.sleep(0.05)
+        gate = self.admission._gates_by_handler[SlowHandler][0]
+        self.assertEqual(gate.queued, 1)
+
+        stream.close()
+        yield gen.sleep(0.05)
+        self.assertEqual(gate.queued, 0)
+        # The place in the queue can be taken by another request
+        second = self._get("/slow")
+        yield gen.sleep(0.05)
+        self.assertEqual(gate.queued, 1)
+        self.release.set()
+        responses = yield [first, second]
+        self.assertEqual([resp.code for resp in responses], [200, 200])
+        self.assertEqual((gate.active, gate.queued), (0, 0))
+
+
+class LongPollTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.admission = AdmissionController({"max_concurrent": 1})
+        routes = self.admission.register_routes([
+            (r"/events", EventLongPollHandler, dict(channel=EventChannel())),
+            (r"/other", OtherHandler)])
+        return Application(routes, admission=self.admission)
+
+    @gen_test
+    def test_long_polls_are_not_limited(self):
+        polls = [self.http_client.fetch(self.get_url("/events?wait=0.3")) for _ in range(3)]
+        yield gen.sleep(0.05)
+        other = yield self.http_client.fetch(self.get_url("/other"))
+        self.assertEqual(other.code, 200)
+        responses = yield polls
+        self.assertEqual([resp.code for resp in responses], [200, 200, 200])
+
+
+class GlobalLimitTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.admission = AdmissionController({"max_concurrent": 1, "max_queue": 0,
+                                              "routes": {"/other": {"max_concurrent": 2}}})
+        routes = self.admission.register_routes([(r"/other", OtherHandler)])
+        return Application(routes, admission=self.admission)
+
+    def test_config_limits(self):
+        self.assertEqual(self.fetch("/other").code, 200)
+        metrics = dict((name, samples) for name, _, _, samples in self.admission.collect())
+        self.assertEqual([labels["route"] for labels, _ in metrics["arteria_admission_active"]],
+                         ["/other", "all routes"])
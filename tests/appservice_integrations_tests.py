@@ -1,17 +1,39 @@
+import logging
 import os
+import shutil
+import tempfile
+
+import mock
+import yaml
 
 from arteria.web.app import AppService
 from unittest import TestCase
 
 
+def _config_root(tmp_dir):
+    """Copies the template configs to tmp_dir, with the log file in it rather than in the cwd"""
+    templates = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "templates")
+    shutil.copy(os.path.join(templates, "app.config"), tmp_dir)
+    with open(os.path.join(templates, "logger.config")) as f:
+        logger_config = yaml.safe_load(f)
+    logger_config["handlers"]["file_handler"]["filename"] = os.path.join(tmp_dir, "messages.log")
+    with open(os.path.join(tmp_dir, "logger.config"), "w") as f:
+        yaml.safe_dump(logger_config, f)
+    return tmp_dir
+
+
 class AppServiceTest(TestCase):
 
-    this_file_path = os.path.dirname(os.path.realpath(__file__))
+    def setUp(self):
+        self.config_root = _config_root(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.config_root)
 
     def test_can_load_configuration(self):
         app_svc = AppService.create(
                 product_name="arteria-test",
-                config_root="{}/../templates/".format(self.this_file_path))
+                config_root=self.config_root)
         self.assertIsNotNone(app_svc.config_svc)
         app_config = app_svc.config_svc.get_app_config()
         logger_config = app_svc.config_svc.get_logger_config()
@@ -22,7 +44,40 @@ class AppServiceTest(TestCase):
     def test_can_use_args(self):
         app_svc = AppService.create(
                 product_name="arteria-test",
-                config_root="{}/../templates/".format(self.this_file_path),
+                config_root=self.config_root,
                 args=['--port', '1234'])
 
         self.assertEquals(app_svc._port, 1234)
+
+    def test_can_set_workers(self):
+        app_svc = AppService.create(
+                product_name="arteria-test",
+                config_root=self.config_root,
+                args=['--workers', '4'])
+
+        self.assertEqual(app_svc._workers, 4)
+
+    def test_reuse_port_falls_back_to_a_shared_socket_on_old_tornado(self):
+        config_svc = AppService.create(product_name="arteria-test",
+                                       config_root=self.config_root).config_svc
+        app_svc = AppService(config_svc, debug=False, port=0, workers=2, reuse_port=True)
+        self.assertTrue(app_svc._reuse_port)
+        with mock.patch("tornado.version_info", (4, 2, 1, 0)):
+            app_svc = AppService(config_svc, debug=False, port=0, workers=2, reuse_port=True)
+        self.assertFalse(app_svc._reuse_port)
+
+    def test_log_levels_are_shared_between_workers(self):
+        app_svc = AppService.create(
+                product_name="arteria-test",
+                config_root=self.config_root,
+                args=['--workers', '2'])
+        loggers = [logging.getLogger("arteria.test.worker_{0}".format(i)) for i in range(2)]
+        pid = os.fork()
+        if pid == 0:
+            # Another worker sets the level of two loggers within one poll interval
+            app_svc.set_log_level("DEBUG", logger=loggers[0].name)
+            app_svc.set_log_level("ERROR", logger=loggers[1].name)
+            os._exit(0)
+        os.waitpid(pid, 0)
+        app_svc._sync_log_level()
+        self.assertEqual([logger.level for logger in loggers], [logging.DEBUG, logging.ERROR])
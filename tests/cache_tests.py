@@ -0,0 +1,102 @@
+import json
+
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application
+
+import arteria
+from arteria.web.cache import ResponseCache
+from arteria.web.handlers import BaseRestHandler
+
+from unittest import TestCase
+
+
+class CountingHandler(BaseRestHandler):
+    calls = 0
+
+    @arteria.cached(ttl=60, max_entries=2)
+    @gen.coroutine
+    def get(self, name):
+        """Returns how many times the response has been computed"""
+        CountingHandler.calls += 1
+        yield gen.sleep(0.05)
+        if name == "missing":
+            self.set_status(404)
+        elif name == "paged":
+            self.set_status(203)
+            self.set_header("Cache-Control", "max-age=60")
+            self.add_header("Link", '</next>; rel="next"')
+            self.add_header("Link", '</last>; rel="last"')
+        self.write_object({"name": name, "calls": CountingHandler.calls})
+
+
+class CachedDecoratorTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        CountingHandler.calls = 0
+        CountingHandler.get.invalidate()
+        return Application([(r"/status/(\w+)", CountingHandler)])
+
+    def _get(self, path, **kwargs):
+        return self.http_client.fetch(self.get_url(path), raise_error=False, **kwargs)
+
+    def test_response_is_cached(self):
+        first = self.fetch("/status/a")
+        second = self.fetch("/status/a")
+        self.assertEqual(json.loads(second.body)["calls"], 1)
+        self.assertEqual(first.headers["Etag"], second.headers["Etag"])
+
+        self.fetch("/status/b")
+        self.assertEqual(CountingHandler.calls, 2)
+
+    def test_status_and_headers_are_cached(self):
+        first = self.fetch("/status/paged")
+        second = self.fetch("/status/paged")
+        self.assertEqual(json.loads(second.body)["calls"], 1)
+        for resp in (first, second):
+            self.assertEqual(resp.code, 203)
+            self.assertEqual(resp.headers["Cache-Control"], "max-age=60")
+            self.assertEqual(resp.headers.get_list("Link"),
+                             ['</next>; rel="next"', '</last>; rel="last"'])
+            self.assertEqual(resp.headers["Content-Type"], first.headers["Content-Type"])
+
+    @gen_test
+    def test_concurrent_requests_are_computed_once(self):
+        responses = yield [self._get("/status/a") for _ in range(5)]
+        self.assertEqual([json.loads(resp.body)["calls"] for resp in responses], [1] * 5)
+
+    def test_etag_is_checked(self):
+        etag = self.fetch("/status/a").headers["Etag"]
+        resp = self.fetch("/status/a", headers={"If-None-Match": etag})
+        self.assertEqual(resp.code, 304)
+
+    def test_errors_are_not_cached(self):
+        self.fetch("/status/missing")
+        resp = self.fetch("/status/missing")
+        self.assertEqual(resp.code, 404)
+        self.assertEqual(CountingHandler.calls, 2)
+
+    def test_invalidate(self):
+        self.fetch("/status/a")
+        CountingHandler.get.invalidate("/status/a")
+        self.assertEqual(json.loads(self.fetch("/status/a").body)["calls"], 2)
+
+    def test_docstring_is_kept_for_api_help(self):
+        self.assertIn("how many times", CountingHandler.get.__doc__)
+
+
+class ResponseCacheTest(TestCase):
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResponseCache(ttl=60, max_entries=2)
+        for key in ("a", "b"):
+            cache.put((key, ""), b"{}")
+        cache.get(("a", ""))
+        cache.put(("c", ""), b"{}")
+        self.assertIsNone(cache.get(("b", "")))
+        self.assertIsNotNone(cache.get(("a", "")))
+
+    def test_entries_expire(self):
+        cache = ResponseCache(ttl=0, max_entries=2)
+        cache.put(("a", ""), b"{}")
+        self.assertIsNone(cache.get(("a", "")))
@@ -0,0 +1,181 @@
+import mock
+
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application
+
+from arteria.client import ArteriaClient, ArteriaClientError, CircuitBreaker, \
+    CircuitOpenError, WaitTimeoutError
+from arteria.web.events import EventChannel, EventLongPollHandler
+from arteria.web.handlers import BaseRestHandler
+from arteria.web.state import State
+
+from unittest import TestCase
+
+
+class CircuitBreakerTest(TestCase):
+
+    def test_opens_and_half_opens(self):
+        now = [0]
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+        now[0] = 10
+        self.assertTrue(breaker.allow())
+        # Only one trial call at a time
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        now[0] = 20
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_trial_with_unexpected_error(self):
+        now = [0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        now[0] = 10
+        self.assertTrue(breaker.allow())
+        breaker.record_error()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+
+
+class FlakyHandler(BaseRestHandler):
+    failures = 0
+
+    def get(self):
+        if FlakyHandler.failures > 0:
+            FlakyHandler.failures -= 1
+            self.set_header("Retry-After", "0")
+            self.set_status(503)
+            return
+        self.write_object({"ok": True})
+
+    def post(self):
+        FlakyHandler.failures += 1
+        self.set_status(500)
+
+
+class ItemHandler(BaseRestHandler):
+
+    def get(self, name):
+        if name == "missing":
+            self.set_status(404)
+            return
+        self.write_object({"name": name})
+
+
+class JobHandler(BaseRestHandler):
+
+    def initialize(self, jobs):
+        self.jobs = jobs
+
+    def get(self, job_id):
+        self.write_object({"id": job_id, "state": self.jobs[job_id]})
+
+
+class ArteriaClientTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        FlakyHandler.failures = 0
+        self.jobs = {}
+        self.channel = EventChannel()
+        return Application([
+            (r"/api/1.0/flaky", FlakyHandler),
+            (r"/api/1.0/items/(\w+)", ItemHandler),
+            (r"/api/1.0/jobs/(\w+)", JobHandler, dict(jobs=self.jobs)),
+            (r"/api/1.0/events", EventLongPollHandler, dict(channel=self.channel)),
+        ])
+
+    def setUp(self):
+        super(ArteriaClientTest, self).setUp()
+        self.client = ArteriaClient(self.get_url("/api/1.0"), backoff=0.01, max_retries=2)
+
+    def tearDown(self):
+        self.client.close()
+        super(ArteriaClientTest, self).tearDown()
+
+    @gen_test
+    def test_retries_until_success(self):
+        FlakyHandler.failures = 2
+        body = yield self.client.get("/flaky")
+        self.assertEqual(body, {"ok": True})
+
+    @gen_test
+    def test_gives_up_after_max_retries(self):
+        FlakyHandler.failures = 3
+        with self.assertRaises(ArteriaClientError) as context:
+            yield self.client.get("/flaky")
+        self.assertEqual(context.exception.code, 503)
+
+    @gen_test
+    def test_post_is_not_retried_on_server_errors(self):
+        with self.assertRaises(ArteriaClientError):
+            yield self.client.post("/flaky", {"a": 1})
+        self.assertEqual(FlakyHandler.failures, 1)
+
+    @gen_test
+    def test_client_errors_are_not_retried(self):
+        with self.assertRaises(ArteriaClientError) as context:
+            yield self.client.get("/items/missing")
+        self.assertEqual(context.exception.code, 404)
+
+    @gen_test
+    def test_circuit_opens(self):
+        self.client.circuit_breaker = CircuitBreaker(failure_threshold=2)
+        FlakyHandler.failures = 10
+        with self.assertRaises(CircuitOpenError):
+            yield self.client.get("/flaky")
+
+    @gen_test
+    def test_unexpected_error_ends_the_trial(self):
+        now = [0]
+        self.client.circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10,
+                                                     clock=lambda: now[0])
+        self.client.circuit_breaker.record_failure()
+        now[0] = 10
+        with mock.patch.object(self.client.http_client, "fetch", side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                yield self.client.get("/items/a")
+        body = yield self.client.get("/items/a")
+        self.assertEqual(body["name"], "a")
+        self.assertEqual(self.client.circuit_breaker.state, CircuitBreaker.CLOSED)
+
+    @gen_test
+    def test_get_many(self):
+        bodies = yield self.client.get_many(["/items/a", "/items/b", "/items/c"], concurrency=2)
+        self.assertEqual([body["name"] for body in bodies], ["a", "b", "c"])
+
+    @gen_test
+    def test_wait_for_state_polling(self):
+        self.jobs["1"] = State.STARTED
+        self.io_loop.call_later(0.05, lambda: self.jobs.update({"1": State.DONE}))
+        job = yield self.client.wait_for_state("/jobs/1", poll_interval=0.01, timeout=5)
+        self.assertEqual(job["state"], State.DONE)
+
+    @gen_test
+    def test_wait_for_state_timeout(self):
+        self.jobs["1"] = State.STARTED
+        with self.assertRaises(WaitTimeoutError):
+            yield self.client.wait_for_state("/jobs/1", poll_interval=0.01, timeout=0.1)
+
+    @gen_test
+    def test_wait_for_state_long_poll(self):
+        self.jobs["1"] = State.STARTED
+
+        def finish():
+            self.jobs["1"] = State.DONE
+            self.channel.publish("1", State.DONE)
+
+        self.io_loop.call_later(0.05, finish)
+        # A long poll interval, so polling alone would time out
+        job = yield self.client.wait_for_state("/jobs/1", poll_interval=30, timeout=5,
+                                               events_path="/events", entity_id="1")
+        self.assertEqual(job["state"], State.DONE)
@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from arteria.configuration import ConfigurationService
+
+
+class ConfigurationServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.app_config_path = os.path.join(self.config_dir, "app.config")
+        self._write_config("port: 10000\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.config_dir)
+
+    def _write_config(self, content):
+        with open(self.app_config_path, "w") as f:
+            f.write(content)
+
+    def _touch_later(self):
+        # Make sure the mtime changes even on file systems with coarse timestamps
+        stat = os.stat(self.app_config_path)
+        os.utime(self.app_config_path, (stat.st_atime, stat.st_mtime + 10))
+
+    def test_config_is_cached(self):
+        config_svc = ConfigurationService(app_config_path=self.app_config_path)
+        with mock.patch.object(ConfigurationService, "read_yaml",
+                               wraps=ConfigurationService.read_yaml) as read_yaml:
+            config_svc.get_app_config()
+            config_svc.get_app_config()
+            config_svc.check_for_changes()
+            self.assertEqual(read_yaml.call_count, 1)
+
+    def test_changed_config_is_reloaded(self):
+        config_svc = ConfigurationService(app_config_path=self.app_config_path, reload_interval=0)
+        self.assertEqual(config_svc["port"], 10000)
+        self._write_config("port: 10001\n")
+        self._touch_later()
+        self.assertEqual(config_svc["port"], 10001)
+
+    def test_reload_interval_is_respected(self):
+        config_svc = ConfigurationService(app_config_path=self.app_config_path,
+                                          reload_interval=3600)
+        self.assertEqual(config_svc["port"], 10000)
+        self._write_config("port: 10001\n")
+        self._touch_later()
+        self.assertEqual(config_svc["port"], 10000)
+        config_svc.check_for_changes()
+        self.assertEqual(config_svc["port"], 10001)
+
+    def test_listeners_are_notified_on_change(self):
+        config_svc = ConfigurationService(app_config_path=self.app_config_path,
+                                          reload_interval=None)
+        listener = mock.MagicMock()
+        config_svc.add_listener(listener)
+        config_svc.get_app_config()
+        config_svc.check_for_changes()
+        self.assertFalse(listener.called)
+
+        self._write_config("port: 10001\n")
+        self._touch_later()
+        config_svc.check_for_changes()
+        listener.assert_called_once_with(self.app_config_path, {"port": 10001})
+
+    def test_check_does_not_replace_newer_snapshot(self):
+        config_svc = ConfigurationService(app_config_path=self.app_config_path, reload_interval=0)
+        config_svc.get_app_config()
+        stale = config_svc._cache[self.app_config_path]
+        newer = stale._replace(config={"port": 10001})
+        signature = ConfigurationService._signature
+
+        def reloaded_by_other_thread(path):
+            # Another thread stores a reloaded config while this one checks the file
+            config_svc._cache[path] = newer
+            return signature(path)
+
+        with mock.patch.object(ConfigurationService, "_signature",
+                               side_effect=reloaded_by_other_thread):
+            self.assertEqual(config_svc.get_app_config(), {"port": 10001})
+        self.assertIs(config_svc._cache[self.app_config_path], newer)
+
+
+class CompiledConfigCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.app_config_path = os.path.join(self.config_dir, "app.config")
+        with open(self.app_config_path, "w") as f:
+            f.write("port: 10000\nsamples: [a, b]\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.config_dir)
+        shutil.rmtree(self.cache_dir)
+
+    def _create_config_svc(self):
+        return ConfigurationService(app_config_path=self.app_config_path,
+                                    compiled_cache_dir=self.cache_dir)
+
+    def test_unchanged_config_is_not_parsed_again(self):
+        self.assertEqual(self._create_config_svc()["samples"], ["a", "b"])
+        with mock.patch.object(ConfigurationService, "parse_yaml") as parse_yaml:
+            self.assertEqual(self._create_config_svc()["samples"], ["a", "b"])
+            self.assertFalse(parse_yaml.called)
+
+    def test_changed_config_is_parsed_again(self):
+        self._create_config_svc().get_app_config()
+        with open(self.app_config_path, "w") as f:
+            f.write("port: 10001\n")
+        self.assertEqual(self._create_config_svc()["port"], 10001)
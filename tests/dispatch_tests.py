@@ -0,0 +1,84 @@
+import json
+
+from tornado.httputil import HTTPServerRequest
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application, URLSpec
+
+from arteria.web.dispatch import create_application, literal_prefix
+from arteria.web.handlers import BaseRestHandler
+
+from unittest import TestCase
+
+
+class LiteralPrefixTest(TestCase):
+
+    def test_literal_prefix(self):
+        self.assertEqual(literal_prefix(r"/api/1\.0/admin$"), ("/api/1.0/admin", False, True))
+        self.assertEqual(literal_prefix(r"/api/1.0/admin$"), ("/api/1.0/admin", True, True))
+        self.assertEqual(literal_prefix(r"/api/1.0/runs/(\w+)$"), ("/api/1.0/runs/", True, False))
+        self.assertEqual(literal_prefix(r"/items?$"), ("/item", False, False))
+        self.assertEqual(literal_prefix(r"/a\d+$"), ("/a", False, False))
+        self.assertEqual(literal_prefix(r"/a|/b$"), ("", False, False))
+
+
+class NamedHandler(BaseRestHandler):
+
+    def initialize(self, name):
+        self.name = name
+
+    def get(self, *args, **kwargs):
+        self.write_object({"name": self.name, "args": list(args), "kwargs": kwargs})
+
+
+def _routes():
+    routes = [
+        (r"/api/1.0/runs/(\w+)", NamedHandler, dict(name="run")),
+        (r"/api/1.0/runs/latest", NamedHandler, dict(name="shadowed by run")),
+        (r"/api/1.0/admin/metrics", NamedHandler, dict(name="metrics")),
+        URLSpec(r"/api/1.0/projects/(?P<project>[^/]+)/samples", NamedHandler,
+                dict(name="samples"), name="samples"),
+        (r"/api/1\.0/static", NamedHandler, dict(name="static")),
+        (r"/api/1.0/items?", NamedHandler, dict(name="items")),
+        (r"/api/1.0/misc/.*", NamedHandler, dict(name="catch all")),
+        (r"/api/1.0/misc/unreachable", NamedHandler, dict(name="unreachable")),
+    ]
+    routes += [(r"/api/1.0/instruments/instrument_{0}/(\w+)".format(i), NamedHandler,
+                dict(name="instrument_{0}".format(i))) for i in range(100)]
+    return routes
+
+
+class CompiledRouterTest(TestCase):
+
+    paths = ["/api/1.0/runs/foo", "/api/1.0/runs/latest", "/api/1.0/admin/metrics",
+             "/api/1.0/projects/p%201/samples", "/api/1.0/static", "/api/1.0/item",
+             "/api/1.0/items", "/api/1.0/misc/unreachable",
+             "/api/1.0/instruments/instrument_42/status", "/api/1.0/instruments/instrument_42",
+             "/api/1X0/admin/metrics", "/api", "/missing", "/"]
+
+    def _find(self, application, path):
+        request = HTTPServerRequest(method="GET", uri=path)
+        delegate = application.find_handler(request)
+        return (delegate.handler_class, delegate.handler_kwargs,
+                delegate.path_args, delegate.path_kwargs)
+
+    def test_same_handlers_as_tornado(self):
+        tornado_app = Application(_routes())
+        compiled_app = create_application(_routes(), min_routes=0)
+        for path in self.paths:
+            self.assertEqual(self._find(compiled_app, path), self._find(tornado_app, path), path)
+
+    def test_reverse_url(self):
+        self.assertEqual(create_application(_routes(), min_routes=0).reverse_url("samples", "p1"),
+                         "/api/1.0/projects/p1/samples")
+
+
+class CompiledApplicationTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return create_application(_routes(), min_routes=0)
+
+    def test_dispatch(self):
+        resp = self.fetch("/api/1.0/instruments/instrument_99/status")
+        self.assertEqual(json.loads(resp.body),
+                         {"name": "instrument_99", "args": ["status"], "kwargs": {}})
+        self.assertEqual(self.fetch("/missing").code, 404)
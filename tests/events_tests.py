@@ -0,0 +1,121 @@
+import json
+import threading
+
+import mock
+
+from tornado import gen
+from tornado.httpclient import HTTPRequest, HTTPError
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application
+from tornado.websocket import websocket_connect
+
+from arteria.jobs import JobRunner
+from arteria.web.events import EventChannel, EventLongPollHandler, EventStreamHandler, \
+    EventWebSocketHandler
+from arteria.web.state import State
+
+from unittest import TestCase
+
+
+class EventChannelTest(TestCase):
+
+    def test_events_since_version(self):
+        channel = EventChannel(history_size=3)
+        for i in range(3):
+            channel.publish("job{0}".format(i % 2), State.STARTED)
+        self.assertEqual([event.version for event in channel.events_since(1)], [2, 3])
+        self.assertEqual([event.version for event in channel.events_since(0, "job1")], [2])
+
+    def test_latest_per_entity_when_history_is_exceeded(self):
+        channel = EventChannel(history_size=2)
+        for state in (State.STARTED, State.DONE):
+            for entity_id in ("job0", "job1", "job2"):
+                channel.publish(entity_id, state)
+        events = channel.events_since(0)
+        self.assertEqual([(event.entity_id, event.state) for event in events],
+                         [("job0", State.DONE), ("job1", State.DONE), ("job2", State.DONE)])
+
+    def test_latest_events_are_kept_for_the_most_recent_entities(self):
+        channel = EventChannel(history_size=1, max_entities=2)
+        for entity_id in ("job0", "job1", "job2", "job0"):
+            channel.publish(entity_id, State.STARTED)
+        self.assertEqual([event.entity_id for event in channel.events_since(0)],
+                         ["job2", "job0"])
+
+
+class EventHandlersTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.channel = EventChannel()
+        return Application([
+            (r"/events", EventLongPollHandler, dict(channel=self.channel)),
+            (r"/events/stream", EventStreamHandler, dict(channel=self.channel)),
+            (r"/events/ws", EventWebSocketHandler, dict(channel=self.channel)),
+        ])
+
+    def _publish_from_thread(self, *args):
+        threading.Timer(0.1, self.channel.publish, args).start()
+
+    @gen_test
+    def test_long_poll_returns_when_state_changes(self):
+        self._publish_from_thread("job1", State.DONE)
+        resp = yield self.http_client.fetch(self.get_url("/events?since=0&wait=10&entity=job1"))
+        body = json.loads(resp.body)
+        self.assertEqual(body["version"], 1)
+        self.assertEqual(body["events"][0]["state"], State.DONE)
+
+    @gen_test
+    def test_long_poll_gets_event_published_before_subscribing(self):
+        events_since = self.channel.events_since
+
+        def publish_before_subscribing(*args):
+            # Another thread publishes between the check for events and the subscription
+            events = events_since(*args)
+            self.channel.publish("job1", State.DONE)
+            return events
+
+        with mock.patch.object(self.channel, "events_since",
+                               side_effect=publish_before_subscribing):
+            resp = yield self.http_client.fetch(self.get_url("/events?since=0&wait=5"))
+        self.assertEqual(json.loads(resp.body)["version"], 1)
+
+    @gen_test
+    def test_long_poll_times_out_without_events(self):
+        resp = yield self.http_client.fetch(self.get_url("/events?wait=0.1"))
+        self.assertEqual(json.loads(resp.body), {"version": 0, "events": []})
+
+    @gen_test
+    def test_server_sent_events_are_streamed(self):
+        self.channel.publish("job1", State.STARTED)
+        chunks = []
+        self._publish_from_thread("job1", State.DONE)
+        # The stream doesn't end, so the request times out after receiving the events
+        request = HTTPRequest(self.get_url("/events/stream"), streaming_callback=chunks.append,
+                              headers={"Last-Event-ID": "0"}, request_timeout=0.5)
+        with self.assertRaises(HTTPError):
+            yield self.http_client.fetch(request)
+        body = b"".join(chunks).decode("utf-8")
+        self.assertIn("id: 1\nevent: started\n", body)
+        self.assertIn("id: 2\nevent: done\n", body)
+
+    @gen_test
+    def test_websocket_receives_job_events(self):
+        job_runner = JobRunner()
+        job_runner.add_listener(self.channel.job_listener)
+        connection = yield websocket_connect(self.get_url("/events/ws").replace("http", "ws"))
+        yield gen.sleep(0.05)
+        job = job_runner.submit(lambda: 42)
+        states = []
+        while State.DONE not in states:
+            message = json.loads((yield connection.read_message()))
+            self.assertEqual(message["entity_id"], job.id)
+            states.append(message["state"])
+        self.assertEqual(states, [State.PENDING, State.STARTED, State.DONE])
+        connection.close()
+        job_runner.shutdown()
+
+    @gen_test
+    def test_websocket_rejects_invalid_version(self):
+        with self.assertRaises(HTTPError) as context:
+            yield websocket_connect(self.get_url("/events/ws?since=abc").replace("http", "ws"))
+        self.assertEqual(context.exception.code, 400)
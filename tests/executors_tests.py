@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import threading
+
+import mock
+
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase, ExpectLog
+from tornado.web import Application
+
+import arteria
+from arteria.exceptions import ArteriaUsageException
+from arteria.executors import ExecutorService, PoolSaturatedError
+from arteria.web.handlers import BaseRestHandler
+
+from unittest import TestCase
+
+
+class ExecutorServiceTest(TestCase):
+
+    def setUp(self):
+        self.executors = ExecutorService({"small": {"type": "thread", "size": 1, "max_queue": 1}})
+
+    def tearDown(self):
+        self.executors.shutdown()
+
+    def test_default_pool_exists(self):
+        self.assertEqual(self.executors.submit("default", sum, [1, 2]).result(), 3)
+
+    def test_unknown_pool(self):
+        with self.assertRaises(ArteriaUsageException):
+            self.executors.submit("missing", sum, [1, 2])
+
+    def test_unknown_pool_type(self):
+        with self.assertRaises(ArteriaUsageException):
+            ExecutorService({"bad": {"type": "fiber"}})
+
+    def test_saturated_pool_rejects_tasks(self):
+        release = threading.Event()
+        running = self.executors.submit("small", release.wait)
+        queued = self.executors.submit("small", release.wait)
+        with self.assertRaises(PoolSaturatedError):
+            self.executors.submit("small", release.wait)
+        pool = self.executors.get("small")
+        self.assertEqual((pool.active, pool.queued, pool.rejected), (1, 1, 1))
+
+        release.set()
+        running.result()
+        queued.result()
+        self.assertEqual((pool.active, pool.queued), (0, 0))
+
+    def test_collect(self):
+        self.executors.submit("small", sum, [1]).result()
+        metrics = dict((name, samples) for name, _, _, samples in self.executors.collect())
+        self.assertIn(({"pool": "small"}, 1), metrics["arteria_executor_submitted_total"])
+
+
+class BlockingHandler(BaseRestHandler):
+
+    @arteria.offload("default")
+    def get(self, name):
+        return {"name": name, "thread": threading.current_thread().name}
+
+
+class ProcessPoolOffloadHandler(BaseRestHandler):
+
+    @arteria.offload("checksum")
+    def get(self, name):
+        return {"name": name}
+
+
+def _md5_in_process(data):
+    return {"md5": hashlib.md5(data).hexdigest(), "pid": os.getpid()}
+
+
+class ChecksumHandler(BaseRestHandler):
+
+    @gen.coroutine
+    def get(self, name):
+        result = yield self.run_in_pool("checksum", _md5_in_process, name.encode("utf-8"))
+        self.write_object(result)
+
+
+class OffloadDecoratorTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.executors = ExecutorService({"checksum": {"type": "process", "size": 1}})
+        return Application([(r"/blocking/(\w+)", BlockingHandler),
+                            (r"/offloaded_to_process/(\w+)", ProcessPoolOffloadHandler),
+                            (r"/checksum/(\w+)", ChecksumHandler)], executors=self.executors)
+
+    def tearDown(self):
+        self.executors.shutdown()
+        super(OffloadDecoratorTest, self).tearDown()
+
+    def test_runs_in_pool(self):
+        resp = self.fetch("/blocking/foo")
+        self.assertEqual(resp.code, 200)
+        body = json.loads(resp.body)
+        self.assertEqual(body["name"], "foo")
+        self.assertNotEqual(body["thread"], threading.current_thread().name)
+
+    def test_process_pool(self):
+        resp = self.fetch("/checksum/foo")
+        self.assertEqual(resp.code, 200)
+        body = json.loads(resp.body)
+        self.assertEqual(body["md5"], hashlib.md5(b"foo").hexdigest())
+        self.assertNotEqual(body["pid"], os.getpid())
+
+    def test_offload_to_process_pool_is_rejected(self):
+        # The handler would otherwise be pickled to be sent to the pool
+        with mock.patch.object(self.executors, "submit") as submit:
+            with ExpectLog("tornado.application", "Uncaught exception"):
+                resp = self.fetch("/offloaded_to_process/foo")
+        self.assertEqual(resp.code, 500)
+        submit.assert_not_called()
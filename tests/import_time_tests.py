@@ -0,0 +1,44 @@
+import sys
+import unittest
+
+from arteria.testhelpers import import_times
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "python -X importtime requires Python 3.7")
+class ImportTimeTest(unittest.TestCase):
+    """
+    Checks that importing the light parts of arteria, e.g. in CLI wrappers and health
+    checks, stays fast
+    """
+
+    # Budgets for the cumulative import time of the modules, as a multiple of the import time
+    # of a reference module measured on the same machine, so that they hold on slow and busy
+    # machines too. They leave room for noise, but catch a heavy dependency imported up front.
+    BUDGETS = {"arteria.web.state": ("json", 5),
+               "arteria.configuration": ("json", 30),
+               "arteria.web.app": ("tornado.web", 2)}
+
+    # Dependencies that are only imported on first use
+    LAZY = {"arteria.web.state": ["tornado", "yaml"],
+            "arteria.configuration": ["tornado", "yaml", "pickle", "tempfile"],
+            "arteria.testhelpers": ["requests", "tornado"],
+            "arteria.web.app": ["yaml", "argparse", "logging.config", "sqlite3", "cProfile",
+                                "orjson", "ujson"]}
+
+    def test_dependencies_are_imported_lazily(self):
+        # Modules the interpreter imports on startup, e.g. from sitecustomize, don't count
+        startup = import_times("sys", repeat=1)
+        for module, dependencies in self.LAZY.items():
+            imported = import_times(module, repeat=1)
+            for dependency in set(dependencies) - set(startup):
+                self.assertNotIn(dependency, imported,
+                                 "Importing {0} imports {1}".format(module, dependency))
+
+    def test_import_time_budget(self):
+        for module, (reference, factor) in self.BUDGETS.items():
+            milliseconds = import_times(module)[module] / 1000.0
+            reference_milliseconds = import_times(reference)[reference] / 1000.0
+            self.assertLessEqual(
+                milliseconds, factor * reference_milliseconds,
+                "Importing {0} took {1:.1f} ms, more than {2} times the {3:.1f} ms of {4}"
+                .format(module, milliseconds, factor, reference_milliseconds, reference))
@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+import unittest
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from arteria.exceptions import InvalidArteriaStateException
+from arteria.jobs import JobRunner, Job, JobQueueFullError, current_job
+from arteria.web.handlers import JobsHandler, JobHandler
+from arteria.web.state import State
+
+
+def wait_for_state(job, state, timeout=5):
+    deadline = time.time() + timeout
+    while job.state != state and time.time() < deadline:
+        time.sleep(0.01)
+    return job.state
+
+
+class JobRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.job_runner = JobRunner(max_workers=1, max_queue_size=1)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.job_runner.shutdown()
+
+    def _block(self):
+        self.release.wait(5)
+        return "released"
+
+    def test_job_goes_through_states(self):
+        states = []
+        self.job_runner.add_listener(lambda job, state: states.append(state))
+        job = self.job_runner.submit(self._block)
+        self.assertEqual(job.state, State.STARTED)
+        self.release.set()
+        self.assertEqual(wait_for_state(job, State.DONE), State.DONE)
+        self.assertEqual(job.result, "released")
+        self.assertEqual(states, [State.PENDING, State.STARTED, State.DONE])
+
+    def test_failing_job_ends_in_error(self):
+        job = self.job_runner.submit(lambda: 1 / 0)
+        self.assertEqual(wait_for_state(job, State.ERROR), State.ERROR)
+        self.assertIn("division", job.error)
+
+    def test_queue_is_bounded(self):
+        self.job_runner.submit(self._block)
+        pending = self.job_runner.submit(self._block)
+        self.assertEqual(pending.state, State.PENDING)
+        self.assertRaises(JobQueueFullError, self.job_runner.submit, self._block)
+
+    def test_can_cancel_pending_and_started_jobs(self):
+        def cancellable():
+            while not current_job().cancel_requested:
+                time.sleep(0.01)
+
+        started = self.job_runner.submit(cancellable)
+        pending = self.job_runner.submit(self._block)
+        self.job_runner.cancel(pending.id)
+        self.job_runner.cancel(started.id)
+        self.assertEqual(pending.state, State.CANCELLED)
+        self.assertEqual(started.state, State.CANCELLED)
+
+    def test_job_times_out(self):
+        job = self.job_runner.submit(self._block, timeout=0.05)
+        self.assertEqual(wait_for_state(job, State.ERROR), State.ERROR)
+        self.assertIn("Timed out", job.error)
+
+    def test_invalid_transition_is_rejected(self):
+        job = Job("id", None, (), {}, None)
+        self.assertRaises(InvalidArteriaStateException, job.transition, State.DONE)
+
+
+class JobHandlersTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.job_runner = JobRunner(max_workers=1)
+        return Application([
+            (r"/api/1.0/jobs", JobsHandler, dict(job_runner=self.job_runner,
+                                                  target=lambda body: body["value"] * 2)),
+            (r"/api/1.0/jobs/(\w+)", JobHandler, dict(job_runner=self.job_runner)),
+        ])
+
+    def tearDown(self):
+        self.job_runner.shutdown()
+        super(JobHandlersTest, self).tearDown()
+
+    def test_submit_and_poll_job(self):
+        resp = self.fetch("/api/1.0/jobs", method="POST", body=json.dumps({"value": 21}))
+        self.assertEqual(resp.code, 202)
+        job = json.loads(resp.body)
+        wait_for_state(self.job_runner.get(job["id"]), State.DONE)
+
+        resp = self.fetch("/api/1.0/jobs/{0}".format(job["id"]))
+        self.assertEqual(json.loads(resp.body)["result"], 42)
+        resp = self.fetch("/api/1.0/jobs?state=done")
+        self.assertEqual(len(json.loads(resp.body)["jobs"]), 1)
+
+    def test_unknown_job_is_not_found(self):
+        resp = self.fetch("/api/1.0/jobs/unknown", method="DELETE")
+        self.assertEqual(resp.code, 404)
@@ -0,0 +1,169 @@
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import time
+
+import mock
+
+from arteria.leases import LeaseLostError, LeaseManager
+from arteria.web.state import State
+
+from unittest import TestCase
+
+UNITS = ["runfolder_{0}".format(i) for i in range(30)]
+
+
+def _work(lease_dir, node_id, results):
+    # Claims units until there are none left, like a node running the same service
+    leases = LeaseManager(lease_dir, node_id=node_id, ttl=30)
+    claimed = []
+    while True:
+        lease = leases.claim_next(UNITS)
+        if lease is None:
+            break
+        leases.update(lease, State.STARTED)
+        time.sleep(0.001)
+        leases.release(lease, State.DONE)
+        claimed.append(lease.unit_id)
+    results.put((node_id, claimed))
+
+
+class LeaseManagerTest(TestCase):
+
+    def setUp(self):
+        self.lease_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.lease_dir)
+
+    def test_claim_update_release(self):
+        node_a = LeaseManager(self.lease_dir, node_id="a")
+        node_b = LeaseManager(self.lease_dir, node_id="b")
+        lease = node_a.claim("run1", data={"step": 1})
+        self.assertEqual((lease.state, lease.owner), (State.PENDING, "a"))
+        self.assertIsNone(node_b.claim("run1"))
+
+        node_a.update(lease, State.STARTED, {"step": 2})
+        self.assertEqual(node_b.get("run1")["state"], State.STARTED)
+        self.assertEqual(node_b.get("run1")["data"], {"step": 2})
+
+        # Released without a terminal state, the unit can be claimed again
+        node_a.release(lease)
+        self.assertEqual(node_b.claim("run1").owner, "b")
+
+    def test_done_units_are_not_claimed_again(self):
+        node_a = LeaseManager(self.lease_dir, node_id="a", ttl=0.01)
+        node_a.release(node_a.claim("run1"), State.DONE)
+        time.sleep(0.05)
+        self.assertIsNone(LeaseManager(self.lease_dir, node_id="b").claim("run1"))
+        self.assertEqual([lease["state"] for lease in node_a.list()], [State.DONE])
+
+    def test_expired_lease_is_taken_over(self):
+        node_a = LeaseManager(self.lease_dir, node_id="a", ttl=0.05)
+        lease_a = node_a.claim("run1")
+        node_a.update(lease_a, State.STARTED, {"step": 3})
+        time.sleep(0.1)
+
+        lease_b = LeaseManager(self.lease_dir, node_id="b").claim("run1")
+        self.assertEqual(lease_b.taken_over_from["owner"], "a")
+        self.assertEqual(lease_b.taken_over_from["data"], {"step": 3})
+        with self.assertRaises(LeaseLostError):
+            node_a.renew(lease_a)
+
+    def test_heartbeat_keeps_lease(self):
+        node_a = LeaseManager(self.lease_dir, node_id="a", ttl=0.2, heartbeat_interval=0.02)
+        lost = []
+        node_a.add_listener(lost.append)
+        node_a.start()
+        try:
+            lease = node_a.claim("run1")
+            time.sleep(0.4)
+            self.assertIsNone(LeaseManager(self.lease_dir, node_id="b").claim("run1"))
+            self.assertEqual(node_a.held(), [lease])
+        finally:
+            node_a.stop()
+        self.assertEqual(lost, [])
+
+    def test_renewal_racing_release_keeps_the_done_lease(self):
+        node_a = LeaseManager(self.lease_dir, node_id="a")
+        lease = node_a.claim("run1")
+        node_a.update(lease, State.STARTED)
+        lost = []
+        node_a.add_listener(lost.append)
+        checked, released = threading.Event(), threading.Event()
+        check_owner = node_a._check_owner
+
+        def check_owner_then_pause(checked_lease):
+            check_owner(checked_lease)
+            if threading.current_thread().name == "renewal":
+                # The release runs here, unless the renewal holds the lock of the lease
+                checked.set()
+                released.wait(1)
+
+        with mock.patch.object(node_a, "_check_owner", side_effect=check_owner_then_pause):
+            renewal = threading.Thread(target=node_a._renew_held, name="renewal")
+            renewal.start()
+            checked.wait(1)
+            release = threading.Thread(target=node_a.release, args=(lease, State.DONE))
+            release.start()
+            release.join(0.1)
+            released.set()
+            renewal.join()
+            release.join()
+            # A renewal after the release
+            node_a._renew_held()
+
+        record = node_a.get("run1")
+        self.assertEqual((record["state"], record["expires"]), (State.DONE, None))
+        self.assertEqual(lost, [])
+
+    def test_renewal_after_release_does_not_recreate_the_lease(self):
+        node_a = LeaseManager(self.lease_dir, node_id="a")
+        lease = node_a.claim("run1")
+        lost = []
+        node_a.add_listener(lost.append)
+        with mock.patch.object(node_a, "held", return_value=[lease]):
+            node_a.release(lease)
+            node_a._renew_held()
+        self.assertIsNone(node_a.get("run1"))
+        self.assertEqual(lost, [])
+
+    def test_expired_lease_is_lost_instead_of_renewed(self):
+        now = [0]
+        node_a = LeaseManager(self.lease_dir, node_id="a", ttl=10, clock=lambda: now[0])
+        lost = []
+        node_a.add_listener(lost.append)
+        lease = node_a.claim("run1")
+        # The heartbeat stalled past the ttl
+        now[0] = 11
+        node_a._renew_held()
+        self.assertEqual(lost, [lease])
+        self.assertTrue(lease.lost)
+        self.assertEqual(node_a.get("run1")["expires"], 10)
+        with self.assertRaises(LeaseLostError):
+            node_a.update(lease, State.STARTED)
+
+    def test_claiming_held_and_done_units_writes_nothing(self):
+        node_a = LeaseManager(self.lease_dir, node_id="a")
+        node_b = LeaseManager(self.lease_dir, node_id="b")
+        node_a.claim("run1")
+        node_a.release(node_a.claim("run2"), State.DONE)
+        with mock.patch.object(node_b, "_write_temporary") as write_temporary:
+            self.assertIsNone(node_b.claim_next(["run1", "run2"]))
+        write_temporary.assert_not_called()
+
+    def test_nodes_in_processes_claim_each_unit_once(self):
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_work,
+                                             args=(self.lease_dir, "node_{0}".format(i), results))
+                     for i in range(4)]
+        for process in processes:
+            process.start()
+        claimed = dict(results.get(timeout=30) for _ in processes)
+        for process in processes:
+            process.join()
+        all_claimed = [unit for units in claimed.values() for unit in units]
+        self.assertEqual(sorted(all_claimed), sorted(UNITS))
+        self.assertTrue(all(lease["state"] == State.DONE
+                            for lease in LeaseManager(self.lease_dir).list()))
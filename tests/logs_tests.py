@@ -0,0 +1,87 @@
+import logging
+import threading
+import unittest
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from arteria.exceptions import ArteriaUsageException
+from arteria.web import logs
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.threads = set()
+
+    def emit(self, record):
+        self.records.append(record.getMessage())
+        self.threads.add(threading.current_thread().name)
+
+
+class LogLevelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.handler.set_name("recording_handler")
+        self.logger = logging.getLogger("arteria.tests.levels")
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(logging.NOTSET)
+
+    def test_can_set_level_of_named_handler(self):
+        logs.set_level("ERROR", handler="recording_handler")
+        self.assertEqual(logs.get_level(handler="recording_handler"), "ERROR")
+        self.logger.warning("dropped")
+        self.logger.error("kept")
+        self.assertEqual(self.handler.records, ["kept"])
+
+    def test_can_set_level_of_named_logger(self):
+        logs.set_level("DEBUG", logger="arteria.tests.levels")
+        self.assertEqual(logs.get_level(logger="arteria.tests.levels"), "DEBUG")
+
+    def test_unknown_level_and_handler_are_rejected(self):
+        self.assertRaises(ArteriaUsageException, logs.set_level, "LOUD",
+                          handler="recording_handler")
+        self.assertRaises(ArteriaUsageException, logs.set_level, "DEBUG", handler="unknown")
+
+
+class AsyncLoggingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = logging.getLogger()
+        self.original_handlers = list(self.root.handlers)
+        self.handler = RecordingHandler()
+        self.handler.set_name("recording_handler")
+        for handler in self.original_handlers:
+            self.root.removeHandler(handler)
+        self.root.addHandler(self.handler)
+
+    def tearDown(self):
+        self.root.removeHandler(self.handler)
+        for handler in self.original_handlers:
+            self.root.addHandler(handler)
+
+    def test_records_are_handled_on_background_thread(self):
+        async_logging = logs.AsyncLogging()
+        async_logging.install()
+        # The handler can still be found by name when moved to the background thread
+        logs.set_level("ERROR", handler="recording_handler")
+        logging.getLogger("arteria.tests.async").error("async")
+        logging.getLogger("arteria.tests.async").warning("dropped by level")
+        async_logging.uninstall()
+
+        self.assertEqual(self.handler.records, ["async"])
+        self.assertNotIn(threading.current_thread().name, self.handler.threads)
+
+    def test_full_queue_drops_records(self):
+        handler = logs.BoundedQueueHandler(queue.Queue(1), overflow="drop_oldest")
+        for message in ("first", "second", "third"):
+            handler.handle(logging.makeLogRecord({"msg": message}))
+        self.assertEqual(handler.dropped, 2)
+        self.assertEqual(handler.queue.get_nowait().getMessage(), "third")
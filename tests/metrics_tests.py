@@ -0,0 +1,66 @@
+import unittest
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from arteria.web.handlers import BaseRestHandler, MetricsHandler
+from arteria.web.metrics import MetricsRegistry, process_metrics
+
+
+class HelloHandler(BaseRestHandler):
+    def get(self, name=None):
+        self.write_object({"hello": "world"})
+
+
+class MetricsHandlerTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.metrics = MetricsRegistry()
+        self.metrics.add_collector(process_metrics)
+        routes = [
+            (r"/api/1.0/hello", HelloHandler),
+            (r"/api/1.0/hello/([^/]+)", HelloHandler),
+            (r"/api/1.0/admin/metrics", MetricsHandler, dict(metrics=self.metrics)),
+        ]
+        self.metrics.register_routes(routes)
+        return Application(routes, metrics=self.metrics)
+
+    def test_requests_are_recorded_per_route(self):
+        for _ in range(3):
+            self.fetch("/api/1.0/hello")
+        self.fetch("/api/1.0/hello", method="POST", body="")
+
+        body = self.fetch("/api/1.0/admin/metrics").body.decode("utf-8")
+        lines = body.splitlines()
+        self.assertIn('arteria_http_requests_total{route="/api/1.0/hello",status="200"} 3', lines)
+        self.assertIn('arteria_http_requests_total{route="/api/1.0/hello",status="405"} 1', lines)
+        self.assertIn('arteria_http_request_duration_seconds_count{route="/api/1.0/hello"} 4',
+                      lines)
+        self.assertIn('arteria_http_request_duration_seconds_bucket'
+                      '{le="+Inf",route="/api/1.0/hello"} 4', lines)
+        # The metrics request itself is still in flight while rendering
+        self.assertIn('arteria_http_requests_in_flight{route="/api/1.0/admin/metrics"} 1', lines)
+        self.assertTrue(any(line.startswith("process_resident_memory_bytes ") for line in lines))
+
+    def test_routes_of_a_handler_class_are_recorded_separately(self):
+        self.fetch("/api/1.0/hello")
+        for _ in range(2):
+            self.fetch("/api/1.0/hello/world")
+
+        lines = self.fetch("/api/1.0/admin/metrics").body.decode("utf-8").splitlines()
+        self.assertIn('arteria_http_request_duration_seconds_count{route="/api/1.0/hello"} 1',
+                      lines)
+        self.assertIn('arteria_http_request_duration_seconds_count'
+                      '{route="/api/1.0/hello/([^/]+)"} 2', lines)
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def test_latency_is_recorded_in_buckets(self):
+        metrics = MetricsRegistry(buckets=(0.1, 1.0))
+        for latency in (0.05, 0.5, 5.0):
+            route_metrics = metrics.start_request(HelloHandler)
+            metrics.finish_request(route_metrics, 200, latency)
+        self.assertEqual(route_metrics.buckets, [1, 1, 1])
+        self.assertEqual(route_metrics.in_flight, 0)
+        self.assertEqual(route_metrics.route, "HelloHandler")
@@ -0,0 +1,145 @@
+import json
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from arteria.web.handlers import BaseRestHandler
+from arteria.web.pagination import InvalidCursorError, decode_cursor, encode_cursor, \
+    paginate, project
+
+from unittest import TestCase
+
+
+class PaginateTest(TestCase):
+
+    def _all_pages(self, source_factory, limit, **kwargs):
+        pages = []
+        cursor = None
+        while True:
+            page = paginate(source_factory(), limit, cursor, **kwargs)
+            pages.append(page.items)
+            cursor = page.next_cursor
+            if cursor is None:
+                return pages
+
+    def test_cursor_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor({"after": "run_1"})), {"after": "run_1"})
+        for cursor in ["not base64!", encode_cursor([1, 2])]:
+            with self.assertRaises(InvalidCursorError):
+                decode_cursor(cursor)
+
+    def test_offset_pages_from_generator(self):
+        consumed = []
+
+        def numbers():
+            for i in range(7):
+                consumed.append(i)
+                yield i
+
+        page = paginate(numbers(), 3)
+        self.assertEqual(page.items, [0, 1, 2])
+        # Only the page and the item telling that there is a next page are read
+        self.assertEqual(consumed, [0, 1, 2, 3])
+        self.assertEqual(self._all_pages(lambda: iter(range(7)), 3), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(self._all_pages(lambda: list(range(6)), 3), [[0, 1, 2], [3, 4, 5]])
+
+    def test_sort_key_pages(self):
+        names = ["run_{0}".format(i) for i in range(5)]
+        self.assertEqual(self._all_pages(lambda: iter(names), 2, sort_key=lambda name: name),
+                         [names[0:2], names[2:4], names[4:]])
+        self.assertEqual(self._all_pages(lambda: reversed(names), 3, sort_key=lambda name: name,
+                                         reverse=True),
+                         [names[:1:-1], names[1::-1]])
+
+        # A page added before the cursor doesn't shift the next page
+        page = paginate(names, 2, sort_key=lambda name: name)
+        self.assertEqual(paginate(["run_00"] + names, 2, page.next_cursor,
+                                  sort_key=lambda name: name).items, ["run_2", "run_3"])
+
+    def test_items_with_the_same_key(self):
+        keys = [1, 1, 1, 1, 1, 2]
+        self.assertEqual(self._all_pages(lambda: iter(keys), 2, sort_key=lambda key: key),
+                         [[1, 1], [1, 1], [1, 2]])
+        self.assertEqual(self._all_pages(lambda: iter(keys[::-1]), 2, sort_key=lambda key: key,
+                                         reverse=True),
+                         [[2, 1], [1, 1], [1, 1]])
+        items = [{"key": key, "id": i} for i, key in enumerate(keys)]
+        pages = self._all_pages(lambda: iter(items), 4, sort_key=lambda item: item["key"])
+        self.assertEqual([[item["id"] for item in page] for page in pages],
+                         [[0, 1, 2, 3], [4, 5]])
+
+    def test_tuple_sort_keys(self):
+        runs = [("run_1", 1), ("run_1", 2), ("run_2", 1), ("run_2", 1), ("run_3", 1)]
+        self.assertEqual(self._all_pages(lambda: iter(runs), 2, sort_key=lambda run: run),
+                         [runs[0:2], runs[2:4], runs[4:]])
+
+    def test_invalid_sort_cursors(self):
+        for position in [{"key": 1}, {"key": 1, "skip": -1}, {"key": {"a": 1}, "skip": 0},
+                         {"offset": 2}]:
+            with self.assertRaises(InvalidCursorError):
+                paginate([1, 2, 3], 1, encode_cursor(position), sort_key=lambda i: i)
+        with self.assertRaises(InvalidCursorError):
+            paginate([1, 2, 3], 1, encode_cursor({"key": "a", "skip": 0}), sort_key=lambda i: i)
+
+    def test_errors_of_the_sort_key_are_not_hidden(self):
+        def sort_key(item):
+            raise TypeError("Not sortable")
+
+        page = paginate([1, 2, 3], 1, sort_key=lambda i: i)
+        with self.assertRaises(TypeError):
+            paginate([1, 2, 3], 1, page.next_cursor, sort_key=sort_key)
+
+    def test_indexed_source(self):
+        calls = []
+
+        def from_index(after):
+            calls.append(after)
+            return (i for i in range(10) if after is None or i >= after)
+
+        page = paginate(from_index, 4, sort_key=lambda i: i)
+        page = paginate(from_index, 4, page.next_cursor, sort_key=lambda i: i)
+        self.assertEqual(page.items, [4, 5, 6, 7])
+        self.assertEqual(calls, [None, 3])
+
+    def test_project(self):
+        item = {"name": "run_1", "state": "done", "path": "/data/run_1"}
+        self.assertEqual(project(item, ["name", "state", "missing"]),
+                         {"name": "run_1", "state": "done"})
+        self.assertIs(project(item, None), item)
+
+
+class RunfoldersHandler(BaseRestHandler):
+
+    def get(self):
+        runfolders = ({"name": "run_{0:02d}".format(i), "state": "done", "lane_count": 8}
+                      for i in range(25))
+        self.write_page(runfolders, key="runfolders", default_limit=10, max_limit=20,
+                        sort_key=lambda runfolder: runfolder["name"])
+
+
+class WritePageTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return Application([(r"/runfolders", RunfoldersHandler)])
+
+    def test_pages_with_link_header(self):
+        resp = self.fetch("/runfolders?fields=name&limit=20")
+        body = json.loads(resp.body)
+        self.assertEqual(body["runfolders"][0], {"name": "run_00"})
+        self.assertEqual(len(body["runfolders"]), 20)
+
+        link = resp.headers["Link"]
+        self.assertTrue(link.endswith('>; rel="next"'))
+        self.assertIn("fields=name", link)
+        next_url = link[1:link.index(">")]
+        body = json.loads(self.fetch(next_url[next_url.index("/runfolders"):]).body)
+        self.assertEqual([runfolder["name"] for runfolder in body["runfolders"]],
+                         ["run_{0}".format(i) for i in range(20, 25)])
+        self.assertIsNone(body["next_cursor"])
+
+    def test_invalid_arguments(self):
+        self.assertEqual(self.fetch("/runfolders?limit=21").code, 400)
+        self.assertEqual(self.fetch("/runfolders?limit=x").code, 400)
+        self.assertEqual(self.fetch("/runfolders?cursor=invalid").code, 400)
+        self.assertEqual(self.fetch("/runfolders?cursor=" + encode_cursor({"after": 1})).code,
+                         400)
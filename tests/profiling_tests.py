@@ -0,0 +1,56 @@
+import json
+import marshal
+import time
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from arteria.web.handlers import ProfilingHandler
+from arteria.web.profiling import ProfilingService
+
+
+class ProfilingHandlerTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.profiling_svc = ProfilingService()
+        return Application([
+            (r"/api/1.0/admin/profiling", ProfilingHandler,
+             dict(profiling_svc=self.profiling_svc)),
+        ])
+
+    def _start(self, **body):
+        return self.fetch("/api/1.0/admin/profiling", method="PUT", body=json.dumps(body))
+
+    def test_cprofile_session_can_be_downloaded_as_pstats(self):
+        resp = self._start(mode="cprofile", duration=60)
+        self.assertTrue(json.loads(resp.body)["running"])
+        self.fetch("/api/1.0/admin/profiling")
+        self.fetch("/api/1.0/admin/profiling", method="DELETE")
+
+        resp = self.fetch("/api/1.0/admin/profiling?format=pstats")
+        self.assertEqual(resp.code, 200)
+        self.assertIsInstance(marshal.loads(resp.body), dict)
+
+    def test_sampling_session_stops_after_duration(self):
+        self._start(mode="sampling", duration=0.2, interval=0.01)
+        deadline = time.time() + 5
+        while self.profiling_svc.is_running() and time.time() < deadline:
+            time.sleep(0.05)
+
+        resp = self.fetch("/api/1.0/admin/profiling?format=collapsed")
+        self.assertEqual(resp.code, 200)
+        self.assertIn(b"MainThread;", resp.body)
+
+    def test_sampling_session_with_long_interval_stops_at_duration(self):
+        self.profiling_svc.start("sampling", 0.1, interval=30)
+        deadline = time.time() + 5
+        while self.profiling_svc.is_running() and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertLess(time.time() - self.profiling_svc.status()["started"], 1)
+
+    def test_invalid_mode_and_format_are_rejected(self):
+        self.assertEqual(self._start(mode="magic", duration=1).code, 400)
+        self.assertEqual(self._start(mode="sampling", duration=1, interval=0).code, 400)
+        self.assertEqual(self._start(mode="sampling", duration=1, interval=-1).code, 400)
+        self.assertFalse(self.profiling_svc.is_running())
+        self.assertEqual(self.fetch("/api/1.0/admin/profiling?format=pstats").code, 400)
@@ -1,5 +1,9 @@
+import json
 from unittest import TestCase
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
 import arteria
+from arteria.web.handlers import ApiHelpHandler
 from arteria.web.routes import RouteService
 import mock
 
@@ -43,3 +47,41 @@ class TestHandler:
     def delete(self):
         """True: Documentation should show up"""
         pass
+
+
+class RoutesServiceHelpCacheTest(TestCase):
+    def setUp(self):
+        self.route_svc = RouteService(mock.MagicMock(), debug=False)
+        self.route_svc.set_routes([("/route0", TestHandler)])
+
+    def test_help_is_correct_per_base_url(self):
+        for base_url in ("http://host1", "http://host2", "http://host1"):
+            help = self.route_svc.get_help(base_url).get("doc")
+            self.assertEqual(help[0]["route"], "{0}/route0".format(base_url))
+            etag, body = self.route_svc.get_help_response(base_url)
+            self.assertEqual(json.loads(body.decode("utf-8"))["doc"][0]["route"],
+                             "{0}/route0".format(base_url))
+
+    def test_help_is_regenerated_when_routes_are_set(self):
+        etag, _ = self.route_svc.get_help_response("http://self")
+        self.route_svc.set_routes([("/route0", TestHandler), ("/route1", TestHandler)])
+        new_etag, body = self.route_svc.get_help_response("http://self")
+        self.assertNotEqual(etag, new_etag)
+        self.assertEqual(len(json.loads(body.decode("utf-8"))["doc"]), 2)
+
+
+class ApiHelpHandlerTest(AsyncHTTPTestCase):
+    def get_app(self):
+        route_svc = RouteService(mock.MagicMock(), debug=False)
+        routes = [("/api", ApiHelpHandler, dict(route_svc=route_svc))]
+        route_svc.set_routes(routes)
+        return Application(routes)
+
+    def test_unchanged_help_is_not_modified(self):
+        resp = self.fetch("/api")
+        self.assertEqual(resp.code, 200)
+        etag = resp.headers["Etag"]
+
+        resp = self.fetch("/api", headers={"If-None-Match": etag})
+        self.assertEqual(resp.code, 304)
+        self.assertEqual(resp.body, b"")
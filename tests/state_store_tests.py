@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from arteria.jobs import JobRunner
+from arteria.state_store import MemoryStateStore, SqliteStateStore, StateRecord
+from arteria.web.state import State
+
+
+class StateStoreTestMixin(object):
+
+    def test_counts_and_lists_by_state(self):
+        store = self.create_store()
+        for i in range(5):
+            store.put(StateRecord(str(i), State.STARTED, i))
+        store.put(StateRecord("1", State.DONE, 10, {"result": 42}))
+        store.put(StateRecord("3", State.DONE, 11))
+
+        self.assertEqual(store.count(), 5)
+        self.assertEqual(store.count(State.STARTED), 3)
+        self.assertEqual(store.count(State.DONE), 2)
+        self.assertEqual([record.id for record in store.list(State.DONE)], ["3", "1"])
+        self.assertEqual([record.id for record in store.list(State.STARTED, limit=2)],
+                         ["4", "2"])
+        self.assertEqual(store.get("1").to_dict(), {"id": "1", "state": State.DONE, "result": 42})
+        self.assertIsNone(store.get("unknown"))
+
+
+class MemoryStateStoreTest(StateStoreTestMixin, unittest.TestCase):
+
+    def create_store(self):
+        return MemoryStateStore()
+
+
+class SqliteStateStoreTest(StateStoreTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.db_dir, "jobs.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.db_dir)
+
+    def create_store(self):
+        return SqliteStateStore(self.db_path)
+
+    def test_state_survives_restart(self):
+        store = self.create_store()
+        store.put(StateRecord("1", State.DONE, 1))
+        store.put(StateRecord("2", State.STARTED, 2))
+        store.close()
+
+        store = self.create_store()
+        self.assertEqual(store.count(State.DONE), 1)
+        self.assertEqual(store.get("2").state, State.STARTED)
+
+    def test_job_runner_recovers_interrupted_jobs(self):
+        store = self.create_store()
+        store.put(StateRecord("1", State.STARTED, 1))
+        job_runner = JobRunner(store=store)
+        self.assertEqual(job_runner.get("1").state, State.ERROR)
+        self.assertEqual(job_runner.counts()[State.ERROR], 1)
+
+    def test_put_does_not_wait_for_the_database(self):
+        store = self.create_store()
+        with store._db_lock:
+            # The database is busy, e.g. with a write to a slow disk
+            store.put(StateRecord("1", State.PENDING, 1))
+            store.put(StateRecord("2", State.DONE, 2, {"result": 42}))
+            self.assertEqual(store.get("2").data, {"result": 42})
+            self.assertEqual(store.count(), 2)
+        store.flush()
+        store.close()
+        store = self.create_store()
+        self.assertEqual(store.counts()[State.DONE], 1)
+        self.assertEqual(store.get("1").state, State.PENDING)
+
+    def test_list_does_not_wait_for_the_writer(self):
+        store = self.create_store()
+        store.put(StateRecord("1", State.DONE, 1))
+        store.put(StateRecord("2", State.ERROR, 2))
+        store.flush()
+        listed = []
+        with store._db_lock:
+            # The writer is busy, and these are only in memory
+            store.put(StateRecord("2", State.DONE, 3))
+            store.put(StateRecord("3", State.DONE, 4))
+            lister = threading.Thread(target=lambda: listed.append(store.list(State.DONE)))
+            lister.start()
+            lister.join(5)
+            self.assertFalse(lister.is_alive())
+        self.assertEqual([record.id for record in listed[0]], ["3", "2", "1"])
+        self.assertEqual([record.id for record in store.list(limit=2)], ["3", "2"])
+        self.assertEqual(store.list(State.ERROR), [])
+        store.close()
+
+    def test_updates_of_stored_records_are_counted_once(self):
+        store = self.create_store()
+        store.put(StateRecord("1", State.DONE, 1))
+        store.flush()
+        store.put(StateRecord("1", State.ERROR, 2))
+        store.flush()
+        self.assertEqual((store.count(), store.count(State.DONE), store.count(State.ERROR)),
+                         (1, 0, 1))
+
+    def test_job_with_unstorable_result_ends_in_error(self):
+        job_runner = JobRunner(max_workers=1, store=self.create_store())
+        release = threading.Event()
+        unstorable = job_runner.submit(lambda: release.wait(5) and object())
+        queued = job_runner.submit(lambda: "stored")
+        release.set()
+        deadline = time.time() + 5
+        while queued.state != State.DONE and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(unstorable.state, State.ERROR)
+        self.assertIn("can't be stored", unstorable.error)
+        self.assertEqual(job_runner.get(unstorable.id).state, State.ERROR)
+        # The queued job is still started
+        self.assertEqual(queued.state, State.DONE)
+        job_runner.shutdown()
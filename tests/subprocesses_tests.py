@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+import threading
+
+import mock
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from arteria.subprocesses import RotatingOutput, SubprocessRunner, state_for_exit_status
+from arteria.web.state import State
+
+from unittest import TestCase
+
+
+class RotatingOutputTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_rotates_at_max_bytes(self):
+        path = os.path.join(self.tmp_dir, "out")
+        output = RotatingOutput(path, max_bytes=10, backup_count=2)
+        for chunk in [b"a" * 6, b"b" * 6, b"c" * 6, b"d" * 6]:
+            output.write(chunk)
+        output.close()
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"d" * 6)
+        with open(path + ".1", "rb") as f:
+            self.assertEqual(f.read(), b"c" * 6)
+        with open(path + ".2", "rb") as f:
+            self.assertEqual(f.read(), b"b" * 6)
+        self.assertFalse(os.path.exists(path + ".3"))
+
+
+class StateForExitStatusTest(TestCase):
+
+    def test_exit_status(self):
+        self.assertEqual(state_for_exit_status(0), State.DONE)
+        self.assertEqual(state_for_exit_status(1), State.ERROR)
+        self.assertEqual(state_for_exit_status(-15), State.ERROR)
+        self.assertEqual(state_for_exit_status(-15, cancelled=True), State.CANCELLED)
+
+
+class SubprocessRunnerTest(AsyncTestCase):
+
+    def setUp(self):
+        super(SubprocessRunnerTest, self).setUp()
+        self.log_dir = tempfile.mkdtemp()
+        self.runner = SubprocessRunner(self.log_dir, max_processes=4,
+                                       tool_limits={"sleep": 1}, kill_timeout=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+        super(SubprocessRunnerTest, self).tearDown()
+
+    @gen_test
+    def test_output_is_written_to_files(self):
+        handle = yield self.runner.run(["sh", "-c", "echo out; echo err >&2"])
+        self.assertEqual(handle.state, State.DONE)
+        self.assertEqual(handle.returncode, 0)
+        with open(handle.stdout_path) as f:
+            self.assertEqual(f.read(), "out\n")
+        with open(handle.stderr_path) as f:
+            self.assertEqual(f.read(), "err\n")
+
+    @gen_test
+    def test_output_is_written_off_the_ioloop_thread(self):
+        threads = []
+        write = RotatingOutput.write
+
+        def record_thread(output, data):
+            threads.append(threading.current_thread().name)
+            write(output, data)
+
+        with mock.patch.object(RotatingOutput, "write", autospec=True,
+                               side_effect=record_thread):
+            handle = yield self.runner.run(["sh", "-c", "seq 10000"])
+        with open(handle.stdout_path) as f:
+            self.assertEqual(f.read().split(), [str(i) for i in range(1, 10001)])
+        self.assertTrue(threads)
+        self.assertNotIn(threading.current_thread().name, threads)
+
+    @gen_test
+    def test_failure_is_error(self):
+        handle = yield self.runner.run(["sh", "-c", "exit 3"])
+        self.assertEqual(handle.state, State.ERROR)
+        self.assertEqual(handle.returncode, 3)
+
+    @gen_test
+    def test_tool_limit(self):
+        running = []
+        max_running = []
+
+        def listener(handle, state):
+            if state == State.STARTED:
+                running.append(handle.id)
+            elif handle.id in running:
+                running.remove(handle.id)
+            max_running.append(len(running))
+
+        self.runner.add_listener(listener)
+        yield [self.runner.run(["sleep", "0.1"]) for _ in range(3)]
+        self.assertEqual(max(max_running), 1)
+
+    @gen_test(timeout=10)
+    def test_cancel_kills_process_group(self):
+        handle = self.runner.start(["sh", "-c", "sleep 30; echo not killed"], tool="sh")
+        while handle.state != State.STARTED:
+            yield gen.sleep(0.01)
+        self.assertTrue(self.runner.cancel(handle.id))
+        yield handle.done
+        self.assertEqual(handle.state, State.CANCELLED)
+        self.assertFalse(self.runner.cancel(handle.id))
+
+    @gen_test
+    def test_cancel_queued_process(self):
+        first = self.runner.start(["sleep", "0.2"])
+        queued = self.runner.start(["sleep", "0.2"])
+        self.runner.cancel(queued.id)
+        self.assertEqual(queued.state, State.CANCELLED)
+        yield first.done
+        yield gen.sleep(0.05)
+        self.assertIsNone(queued.pid)
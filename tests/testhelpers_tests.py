@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+
+import yaml
+
+from arteria.testhelpers import AppServiceRunner, BaseRestTest, LoadTestResult, unused_port
+from arteria.web.app import AppService
+from arteria.web.handlers import BaseRestHandler
+
+from unittest import TestCase
+
+
+def _config_root(tmp_dir):
+    """Copies the template configs to tmp_dir, with the log file in it rather than in the cwd"""
+    templates = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "templates")
+    shutil.copy(os.path.join(templates, "app.config"), tmp_dir)
+    with open(os.path.join(templates, "logger.config")) as f:
+        logger_config = yaml.safe_load(f)
+    logger_config["handlers"]["file_handler"]["filename"] = os.path.join(tmp_dir, "messages.log")
+    with open(os.path.join(tmp_dir, "logger.config"), "w") as f:
+        yaml.safe_dump(logger_config, f)
+    return tmp_dir
+
+
+class LoadTestResultTest(TestCase):
+
+    def test_percentiles(self):
+        result = LoadTestResult(list(range(100, 0, -1)), errors=1, duration=2.0)
+        self.assertEqual(result.requests, 100)
+        self.assertEqual(result.throughput, 50.0)
+        self.assertEqual((result.p50, result.p95, result.p99), (50, 95, 99))
+
+    def test_empty(self):
+        result = LoadTestResult([], errors=0, duration=0)
+        self.assertEqual((result.p99, result.throughput), (0.0, 0.0))
+
+
+class PingHandler(BaseRestHandler):
+
+    def get(self):
+        self.write_object({"ping": "pong"})
+
+
+class AppServiceRunnerTest(BaseRestTest):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.config_root = _config_root(tempfile.mkdtemp())
+        app_svc = AppService.create(product_name="arteria-test",
+                                    config_root=cls.config_root,
+                                    args=["--port", str(unused_port())])
+        cls.runner = AppServiceRunner(app_svc, [(r"/api/1.0/ping", PingHandler)]).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.runner.stop()
+        shutil.rmtree(cls.config_root)
+        super(AppServiceRunnerTest, cls).tearDownClass()
+
+    def _base_url(self):
+        return self.runner.base_url + "/api/1.0"
+
+    def test_get(self):
+        resp = self.get("./ping")
+        self.assertEqual(resp.body_obj, {"ping": "pong"})
+
+    def test_load(self):
+        result = self.load("./ping", count=50, concurrency=5)
+        self.assertEqual(result.requests, 50)
+        self.assert_load(result, p99=5000, min_throughput=1)
+
+    def test_load_counts_errors(self):
+        result = self.load("./missing", count=5, concurrency=5)
+        self.assertEqual(result.errors, 5)
+        with self.assertRaises(AssertionError):
+            self.assert_load(result)
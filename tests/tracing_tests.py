@@ -0,0 +1,97 @@
+import json
+
+import mock
+from tornado.httputil import HTTPHeaders, HTTPServerRequest
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application, HTTPError
+
+from arteria.web.handlers import BaseRestHandler
+from arteria.web.tracing import NULL_SPAN, RequestTrace, Tracer
+
+from unittest import TestCase
+
+
+class TracerTest(TestCase):
+
+    def _request(self, **headers):
+        return HTTPServerRequest(method="GET", uri="/", headers=HTTPHeaders(headers))
+
+    def test_request_id(self):
+        tracer = Tracer()
+        self.assertEqual(tracer.start(self._request(**{"X-Request-ID": "abc-123"})).request_id,
+                         "abc-123")
+        # Invalid IDs from clients are replaced
+        self.assertEqual(len(tracer.start(self._request(**{"X-Request-ID": "a b\n"})).request_id),
+                         32)
+        self.assertEqual(len(tracer.start(self._request()).request_id), 32)
+
+    def test_server_timing(self):
+        trace = RequestTrace("abc")
+        trace.add("lookup", 0.002)
+        trace.add("lookup", 0.001)
+        trace.add("serialize", 0.0005)
+        self.assertRegex(trace.server_timing(),
+                                 r"^lookup;dur=3\.000, serialize;dur=0\.500, total;dur=[\d.]+$")
+
+    def test_logs_sampled_and_slow_requests(self):
+        logger = mock.MagicMock()
+        request = self._request()
+        Tracer(sample_rate=0, logger=logger).finish(RequestTrace("a"), request, 200)
+        self.assertFalse(logger.log.called)
+
+        Tracer(sample_rate=0, slow_threshold=0, logger=logger).finish(RequestTrace("b"),
+                                                                      request, 200)
+        entry = json.loads(logger.log.call_args[0][1])
+        self.assertEqual((entry["request_id"], entry["status"]), ("b", 200))
+
+
+class TracedHandler(BaseRestHandler):
+
+    def get(self):
+        with self.span("lookup"):
+            result = {"request_id": self.request_id}
+        if self.get_argument("fail", None):
+            raise HTTPError(500)
+        self.write_object(result)
+
+
+class TracingTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.logger = mock.MagicMock()
+        return Application([(r"/traced", TracedHandler)],
+                           tracing=Tracer(sample_rate=1.0, logger=self.logger))
+
+    def test_spans_and_request_id(self):
+        resp = self.fetch("/traced", headers={"X-Request-ID": "from-client"})
+        self.assertEqual(resp.headers["X-Request-ID"], "from-client")
+        self.assertEqual(json.loads(resp.body), {"request_id": "from-client"})
+        names = [entry.split(";")[0] for entry in resp.headers["Server-Timing"].split(", ")]
+        self.assertEqual(names, ["prepare", "lookup", "serialize", "handler", "total"])
+
+        entry = json.loads(self.logger.log.call_args[0][1])
+        self.assertEqual(entry["request_id"], "from-client")
+        self.assertEqual(list(entry["spans"]),
+                         ["prepare", "lookup", "serialize", "handler", "flush"])
+
+    def test_error_responses_are_traced(self):
+        resp = self.fetch("/traced?fail=1")
+        self.assertEqual(resp.code, 500)
+        self.assertIn("X-Request-ID", resp.headers)
+        self.assertIn("Server-Timing", resp.headers)
+
+
+class UntracedTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return Application([(r"/traced", TracedHandler)])
+
+    def test_no_tracing_headers(self):
+        resp = self.fetch("/traced")
+        self.assertEqual(json.loads(resp.body), {"request_id": None})
+        self.assertNotIn("X-Request-ID", resp.headers)
+        self.assertNotIn("Server-Timing", resp.headers)
+
+    def test_null_span(self):
+        with NULL_SPAN:
+            pass
@@ -0,0 +1,63 @@
+import json
+import time
+
+import mock
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+from tornado.web import Application
+
+from arteria.web.handlers import HealthHandler
+from arteria.web.watchdog import IOLoopWatchdog
+
+
+def block_the_ioloop(seconds):
+    time.sleep(seconds)
+
+
+class IOLoopWatchdogTest(AsyncTestCase):
+
+    def setUp(self):
+        super(IOLoopWatchdogTest, self).setUp()
+        self.logger = mock.MagicMock()
+        self.watchdog = IOLoopWatchdog(interval=0.02, threshold=0.1, logger=self.logger)
+        self.watchdog.start()
+
+    def tearDown(self):
+        self.watchdog.stop()
+        super(IOLoopWatchdogTest, self).tearDown()
+
+    @gen_test
+    def test_records_lag(self):
+        yield gen.sleep(0.1)
+        health = self.watchdog.health()
+        self.assertEqual(health["status"], "ok")
+        self.assertGreater(health["lag_histogram"]["+Inf"], 0)
+        self.assertEqual(health["stalls"], 0)
+
+    @gen_test
+    def test_logs_stack_of_blocking_call(self):
+        yield gen.sleep(0.03)
+        block_the_ioloop(0.4)
+        yield gen.sleep(0.05)
+        self.assertEqual(self.watchdog.stalls, 1)
+        messages = [call[0][0] for call in self.logger.warning.call_args_list]
+        self.assertIn("block_the_ioloop", messages[0])
+        self.assertIn("was blocked for", messages[1])
+        self.assertGreater(self.watchdog.max_lag, 0.2)
+
+
+class HealthHandlerTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.watchdog = IOLoopWatchdog(threshold=1.0)
+        return Application([(r"/health", HealthHandler, dict(watchdog=self.watchdog))])
+
+    def test_health(self):
+        resp = self.fetch("/health")
+        self.assertEqual(resp.code, 200)
+        self.assertEqual(json.loads(resp.body)["status"], "ok")
+
+        self.watchdog.last_lag = 2.0
+        resp = self.fetch("/health")
+        self.assertEqual(resp.code, 503)
+        self.assertEqual(json.loads(resp.body)["status"], "degraded")
@@ -1,12 +1,17 @@
 
+import gzip
+import io
+import tempfile
 import unittest
 import mock
 
-from tornado.testing import AsyncHTTPSTestCase
+from tornado import gen
+from tornado.testing import AsyncHTTPSTestCase, AsyncHTTPTestCase
 from tornado.web import Application
 from tornado.web import URLSpec as url
 
-from arteria.web.handlers import BaseRestHandler
+from arteria.web.handlers import BaseRestHandler, StreamingBodyHandler
+from arteria.web.encoding import set_json_encoder, json_dumps
 import json
 
 
@@ -47,3 +52,95 @@ class TestHandlersSerialization(unittest.TestCase):
 class SerializeMe:
     pass
 
+
+
+class StreamingHandler(BaseRestHandler):
+    @gen.coroutine
+    def get(self):
+        yield self.write_stream(({"index": i} for i in range(250)), key="samples",
+                                batch_size=100)
+
+
+class TestStreamingResponses(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return Application([url(r"/samples", StreamingHandler)], compress_response=True)
+
+    def test_can_stream_generator(self):
+        resp = self.fetch("/samples")
+        self.assertEqual(resp.code, 200)
+        samples = json.loads(resp.body)["samples"]
+        self.assertEqual(samples, [{"index": i} for i in range(250)])
+
+    def test_response_is_gzipped_when_accepted(self):
+        resp = self.fetch("/samples", headers={"Accept-Encoding": "gzip"}, decompress_response=False)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        body = json.loads(gzip.GzipFile(fileobj=io.BytesIO(resp.body)).read().decode("utf-8"))
+        self.assertEqual(len(body["samples"]), 250)
+
+
+class TestJsonEncoding(unittest.TestCase):
+
+    def tearDown(self):
+        set_json_encoder("auto")
+
+    def test_unknown_encoder_is_rejected(self):
+        self.assertRaises(ValueError, set_json_encoder, "magic")
+
+    def test_can_use_json_module(self):
+        self.assertEqual(set_json_encoder("json"), "json")
+        self.assertEqual(json.loads(json_dumps({1: "one"})), {"1": "one"})
+
+
+class SpoolingHandler(StreamingBodyHandler):
+    spool_threshold = 1024
+
+    def post(self):
+        obj = self.body_as_object(["samples"])
+        # The body can be read again, the file is kept open
+        first = self.body_as_object()["samples"][0]
+        self.write_object({"count": len(obj["samples"]), "first": first})
+
+
+class NdjsonHandler(StreamingBodyHandler):
+    body_mode = "ndjson"
+    ndjson_required_members = ["sample"]
+
+    def prepare(self):
+        super(NdjsonHandler, self).prepare()
+        self.received = []
+
+    def on_json_object(self, obj):
+        self.received.append(obj["sample"])
+
+    def post(self):
+        count = self.finish_ndjson()
+        self.write_object({"count": count, "samples": self.received})
+
+
+class TestStreamingRequestBodies(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return Application([url(r"/spool", SpoolingHandler),
+                            url(r"/ndjson", NdjsonHandler)])
+
+    def test_large_body_is_spooled_to_disk(self):
+        body = json.dumps({"samples": [u"s\u00e4mple_{0}".format(i) for i in range(1000)]},
+                          ensure_ascii=False).encode("utf-8")
+        rollover = tempfile.SpooledTemporaryFile.rollover
+        with mock.patch.object(tempfile.SpooledTemporaryFile, "rollover", autospec=True,
+                               side_effect=rollover) as rolled_over:
+            resp = self.fetch("/spool", method="POST", body=body)
+        self.assertEqual(json.loads(resp.body), {"count": 1000, "first": u"s\u00e4mple_0"})
+        self.assertTrue(rolled_over.called)
+
+    def test_required_members_are_validated(self):
+        resp = self.fetch("/spool", method="POST", body=json.dumps({"other": 1}))
+        self.assertEqual(resp.code, 400)
+        resp = self.fetch("/ndjson", method="POST", body='{"other": 1}\n')
+        self.assertEqual(resp.code, 400)
+
+    def test_ndjson_body_is_parsed_per_line(self):
+        body = "\n".join(json.dumps({"sample": i}) for i in range(100))
+        resp = self.fetch("/ndjson", method="POST", body=body)
+        self.assertEqual(json.loads(resp.body), {"count": 100, "samples": list(range(100))})
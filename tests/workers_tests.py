@@ -0,0 +1,41 @@
+import os
+import unittest
+
+from arteria.web.workers import SharedSetting
+
+
+class SharedSettingTest(unittest.TestCase):
+
+    def test_poll_returns_changes_once(self):
+        setting = SharedSetting()
+        self.assertIsNone(setting.get())
+        self.assertIsNone(setting.poll())
+
+        setting.set("DEBUG")
+        self.assertEqual(setting.get(), "DEBUG")
+        # Changes made by the process itself are not reported by poll
+        self.assertIsNone(setting.poll())
+
+    def test_change_in_forked_worker_is_seen_by_parent(self):
+        setting = SharedSetting()
+        pid = os.fork()
+        if pid == 0:
+            setting.set("DEBUG")
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(setting.poll(), "DEBUG")
+        self.assertIsNone(setting.poll())
+
+    def test_too_long_value_is_rejected(self):
+        setting = SharedSetting()
+        self.assertRaises(ValueError, setting.set, "x" * SharedSetting.MAX_LENGTH)
+
+    def test_updates_in_forked_workers_are_combined(self):
+        setting = SharedSetting()
+        for level in ("DEBUG", "INFO"):
+            pid = os.fork()
+            if pid == 0:
+                setting.update(lambda value: ",".join(filter(None, [value, level])))
+                os._exit(0)
+            os.waitpid(pid, 0)
+        self.assertEqual(setting.poll(), "DEBUG,INFO")